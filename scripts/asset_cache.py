@@ -0,0 +1,136 @@
+import os, json, time, shutil, hashlib, tempfile
+
+# A cache of generated files, stored on disk and looked up by a hash of
+# whatever was used to generate them. If nothing that affects an asteroid
+# has changed, we can copy its files out of the cache instead of running
+# the whole pipeline again.
+#
+# Each entry is a folder named after its key, holding one file per "role"
+# (like "fbx" or "normal"). When the cache gets bigger than its size limit,
+# the entries that were used least recently are thrown away. Several
+# processes can share one cache folder, since entries are written somewhere
+# else first and then moved into place in one step.
+#
+# This file doesn't use bpy, so it works outside of Blender too.
+
+# Makes a key out of a dictionary of parameters. Anything that json can
+# write is fine; tuples and lists are treated as the same thing.
+def cache_key(params):
+    text = json.dumps(params, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# Returns how many bytes the files in a folder take up
+def folder_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+class AssetCache:
+
+    # 'max_bytes' is how big the cache may get before old entries are
+    # evicted; None means it can grow forever
+    def __init__(self, directory, max_bytes=None):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    # Returns a dictionary mapping each role to a file in the cache, or
+    # None if there's nothing cached for this key
+    def lookup(self, key):
+        entry = self.entry_path(key)
+
+        try:
+            with open(os.path.join(entry, "entry.json")) as f:
+                files = json.load(f)["files"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+        # Mark the entry as recently used, so that eviction keeps it
+        try:
+            os.utime(entry)
+        except OSError:
+            return None
+
+        return dict((role, os.path.join(entry, name)) for role, name in files.items())
+
+    # Copies the cached files for 'key' to the paths in 'destinations'
+    # (a dictionary mapping roles to paths). Returns True if every file was
+    # found and copied.
+    def restore(self, key, destinations):
+        files = self.lookup(key)
+        if files is None or not set(destinations) <= set(files):
+            return False
+
+        try:
+            for role, path in destinations.items():
+                shutil.copyfile(files[role], path)
+        except OSError:
+            # Another process may have evicted the entry while we were
+            # copying it; treat that the same as not finding it
+            return False
+
+        return True
+
+    # Adds the files in 'sources' (a dictionary mapping roles to paths) to
+    # the cache under 'key', and then evicts old entries if the cache has
+    # got too big
+    def store(self, key, sources, params=None):
+        entry = self.entry_path(key)
+        if os.path.exists(entry):
+            return
+
+        # Build the entry next to where it's going to end up, so that
+        # moving it into place is a single rename
+        staging = tempfile.mkdtemp(prefix=".staging_", dir=self.directory)
+        try:
+            files = {}
+            for role, path in sources.items():
+                name = role + os.path.splitext(path)[1]
+                shutil.copyfile(path, os.path.join(staging, name))
+                files[role] = name
+
+            with open(os.path.join(staging, "entry.json"), "w") as f:
+                json.dump({"files": files, "params": params, "created": time.time()}, f, indent=2)
+
+            os.rename(staging, entry)
+        except OSError:
+            # Someone else stored the same entry first, which is fine
+            pass
+        finally:
+            if os.path.exists(staging):
+                shutil.rmtree(staging, ignore_errors=True)
+
+        self.evict()
+
+    # Deletes the least recently used entries until the cache fits inside
+    # its size limit
+    def evict(self):
+        if self.max_bytes is None:
+            return
+
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), folder_size(path), path))
+            except OSError:
+                pass
+
+        total = sum(size for used, size, path in entries)
+
+        # Oldest first
+        for used, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
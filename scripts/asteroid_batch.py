@@ -0,0 +1,279 @@
+import bpy, os, sys, argparse, json, time, random, traceback
+
+# Blender doesn't add the folder that a --python script lives in to the
+# module search path, so add it ourselves so that we can import the
+# pipeline from asteroid_complete.py.
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from util import *
+import asteroid_complete
+from asteroid_complete import asteroid_settings, asteroid_paths, save_atlas
+from atlas import TextureAtlas
+from asset_cache import AssetCache, cache_key
+from profiling import Profiler
+from metaball_sampler import sample_metaball_elements, split_by_asteroid
+from image_io import background_writer
+
+# Generates lots of asteroids in a single Blender process, so that we only
+# pay for starting Blender and loading the .blend file once. Run it like
+# this:
+#
+#   blender -b "GCAP 2018.blend" --python scripts/asteroid_batch.py -- --count 100
+#
+# Everything after the '--' is read by this script, not by Blender.
+#
+# Each asteroid's seed comes from the batch's master seed and the
+# asteroid's index, so running the same indices with the same --seed
+# always regenerates the same asteroids, no matter how the work is split up.
+
+# Works out what a given asteroid in the batch should be called
+def asteroid_name(prefix, index):
+    return "%s_%04d" % (prefix, index)
+
+# Works out what the atlas that starts with a given asteroid should be
+# called
+def atlas_name(prefix, index):
+    return "%s_Atlas_%04d" % (prefix, index)
+
+# Reads this script's arguments. Blender leaves its own arguments in
+# sys.argv, so we only look at the ones that come after '--'.
+def parse_args(argv=None):
+    if argv is None:
+        argv = sys.argv
+        argv = argv[argv.index("--") + 1:] if "--" in argv else []
+
+    parser = argparse.ArgumentParser(
+        prog="asteroid_batch.py",
+        description="Generate a batch of asteroids in one Blender process.")
+    parser.add_argument("--count", type=int, default=10,
+        help="how many asteroids to generate")
+    parser.add_argument("--start", type=int, default=0,
+        help="the index of the first asteroid in the batch")
+    parser.add_argument("--output", default="//Procgen/Assets/Asteroids/",
+        help="the folder to write asteroids into (// is the .blend's folder)")
+    parser.add_argument("--prefix", default="Asteroid",
+        help="what to start each asteroid's file names with")
+    parser.add_argument("--seed", type=int,
+        help="the master seed for the batch (default: pick one at random)")
+    parser.add_argument("--sampler", choices=("python", "numpy"), default="python",
+        help="how to choose the metaball elements (numpy picks the whole batch at once)")
+    parser.add_argument("--cache",
+        help="a folder to cache generated asteroids (and the meshes made along the way) in, and reuse them from")
+    parser.add_argument("--cache-size", type=float, default=1024,
+        help="how many megabytes the cache may use before old entries are evicted")
+    parser.add_argument("--profile",
+        help="a JSON-lines file to append a timing report for each asteroid to")
+    parser.add_argument("--manifest",
+        help="a JSON file to write the results of the batch into")
+    parser.add_argument("--async-writes", action="store_true",
+        help="save textures on a background thread while the next asteroid is made")
+    parser.add_argument("--texture-format", choices=("png", "dds"), default="png",
+        help="save textures as PNGs, or as block-compressed DDS files with mipmaps")
+    parser.add_argument("--uv-packing", choices=("none", "skyline"), default="none",
+        help="repack the UV islands tightly before baking")
+    parser.add_argument("--bake-mode", choices=("separate", "combined"), default="separate",
+        help="bake each texture on its own, or all of them in one pass (unlit textures get one sample)")
+    parser.add_argument("--lod-ratios", type=float, nargs="+", default=[],
+        help="also export levels of detail keeping these fractions of the low-poly triangles (like 0.5 0.25 0.125)")
+    parser.add_argument("--progressive", action="store_true",
+        help="bake smaller textures for asteroids that look the same with them")
+    parser.add_argument("--bake-config",
+        help="a JSON file of bake settings from bake_tune.py (Blender's --threads still wins over its thread count)")
+    parser.add_argument("--atlas", type=int, default=0,
+        help="bake this many asteroids at a time into one shared set of textures (0 to give each its own)")
+    parser.add_argument("--atlas-size", type=int, default=2048,
+        help="how many pixels across each atlas is")
+
+    return parser.parse_args(argv)
+
+# Settings that only change how fast an asteroid is made, not the files
+# that come out, so they're left out of its cache key. (A tuned bake config
+# on one machine can then reuse asteroids cached on another.)
+UNCACHED_SETTINGS = ("bake_threads", "bake_tile_size", "async_writes")
+
+# Generates an asteroid, unless an identical one is already in the cache,
+# in which case its files are copied out of the cache instead. Returns True
+# if the cache was used.
+def make_asteroid_cached(cache, directory, name, seed, settings=None, elements=None, report=None):
+    settings = asteroid_settings(settings)
+    paths = dict((role, bpy.path.abspath(path)) for role, path in asteroid_paths(directory, name, settings).items())
+
+    # Everything that can change the files that the pipeline produces. The
+    # name is included because it ends up inside the FBX.
+    params = {
+        "name": name,
+        "seed": seed,
+        "settings": dict((k, v) for k, v in settings.items() if k not in UNCACHED_SETTINGS),
+        "blender": list(bpy.app.version),
+    }
+    key = cache_key(params)
+
+    if cache.restore(key, paths):
+        return True
+
+    # Reuse whatever meshes from earlier stages are still valid
+    reset()
+    asteroid_complete.make_asteroid(directory, name, seed, settings, stage_cache=cache, elements=elements, report=report)
+
+    # The textures have to be on disk before they can be cached
+    failures = background_writer.wait()
+    if failures:
+        raise IOError("Couldn't save %s: %s" % failures[0])
+
+    cache.store(key, paths, params)
+    return False
+
+# Generates 'count' asteroids, numbered from 'start', into 'directory'.
+# Returns a list describing how each asteroid went; an asteroid that fails
+# doesn't stop the rest of the batch. If a cache is provided, asteroids
+# that have been generated before are reused from it. If a profiler is
+# provided, each asteroid's report is appended to 'profile_path'.
+#
+# If 'atlas_count' is more than zero, the asteroids are baked that many at
+# a time into shared atlases 'atlas_size' pixels across (see atlas.py),
+# instead of each getting its own textures. Whole asteroids aren't cached
+# in this mode, since their textures are part of an atlas, but the meshes
+# made along the way still are.
+def run_batch(count, start=0, directory="//Procgen/Assets/Asteroids/", prefix="Asteroid", master_seed=0,
+        cache=None, settings=None, profiler=None, profile_path=None, atlas_count=0, atlas_size=2048):
+
+    settings = asteroid_settings(settings)
+
+    # The pipeline builds file names by adding them on to the folder
+    if not directory.endswith("/"):
+        directory += "/"
+
+    # Make sure the output folder exists, since the bakes and the FBX
+    # exporter won't create it for us
+    os.makedirs(bpy.path.abspath(directory), exist_ok=True)
+
+    results = []
+    seeds = [derive_seed(master_seed, index) for index in range(start, start + count)]
+
+    # With the NumPy sampler, choose every asteroid's metaball elements in
+    # one go
+    batch_elements = [None] * count
+    if settings["sampler"] == "numpy":
+        batch_elements = split_by_asteroid(sample_metaball_elements([seed_bits(seed) for seed in seeds],
+            radius=settings["radius"],
+            element_range=settings["element_range"],
+            element_size_range=settings["element_size_range"],
+            negative_chance=settings["negative_chance"]), count)
+
+    atlas = None
+    roles = [role for role in asteroid_paths(directory, prefix, settings) if role != "fbx"]
+
+    for index in range(start, start + count):
+        name = asteroid_name(prefix, index)
+        print("Generating %s (%d of %d)" % (name, index - start + 1, count))
+
+        # Start a new atlas every 'atlas_count' asteroids
+        atlas_index = (index - start) % atlas_count if atlas_count > 0 else 0
+        if atlas_count > 0 and atlas_index == 0:
+            atlas = TextureAtlas(atlas_name(prefix, index), min(atlas_count, start + count - index),
+                size=atlas_size, roles=roles)
+
+        seed = seeds[index - start]
+        elements = batch_elements[index - start]
+        result = {"index": index, "name": name, "seed": seed, "ok": True}
+        if atlas is not None:
+            result["atlas"] = atlas.name
+        report = {}
+        started = time.perf_counter()
+
+        try:
+            if cache is not None and atlas is None:
+                result["cached"] = make_asteroid_cached(cache, directory, name, seed, settings, elements, report)
+            else:
+                # Erase whatever the previous asteroid left in the scene
+                reset()
+
+                # Generate, texture and export this asteroid. (Look it up
+                # in the module, so that a profiler's wrapped version is
+                # used if there is one.)
+                asteroid_complete.make_asteroid(directory, name, seed, settings, stage_cache=cache, elements=elements, report=report,
+                    atlas=atlas, atlas_index=atlas_index)
+        except Exception as e:
+            traceback.print_exc()
+            result["ok"] = False
+            result["error"] = "%s: %s" % (type(e).__name__, e)
+
+        result["seconds"] = time.perf_counter() - started
+        result.update(report)
+        results.append(result)
+
+        if profiler is not None:
+            profile = profiler.finish_asteroid(name, seed=seed, ok=result["ok"], cached=result.get("cached", False), **report)
+            if profile_path:
+                profiler.write_report(profile_path, profile)
+
+        # Save the atlas once its last asteroid is done
+        if atlas is not None and atlas_index == atlas.count - 1:
+            try:
+                save_atlas(atlas, directory, settings)
+            except Exception as e:
+                traceback.print_exc()
+                for result in results[-atlas.count:]:
+                    result["ok"] = False
+                    result["error"] = "%s: %s" % (type(e).__name__, e)
+
+    # Wait for any textures that are still being saved, and fail the
+    # asteroids they belong to if they couldn't be
+    for path, error in background_writer.wait():
+        print("Couldn't save %s: %s" % (path, error))
+        for result in results:
+            owners = [result["name"], result.get("atlas")]
+            if any(owner and os.path.basename(path).startswith(owner + "_") for owner in owners):
+                result["ok"] = False
+                result["error"] = "%s: %s" % (type(error).__name__, error)
+
+    return results
+
+# Saves the results of a batch as JSON, so that whoever started us (like
+# asteroid_farm.py) can find out what happened
+def write_manifest(path, results, master_seed):
+    with open(path, "w") as f:
+        json.dump({"master_seed": master_seed, "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # Pick a master seed if we weren't given one, and say what it was so
+    # that the batch can be regenerated later
+    master_seed = args.seed if args.seed is not None else random.randrange(2**32)
+    print("Master seed: %d" % master_seed)
+
+    cache = None
+    if args.cache:
+        cache = AssetCache(bpy.path.abspath(args.cache), int(args.cache_size * 1024 * 1024))
+
+    # Time every step of the pipeline
+    profiler = None
+    if args.profile:
+        profiler = Profiler()
+        profiler.instrument(asteroid_complete)
+
+    settings = {"sampler": args.sampler, "async_writes": args.async_writes,
+        "texture_format": args.texture_format, "uv_packing": args.uv_packing,
+        "progressive_bake": args.progressive, "lod_ratios": tuple(args.lod_ratios),
+        "bake_mode": args.bake_mode}
+
+    # Bake the way bake_tune.py found was fastest on this machine
+    if args.bake_config:
+        with open(bpy.path.abspath(args.bake_config)) as f:
+            settings.update(json.load(f)["settings"])
+
+    results = run_batch(args.count, args.start, args.output, args.prefix, master_seed, cache,
+        settings=settings,
+        profiler=profiler, profile_path=bpy.path.abspath(args.profile) if args.profile else None,
+        atlas_count=args.atlas, atlas_size=args.atlas_size)
+
+    if profiler is not None:
+        print(profiler.summary())
+
+    if args.manifest:
+        write_manifest(args.manifest, results, master_seed)
+
+    # Let the caller know if anything went wrong
+    if not all(result["ok"] for result in results):
+        sys.exit(1)
@@ -1,13 +1,34 @@
 import bpy, random, math; from mathutils import Euler
+import numpy as np
 
 from util import *
+from stage_cache import stage_keys, cached_stage
+from numpy_bake import bake_normal_map
+from metaball_sampler import sample_metaball_elements
+from polygonize import polygonize_metaball, polygonize_metaball_adaptive, polygonize_to_budget
+from image_io import write_png, background_writer
+from dds import write_dds
+from unwrap import unwrap
+from uv_pack import pack_uvs, uv_utilization
+from decimate import decimate_lods
+from displace import displace_vertices
+from mesh_buffers import shared_buffers
+from image_pool import bake_images
+from progressive import progressive_size
+from atlas import AtlasSlot
     
 def make_asteroid_metaball(
     radius=1, 
     element_range=(2,3), 
     element_size_range=(0.5,1.5), 
-    negative_chance=0.2):
+    negative_chance=0.2,
+    resolution=0.1,
+    seed=None):
     
+    # Make our own random number generator, so that the same seed always
+    # produces the same asteroid
+    rng = make_rng(seed)
+
     # Make a new metaball
     ball = bpy.data.metaballs.new("Asteroid_Ball")
 
@@ -18,31 +39,53 @@ def make_asteroid_metaball(
     bpy.context.scene.objects.link(ball_obj)
     
     # Configure the resolution of the ball
-    ball.resolution = 0.1
+    ball.resolution = resolution
     
     # Generate a random number of metaball elements
-    for i in range(random.randint(*element_range)):
+    for i in range(rng.randint(*element_range)):
 
         # Make a new element
         element = ball.elements.new()
 
         # Make it a randomly-sized ellipsoid
         element.type = 'ELLIPSOID'
-        element.size_x = random.uniform(*element_size_range)
-        element.size_y = random.uniform(*element_size_range)
-        element.size_z = random.uniform(*element_size_range) 
+        element.size_x = rng.uniform(*element_size_range)
+        element.size_y = rng.uniform(*element_size_range)
+        element.size_z = rng.uniform(*element_size_range) 
 
         # Generate a random rotation and use it
-        element.rotation = random_rotation()
+        element.rotation = random_rotation(rng)
 
         # Place it somewhere in the sphere          
-        element.co = point_inside_sphere(radius)    
+        element.co = point_inside_sphere(radius, rng)    
     
         # Maybe make it a negative shape if it's not the first element
         if i != 0:
-            element.use_negative = random.uniform(0,1) < negative_chance
+            element.use_negative = rng.uniform(0,1) < negative_chance
     
     return ball_obj
+
+# Makes an asteroid metaball out of elements that have already been chosen,
+# like the ones that metaball_sampler.py picks for a whole batch at once
+def make_metaball_from_elements(elements, resolution=0.1):
+
+    # Make a new metaball, and an object that uses it, and add it to the
+    # scene
+    ball = bpy.data.metaballs.new("Asteroid_Ball")
+    ball_obj = bpy.data.objects.new("Asteroid_Ball", ball)
+    bpy.context.scene.objects.link(ball_obj)
+
+    ball.resolution = resolution
+
+    for row in elements:
+        element = ball.elements.new()
+        element.type = 'ELLIPSOID'
+        element.size_x, element.size_y, element.size_z = (float(x) for x in row["size"])
+        element.rotation = [float(x) for x in row["rotation"]]
+        element.co = [float(x) for x in row["co"]]
+        element.use_negative = bool(row["negative"])
+
+    return ball_obj
     
     
 def make_mesh_from_metaball(mball_object, name="Asteroid"):  
@@ -66,26 +109,52 @@ def make_mesh_from_metaball(mball_object, name="Asteroid"):
 
     return ball_mesh_object
 
-def add_modifiers(obj):
+# Makes a mesh from a metaball like make_mesh_from_metaball does, but with
+# the NumPy polygonizer in polygonize.py instead of Blender's. 'elements'
+# can be the metaball's elements, if we already have them as an array. If
+# 'adaptive' is True, the field is only evaluated near the surface, which
+# makes fine resolutions much cheaper.
+def make_mesh_from_metaball_numpy(mball_object, name="Asteroid", elements=None, adaptive=False):
+    if elements is None:
+        elements = metaball_elements(mball_object)
+
+    # Build the surface at the same resolution Blender would have used
+    polygonize = polygonize_metaball_adaptive if adaptive else polygonize_metaball
+    vertices, faces = polygonize(elements, resolution=mball_object.data.resolution)
+    ball_mesh_object = mesh_object_from_arrays(name, vertices, faces)
+
+    # Remove the metaball from the scene
+    bpy.context.scene.objects.unlink(mball_object)
+
+    return ball_mesh_object
+
+def add_modifiers(obj, noise_scale=0.5, strength=0.5, weights=(2,2,2,2), subdivide=True, displacement="blender"):
     # Add a subsurface modifier so that we have more faces to work with
-    obj.modifiers.new("Subsurf", 'SUBSURF')
+    if subdivide:
+        obj.modifiers.new("Subsurf", 'SUBSURF')
+
+    if displacement == "numpy":
+        # Apply the subdivision on its own, then displace the result with
+        # NumPy instead of a modifier
+        if subdivide:
+            obj.data = obj.to_mesh(bpy.context.scene, True, 'PREVIEW')
+            obj.modifiers.clear()
+        displace_numpy(obj, noise_scale=noise_scale, strength=strength, weights=weights)
+        return
     
     # Create a texture that the displacement modifier will use
     texture = bpy.data.textures.new("Asteroid_Displacement", 'VORONOI')
     
     # Set it up with some settings that produce a nice rocky surface
-    texture.weight_1 = 2
-    texture.weight_2 = 2
-    texture.weight_3 = 2
-    texture.weight_4 = 2
-    texture.noise_scale = 0.5
+    texture.weight_1, texture.weight_2, texture.weight_3, texture.weight_4 = weights
+    texture.noise_scale = noise_scale
 
     # Add a displacement modifier to add this rough surface to the mesh
     displace = obj.modifiers.new("Displace", 'DISPLACE')    
     
     # Set up the displacement modifier
     displace.texture = texture
-    displace.strength = 0.5
+    displace.strength = strength
     
     # Generate a mesh that incorporates these modifiers, and replace our
     # mesh with it
@@ -94,6 +163,18 @@ def add_modifiers(obj):
     # Get rid of the modifiers - we don't need them anymore
     obj.modifiers.clear()
     
+# Displaces an object's mesh along its vertex normals with Voronoi noise,
+# like add_modifiers' VORONOI texture and DISPLACE modifier, but using
+# displace.py. The vertices are changed in place, rather than making a new
+# mesh with to_mesh.
+def displace_numpy(obj, noise_scale=0.5, strength=0.5, weights=(2,2,2,2), buffers=None):
+    buffers = (buffers or shared_buffers).read(obj.data)
+
+    displace_vertices(buffers.vertices, buffers.normals,
+        noise_scale=noise_scale, strength=strength, weights=weights)
+
+    buffers.write_vertices(obj.data)
+
 # Duplicates the input object, and creates a new one that has a lower
 # polycount.
 def make_lowpoly_object(hipoly_obj, decimate_ratio=0.025):
@@ -119,6 +200,43 @@ def make_lowpoly_object(hipoly_obj, decimate_ratio=0.025):
     # Return the new object that we created and added
     return lowpoly_object
 
+# Makes a low-poly asteroid with about 'target_triangles' triangles
+# straight from its metaball elements, instead of building the dense mesh
+# and then throwing most of it away with make_lowpoly_object. The metaball
+# is polygonized at whatever resolution gives the right number of
+# triangles, and then displaced by the same texture as the high-poly mesh,
+# which puts its vertices on the same rocky surface.
+def make_lowpoly_direct(elements, name="Asteroid", target_triangles=1000, noise_scale=0.5, strength=0.5, weights=(2,2,2,2), displacement="blender"):
+    vertices, faces, resolution = polygonize_to_budget(elements, target_triangles)
+
+    lowpoly_object = mesh_object_from_arrays(name + " Lowpoly", vertices, faces, smooth=False)
+
+    # Displace it, but don't subdivide it, since that's what we're avoiding
+    add_modifiers(lowpoly_object, noise_scale=noise_scale, strength=strength, weights=weights,
+        subdivide=False, displacement=displacement)
+
+    return lowpoly_object
+
+# Makes less detailed versions of the (unwrapped) low-poly object, for
+# levels of detail. 'ratios' are the fraction of the low-poly object's
+# triangles that each level keeps. The levels are made one after the other
+# by decimate.py, each carrying on from the last; they keep the low-poly
+# object's UVs, so they all use the same textures. Levels that the mesh
+# can't be simplified down to are left out, so there can be fewer levels
+# than ratios.
+def make_lod_objects(lowpoly_obj, name="Asteroid", ratios=(0.5,0.25,0.125)):
+    vertices, faces, uvs = mesh_arrays(lowpoly_obj.data)
+    smooth = len(lowpoly_obj.data.polygons) > 0 and lowpoly_obj.data.polygons[0].use_smooth
+
+    lod_objects = []
+    for level, (lod_vertices, lod_faces, lod_uvs) in enumerate(decimate_lods(vertices, faces, ratios, uvs)):
+        lod_object = mesh_object_from_arrays("%s_LOD%d" % (name, level + 1),
+            lod_vertices, lod_faces, smooth=smooth, uvs=lod_uvs)
+        lod_object.active_material = lowpoly_obj.active_material
+        lod_objects.append(lod_object)
+
+    return lod_objects
+
 # Generates a UV map for the object by using the Smart Project operation
 def uv_unwrap(obj, island_margin=0.1):
 
@@ -140,6 +258,40 @@ def uv_unwrap(obj, island_margin=0.1):
     # Return to Object mode
     bpy.ops.object.mode_set(mode='OBJECT')
 
+# Generates a UV map for the object like uv_unwrap does, but with unwrap.py
+# working on the mesh's arrays. It doesn't need Edit mode, an active object
+# or any operators, so it works anywhere.
+def uv_unwrap_numpy(obj, island_margin=0.1, angle_limit=66.0, buffers=None):
+    buffers = (buffers or shared_buffers).read(obj.data)
+
+    uvs, chart = unwrap(buffers.vertices, buffers.loop_vertices, buffers.loop_start, buffers.loop_total,
+        angle_limit=angle_limit, margin=island_margin)
+
+    buffers.write_uvs(obj.data, uvs)
+
+# Repacks the islands of the object's UV map with uv_pack.py, leaving
+# 'padding' pixels between them on a texture 'texture_size' pixels across.
+# Returns how much of the texture the islands cover (0-1).
+def pack_uv_islands(obj, texture_size=1024, padding=4, buffers=None):
+    buffers = (buffers or shared_buffers).read(obj.data)
+
+    uvs, utilization = pack_uvs(buffers.loop_vertices, buffers.loop_start, buffers.loop_total, buffers.uvs,
+        texture_size=texture_size, padding=padding)
+
+    buffers.write_uvs(obj.data, uvs)
+    return utilization
+
+# Moves the object's UV map into part of the texture: every UV is
+# multiplied by 'scale' and then has 'offset' added to it
+def transform_uvs(obj, scale, offset, buffers=None):
+    buffers = (buffers or shared_buffers).read(obj.data)
+    buffers.write_uvs(obj.data, buffers.uvs * scale + np.asarray(offset))
+
+# Returns how much of the texture the object's UV map covers (0-1)
+def uv_layout_utilization(obj, buffers=None):
+    buffers = (buffers or shared_buffers).read(obj.data)
+    return uv_utilization(buffers.uvs, buffers.loop_start, buffers.loop_total)
+
 def create_bake_material(lowpoly_obj):
     # Create a new material 
     bake_material = bpy.data.materials.new("Asteroid")
@@ -161,18 +313,55 @@ def create_bake_material(lowpoly_obj):
     
     return bake_material
 
-def prepare_for_bake():
+# Sets Blender up for baking. Cycles' performance settings are normally
+# left as the .blend has them, but can be chosen here instead (bake_tune.py
+# finds the best ones for a machine):
+#
+# - 'threads': how many threads to bake with
+# - 'tile_size': the size of the tiles that Cycles splits the image into
+#   and hands out to its threads
+# - 'samples': how many samples to take per texel. Bakes that ignore the
+#   lighting (normals and diffuse colour) give the same answer every
+#   sample, so one is all they need.
+#
+# Zero leaves a setting alone. 'fast' turns off denoising and light
+# bounces, which none of our bakes use but which Cycles still pays for.
+def prepare_for_bake(threads=0, tile_size=0, samples=0, fast=False):
+    scene = bpy.context.scene
+
     # Set up our renderer
-    bpy.context.scene.render.engine = 'CYCLES'
-    bpy.context.scene.render.bake.use_selected_to_active = True
+    scene.render.engine = 'CYCLES'
+    scene.render.bake.use_selected_to_active = True
+
+    if threads > 0:
+        scene.render.threads_mode = 'FIXED'
+        scene.render.threads = threads
+
+    if tile_size > 0:
+        scene.render.tile_x = tile_size
+        scene.render.tile_y = tile_size
+
+    if samples > 0:
+        scene.cycles.samples = samples
+
+    if fast:
+        scene.cycles.max_bounces = 0
+        for layer in scene.render.layers:
+            layer.cycles.use_denoising = False
 
-    # Tell Blender we want to export images as PNGs
-    bpy.context.scene.render.image_settings.file_format='PNG'
+    # Always use the same noise pattern, so that baking the same asteroid
+    # twice gives exactly the same image
+    scene.cycles.seed = 0
+    scene.cycles.use_animated_seed = False
+
+    # Tell Blender we want to export images as PNGs (DDS files are written
+    # by save_bake itself)
+    scene.render.image_settings.file_format='PNG'
     
 
 # Bakes the normals from hipoly_obj into an image, using lowpoly_obj's UV
 # map.
-def bake_normals(hipoly_obj, lowpoly_obj, bake_material, size=(1024,1024), path="//Asteroid_nrm.png"):
+def bake_normals(hipoly_obj, lowpoly_obj, bake_material, size=(1024,1024), path="//Asteroid_nrm.png", cage_extrusion=0.1, writer=None, compression=None):
 
     # To bake the normals of an object onto another, you need the following
     # things:
@@ -200,21 +389,20 @@ def bake_normals(hipoly_obj, lowpoly_obj, bake_material, size=(1024,1024), path=
     # Make the low-poly object active
     bpy.context.scene.objects.active = lowpoly_obj
     
-    # Create an image and make the node use it
-    bake_image = bpy.data.images.new('Asteroid_Normalfile',*size)
+    # Borrow an image from the pool and make the node use it
+    bake_image = bake_images.borrow('Asteroid_Normalfile', size, "normal")
     bake_node = bake_material.node_tree.nodes["Bake Destination"]
     bake_node.image = bake_image
     
-    # Perform the bake!
-    bpy.ops.object.bake(type='NORMAL', cage_extrusion=0.1)
-    
-    # Convert the path we got into an absolute path
-    output_path = bpy.path.abspath(path)
+    # Perform the bake, and save the image to disk. The image goes back to
+    # the pool even if either fails.
+    try:
+        bpy.ops.object.bake(type='NORMAL', cage_extrusion=cage_extrusion)
+        save_bake(bake_image, path, writer, compression)
+    finally:
+        bake_images.release(bake_image)
 
-    # Save the image to disk
-    bake_image.save_render(output_path, bpy.context.scene)
-
-def bake_diffuse(hipoly_obj, lowpoly_obj, source_material, bake_material, size=(1024,1024), path="//Asteroid_dif.png"):
+def bake_diffuse(hipoly_obj, lowpoly_obj, source_material, bake_material, size=(1024,1024), path="//Asteroid_dif.png", cage_extrusion=0.1, writer=None, compression=None):
 
     # Ensure that both objects are selected
     hipoly_obj.select = True
@@ -226,8 +414,8 @@ def bake_diffuse(hipoly_obj, lowpoly_obj, source_material, bake_material, size=(
     # Make the high-poly object use the material
     hipoly_obj.active_material = source_material
 
-    # Create a new image to store our baked diffuse texture
-    bake_image = bpy.data.images.new('Asteroid_Diffuse',*size)
+    # Borrow an image to store our baked diffuse texture
+    bake_image = bake_images.borrow('Asteroid_Diffuse', size, "diffuse")
 
     # Find the bake destination node in the bake material and make it
     # use the texture
@@ -235,23 +423,188 @@ def bake_diffuse(hipoly_obj, lowpoly_obj, source_material, bake_material, size=(
     bake_node.image = bake_image
 
     # Perform the bake! This time, bake the albedo; set the pass to COLOR to
-    # make the bake ignore all lighting.
-    bpy.ops.object.bake(type='DIFFUSE', pass_filter=set(['COLOR']), cage_extrusion=0.1)
-    
-    # Convert the path we got into an absolute path
+    # make the bake ignore all lighting. Then save the image to disk, and
+    # give it back to the pool whether or not that worked.
+    try:
+        bpy.ops.object.bake(type='DIFFUSE', pass_filter=set(['COLOR']), cage_extrusion=cage_extrusion)
+        save_bake(bake_image, path, writer, compression)
+    finally:
+        bake_images.release(bake_image)
+
+# Saves a baked image to 'path'. If there's a writer (an
+# image_io.BackgroundWriter), the pixels are copied out and it encodes and
+# saves them on another thread, so we don't have to wait for it.
+#
+# 'compression' is a (format, kind) pair from texture_compression, or None
+# to save a PNG.
+def save_bake(bake_image, path, writer=None, compression=None):
     output_path = bpy.path.abspath(path)
 
+    if compression is not None:
+        save_pixels(image_pixels(bake_image), output_path, writer, compression)
+    elif writer is None:
+        bake_image.save_render(output_path, bpy.context.scene)
+    else:
+        writer.submit(output_path, image_pixels(bake_image)[:, :, :3])
+
+# Saves an array of pixels (bottom row first) as a PNG, or as a DDS if
+# there's a 'compression', using a writer if there is one
+def save_pixels(pixels, output_path, writer=None, compression=None):
+    if compression is None:
+        write, options = write_png, {}
+    else:
+        write, options = write_dds, {"format": compression[0], "kind": compression[1]}
+
+    if writer is None:
+        write(output_path, pixels, **options)
+    else:
+        writer.submit(output_path, pixels, write=write, **options)
+
+# The block compression format and mip filtering ("color", "normal" or
+# "data"; see dds.mip_chain) for each texture, or None for each texture if
+# they're saved as PNGs
+def texture_compression(settings):
+    if settings["texture_format"] != "dds":
+        return {"normal": None, "diffuse": None, "ao": None}
+    return {
+        "normal": ("bc5", "normal"),
+        "diffuse": (settings["diffuse_compression"], "color"),
+        "ao": ("bc4", "data"),
+    }
+
+# Reads the meshes that a normal map is baked from into the arrays that
+# numpy_bake.py works on. Returns (low_vertices, low_faces, low_uvs,
+# high_vertices, high_faces, options), where 'options' holds the normals to
+# pass along as keyword arguments.
+def normal_bake_arrays(hipoly_obj, lowpoly_obj, buffers=None):
+    buffers = buffers or shared_buffers
+
+    # The low-poly mesh's own normals decide what "flat" is in the normal
+    # map, so use its real shading normals. (These are all copies, so
+    # reading the high-poly mesh into the same buffers doesn't touch them.)
+    buffers.read(lowpoly_obj.data)
+    low_vertices, low_faces, low_uvs = buffers.triangles()
+    low_normals = buffers.read_loop_normals(lowpoly_obj.data)[buffers.triangle_loops()[0]]
+
+    buffers.read(hipoly_obj.data)
+    high_vertices, high_faces, high_uvs = buffers.triangles()
+
+    # Smooth-shaded high-poly meshes should bake smooth normals
+    high_normals = None
+    if buffers.use_smooth.any():
+        high_normals = buffers.normals.copy()
+
+    return (low_vertices, low_faces, low_uvs, high_vertices, high_faces,
+        {"low_normals": low_normals, "high_normals": high_normals})
+
+# Bakes the normals from hipoly_obj into an image, like bake_normals, but
+# using the NumPy baker in numpy_bake.py instead of Cycles. It casts one ray
+# per texel rather than path tracing, which is all a normal map needs.
+def bake_normals_numpy(hipoly_obj, lowpoly_obj, size=(1024,1024), path="//Asteroid_nrm.png", cage_extrusion=0.1, writer=None, compression=None):
+
+    # Read both meshes into arrays
+    low_vertices, low_faces, low_uvs, high_vertices, high_faces, normals = normal_bake_arrays(hipoly_obj, lowpoly_obj)
+
+    # Perform the bake!
+    image = bake_normal_map(low_vertices, low_faces, low_uvs, high_vertices, high_faces,
+        size=size, cage_extrusion=cage_extrusion, **normals)
+
     # Save the image to disk
-    bake_image.save_render(output_path, bpy.context.scene)
+    save_pixels(image, bpy.path.abspath(path), writer, compression)
+
+# Decides how big an asteroid's textures need to be, with progressive.py.
+# If its normal map baked at "progressive_scale" times the full size is
+# within "progressive_tolerance" degrees of the real thing, every texture
+# is baked at that scale instead. Returns the settings to bake with.
+def progressive_bake_settings(hipoly_obj, lowpoly_obj, settings):
+    def scaled(size):
+        scale = settings["progressive_scale"]
+        return (max(1, int(size[0] * scale)), max(1, int(size[1] * scale)))
+
+    size = settings["normal_size"]
+    start_size = scaled(size)
+
+    low_vertices, low_faces, low_uvs, high_vertices, high_faces, normals = normal_bake_arrays(hipoly_obj, lowpoly_obj)
+    chosen, error = progressive_size(low_vertices, low_faces, low_uvs, high_vertices, high_faces,
+        size=size, start_size=start_size, tolerance=settings["progressive_tolerance"],
+        cage_extrusion=settings["cage_extrusion"], **normals)
+
+    print("%s: a %dx%d normal map is off by %.2f degrees; baking at %dx%d" % (
+        lowpoly_obj.name, start_size[0], start_size[1], error, chosen[0], chosen[1]))
+
+    if chosen == size:
+        return settings
+
+    return dict(settings, normal_size=start_size,
+        diffuse_size=scaled(settings["diffuse_size"]), ao_size=scaled(settings["ao_size"]))
+
+# The textures that bake_combined can make, and how Cycles bakes each of
+# them. Passes that aren't 'lit' don't depend on the lighting, so every
+# sample gives the same answer and one sample is all they need.
+BAKE_PASSES = {
+    "normal": {"image": 'Asteroid_Normalfile', "type": 'NORMAL', "pass_filter": set(), "lit": False},
+    "diffuse": {"image": 'Asteroid_Diffuse', "type": 'DIFFUSE', "pass_filter": set(['COLOR']), "lit": False},
+    "ao": {"image": 'Asteroid_AO', "type": 'AO', "pass_filter": set(), "lit": True},
+}
+
+# Bakes several textures from hipoly_obj in one go. 'paths' says which
+# textures to make and where to save them (for example, {"normal": ...,
+# "diffuse": ...}), and 'sizes' says how big each one should be.
+#
+# This does the same work as bake_normals followed by bake_diffuse, but it
+# only sets up the objects and materials once, and it bakes the passes
+# that ignore lighting with a single sample instead of however many the
+# scene asks for, which is where most of the time goes.
+def bake_combined(hipoly_obj, lowpoly_obj, source_material, bake_material, paths, sizes=None, cage_extrusion=0.1, lit_samples=16, writer=None, compressions=None):
+    scene = bpy.context.scene
+    sizes = sizes or {}
+    compressions = compressions or {}
+
+    # Ensure that both objects are selected, and make the low-poly object
+    # active
+    hipoly_obj.select = True
+    lowpoly_obj.select = True
+    scene.objects.active = lowpoly_obj
+
+    # The diffuse pass reads the colour from the high-poly object's material;
+    # the other passes don't mind which material it has
+    hipoly_obj.active_material = source_material
+
+    bake_node = bake_material.node_tree.nodes["Bake Destination"]
+
+    # Remember the scene's sample count, so we can put it back afterwards
+    scene_samples = scene.cycles.samples
+
+    try:
+        for role in ("normal", "diffuse", "ao"):
+            if role not in paths:
+                continue
+            bake_pass = BAKE_PASSES[role]
+
+            scene.cycles.samples = lit_samples if bake_pass["lit"] else 1
+
+            # Borrow an image for this pass and make the node use it
+            bake_image = bake_images.borrow(bake_pass["image"], sizes.get(role, (1024,1024)), role)
+            bake_node.image = bake_image
+
+            try:
+                bpy.ops.object.bake(type=bake_pass["type"], pass_filter=bake_pass["pass_filter"], cage_extrusion=cage_extrusion)
+                save_bake(bake_image, paths[role], writer, compressions.get(role))
+            finally:
+                bake_images.release(bake_image)
+    finally:
+        scene.cycles.samples = scene_samples
 
 # Exports the specified object to an FBX file
-def export_fbx(object_to_export, path="//Asteroid.fbx"):
+def export_fbx(object_to_export, path="//Asteroid.fbx", lod_objects=()):
 
     # De-select all objects
     select_all(False)
     
-    # Select the one we want to export
+    # Select the one we want to export, and its levels of detail
     object_to_export.select = True
+    for lod_object in lod_objects:
+        lod_object.select = True
     
     # Convert the path to an absolute one
     output_path = bpy.path.abspath(path)
@@ -259,40 +612,414 @@ def export_fbx(object_to_export, path="//Asteroid.fbx"):
     # Export the selected object as an FBX file
     bpy.ops.export_scene.fbx(filepath=output_path, use_selection=True)
 
-# Erase the scene
-reset()
+# Bakes all of an asteroid's textures from its high-poly object onto its
+# low-poly one, and saves them to the paths in 'paths'. If there's a
+# 'writer', the textures are handed to it instead of the one that the
+# settings ask for (see atlas.AtlasSlot). Returns the size that the normal
+# map was baked at, which is smaller than the settings ask for if a
+# progressive bake decided it could be.
+def bake_asteroid(hipoly_obj, lowpoly_obj, paths, settings, writer=None):
+
+    # Create a material for baking textures with
+    bake_material = create_bake_material(lowpoly_obj)
+
+    # Prepare Blender for baking by setting the render engine and some other settings
+    prepare_for_bake(
+        threads=settings["bake_threads"],
+        tile_size=settings["bake_tile_size"],
+        samples=settings["bake_samples"],
+        fast=settings["bake_fast"])
+
+    # Locate the pre-prepared asteroid material
+    source_material = bpy.data.materials["Asteroid Source"]
+
+    # Bake smaller textures if they'd look the same. (make_asteroid works
+    # this out itself before packing the UVs, and turns this off.)
+    if settings["progressive_bake"]:
+        settings = progressive_bake_settings(hipoly_obj, lowpoly_obj, settings)
+
+    # Save the textures in the background, if we've been asked to
+    if writer is None and settings["async_writes"]:
+        writer = background_writer
+
+    # How to compress each texture, if they're DDS files
+    compressions = texture_compression(settings)
+
+    # Bake the normal map with NumPy instead of Cycles, if we've been
+    # asked to
+    if settings["normal_backend"] == "numpy":
+        bake_normals_numpy(hipoly_obj, lowpoly_obj,
+            size=settings["normal_size"], path=paths["normal"],
+            cage_extrusion=settings["cage_extrusion"], writer=writer,
+            compression=compressions["normal"])
+        paths = dict((role, path) for role, path in paths.items() if role != "normal")
+
+    if settings["bake_mode"] == "combined":
+        # Generate all of the textures from the high-poly object in one go
+        bake_combined(hipoly_obj, lowpoly_obj, source_material, bake_material,
+            dict((role, paths[role]) for role in BAKE_PASSES if role in paths),
+            sizes={
+                "normal": settings["normal_size"],
+                "diffuse": settings["diffuse_size"],
+                "ao": settings["ao_size"],
+            },
+            cage_extrusion=settings["cage_extrusion"],
+            lit_samples=settings["ao_samples"], writer=writer,
+            compressions=compressions)
+    else:
+        # Generate a normal map from the high-poly object and save it
+        if "normal" in paths:
+            bake_normals(hipoly_obj, lowpoly_obj, bake_material,
+                size=settings["normal_size"], path=paths["normal"],
+                cage_extrusion=settings["cage_extrusion"], writer=writer,
+                compression=compressions["normal"])
+
+        # Generate a diffuse map from the high-poly object 
+        bake_diffuse(hipoly_obj, lowpoly_obj, source_material, bake_material,
+            size=settings["diffuse_size"], path=paths["diffuse"],
+            cage_extrusion=settings["cage_extrusion"], writer=writer,
+            compression=compressions["diffuse"])
+
+        # There's no separate function for the ambient occlusion map, so
+        # bake it as a combined bake with nothing else in it
+        if "ao" in paths:
+            bake_combined(hipoly_obj, lowpoly_obj, source_material, bake_material,
+                {"ao": paths["ao"]}, sizes={"ao": settings["ao_size"]},
+                cage_extrusion=settings["cage_extrusion"],
+                lit_samples=settings["ao_samples"], writer=writer,
+                compressions=compressions)
+
+    return settings["normal_size"]
+
+# The settings that control what an asteroid looks like. make_asteroid
+# takes a dictionary like this one; anything that it leaves out is taken
+# from here.
+DEFAULT_SETTINGS = {
+    # make_asteroid_metaball
+    "radius": 1,
+    "element_range": (2,3),
+    "element_size_range": (0.5,1.5),
+    "negative_chance": 0.2,
+    "resolution": 0.1,
+
+    # Which random number generator picks the metaball elements: "python"
+    # (make_asteroid_metaball) or "numpy" (metaball_sampler.py). They make
+    # different asteroids from the same seed.
+    "sampler": "python",
+
+    # What turns the metaball into a mesh: "blender", "numpy"
+    # (polygonize.py), or "adaptive" (polygonize.py, only evaluating the
+    # field near the surface)
+    "polygonizer": "blender",
+
+    # add_modifiers. "displacement" is either "blender" (a DISPLACE
+    # modifier) or "numpy" (displace_numpy); they use different Voronoi
+    # patterns, so they make different rocks.
+    "noise_scale": 0.5,
+    "strength": 0.5,
+    "weights": (2,2,2,2),
+    "displacement": "blender",
+
+    # make_lowpoly_object and uv_unwrap. "lowpoly_mode" is either
+    # "decimate" (make_lowpoly_object, using "decimate_ratio") or "direct"
+    # (make_lowpoly_direct, using "target_triangles").
+    "lowpoly_mode": "decimate",
+    "decimate_ratio": 0.025,
+    "target_triangles": 1000,
+    "island_margin": 0.1,
+
+    # What makes the UV map: "smart_project" (uv_unwrap) or "numpy"
+    # (uv_unwrap_numpy)
+    "unwrapper": "smart_project",
+
+    # How the UV islands are arranged: "none" leaves them where the
+    # unwrapper put them, and "skyline" repacks them tightly
+    # (pack_uv_islands), with "uv_padding" pixels between them
+    "uv_packing": "none",
+    "uv_padding": 4,
+
+    # make_lod_objects: the fraction of the low-poly object's triangles
+    # that LOD1, LOD2 and so on keep, like (0.5,0.25,0.125). Leave it empty
+    # to only export the low-poly object, under its usual name.
+    "lod_ratios": (),
+
+    # bake_normals and bake_diffuse, or bake_combined. "bake_mode" is
+    # either "separate" or "combined" (which bakes the unlit textures with
+    # one sample); "normal_backend" is either "cycles" or "numpy" (see
+    # bake_normals_numpy).
+    "bake_mode": "separate",
+    "normal_backend": "cycles",
+    "normal_size": (1024,1024),
+    "diffuse_size": (1024,1024),
+    "cage_extrusion": 0.1,
+
+    # prepare_for_bake: how Cycles bakes. Zero leaves a setting as the
+    # .blend has it. "bake_samples" only matters for separate bakes, since
+    # combined bakes choose their own sample counts.
+    "bake_threads": 0,
+    "bake_tile_size": 0,
+    "bake_samples": 0,
+    "bake_fast": False,
+
+    # Bake every texture at "progressive_scale" times its size instead, if
+    # the normal map would be within "progressive_tolerance" degrees of the
+    # full size one (see progressive_bake_settings)
+    "progressive_bake": False,
+    "progressive_scale": 0.25,
+    "progressive_tolerance": 2.0,
+
+    # An ambient occlusion map
+    "bake_ao": False,
+    "ao_size": (1024,1024),
+    "ao_samples": 16,
+
+    # Save baked textures on a background thread (image_io.background_writer)
+    # instead of waiting for them. Call background_writer.wait() before
+    # relying on the files being there.
+    "async_writes": False,
+
+    # What to save textures as: "png", or "dds" for block-compressed
+    # textures with mip chains (dds.py). DDS normal maps are BC5 and AO maps
+    # are BC4; "diffuse_compression" is either "bc1" or "bc7".
+    "texture_format": "png",
+    "diffuse_compression": "bc7",
+}
+
+# Returns the material that every asteroid in an atlas shares. It's only
+# there to give the asteroids' FBX files the same material name, so that
+# whatever imports them can point that material at the atlas textures.
+def atlas_material(atlas):
+    material = bpy.data.materials.get(atlas.name)
+    if material is None:
+        material = bpy.data.materials.new(atlas.name)
+    return material
+
+# Saves an atlas's textures next to the asteroids in 'directory', named
+# after the atlas, like asteroid_paths names an asteroid's textures
+def save_atlas(atlas, directory, settings=None):
+    settings = asteroid_settings(settings)
+    paths = asteroid_paths(directory, atlas.name, settings)
+    writer = background_writer if settings["async_writes"] else None
+    compressions = texture_compression(settings)
+
+    for role, pixels in atlas.images.items():
+        save_pixels(pixels, bpy.path.abspath(paths[role]), writer, compressions[role])
+
+    return dict((role, paths[role]) for role in atlas.images)
+
+# Fills in any settings that weren't provided with their defaults
+def asteroid_settings(settings=None):
+    result = dict(DEFAULT_SETTINGS)
+    result.update(settings or {})
+    return result
+
+# Works out where each of an asteroid's files will be written
+def asteroid_paths(directory, name, settings=None):
+    extension = '.png'
+    if settings is not None and settings.get("texture_format") == "dds":
+        extension = '.dds'
+
+    paths = {
+        "normal": directory + name + '_Nrm' + extension,
+        "diffuse": directory + name + '_Dif' + extension,
+        "fbx": directory + name + '.fbx',
+    }
+    if settings is not None and settings.get("bake_ao"):
+        paths["ao"] = directory + name + '_AO' + extension
+    return paths
+
+# Generates, textures and exports a single asteroid. The textures and the
+# FBX are written into 'directory', and are named after 'name'. The same
+# seed and settings always produce the same asteroid; without a seed, a
+# random one is picked.
+#
+# If 'stage_cache' is an AssetCache (and there's a seed), the meshes made
+# along the way are cached, and any that are still valid are reused instead
+# of being built again.
+#
+# With the "numpy" sampler, 'elements' can be this asteroid's elements from
+# sample_metaball_elements, if they've already been chosen as part of a
+# batch.
+#
+# If 'report' is a dictionary, facts about the asteroid that are worth
+# keeping track of (like "uv_utilization") are added to it.
+#
+# If 'atlas' is an atlas.TextureAtlas, the asteroid's textures are baked
+# into cell 'atlas_index' of it rather than saved, and its UVs and material
+# are changed to match. Save the atlas (save_atlas) once every asteroid in
+# it has been made.
+def make_asteroid(directory='//Procgen/Assets/', name='Asteroid', seed=None, settings=None, stage_cache=None, elements=None, report=None, atlas=None, atlas_index=0):
+    settings = asteroid_settings(settings)
+
+    # Textures in an atlas are baked at the size of a cell
+    if atlas is not None:
+        cell_size = (atlas.cell, atlas.cell)
+        settings.update(normal_size=cell_size, diffuse_size=cell_size, ao_size=cell_size)
+
+    paths = asteroid_paths(directory, name, settings)
+
+    # Only a given integer seed makes the same asteroid every time, so
+    # nothing else can be cached (see stage_keys)
+    keys = stage_keys(seed, settings) if stage_cache is not None else None
+
+    # Pick a concrete seed if we weren't given one (or were given a random
+    # number generator), since the metaball can be built more than once
+    # (for the low-poly and high-poly meshes) and every build has to make
+    # the same rock
+    if not isinstance(seed, int):
+        seed = make_rng(seed).getrandbits(64)
+
+    # Generates asteroid shapes. Returns the metaball object, and its
+    # elements if they were chosen by the NumPy sampler.
+    def build_metaball():
+        if settings["sampler"] == "numpy":
+            sampled_elements = elements
+            if sampled_elements is None:
+                sampled_elements = sample_metaball_elements([seed_bits(seed)],
+                    radius=settings["radius"],
+                    element_range=settings["element_range"],
+                    element_size_range=settings["element_size_range"],
+                    negative_chance=settings["negative_chance"])
+            return make_metaball_from_elements(sampled_elements, resolution=settings["resolution"]), sampled_elements
+
+        asteroid_metaball = make_asteroid_metaball(
+            radius=settings["radius"],
+            element_range=settings["element_range"],
+            element_size_range=settings["element_size_range"],
+            negative_chance=settings["negative_chance"],
+            resolution=settings["resolution"],
+            seed=seed)
+        return asteroid_metaball, None
+
+    def build_highpoly():
+        asteroid_metaball, sampled_elements = build_metaball()
+
+        # Make a mesh from those shapes
+        if settings["polygonizer"] in ("numpy", "adaptive"):
+            asteroid_highpoly = make_mesh_from_metaball_numpy(asteroid_metaball, name=name,
+                elements=sampled_elements, adaptive=settings["polygonizer"] == "adaptive")
+        else:
+            asteroid_highpoly = make_mesh_from_metaball(asteroid_metaball, name=name)
+
+        # Add modifiers to make the shape look like rock
+        add_modifiers(asteroid_highpoly,
+            noise_scale=settings["noise_scale"],
+            strength=settings["strength"],
+            weights=settings["weights"],
+            displacement=settings["displacement"])
+
+        return asteroid_highpoly
+
+    # The high-poly mesh is only built when something needs it; in "direct"
+    # low-poly mode, that's just the bakes
+    asteroid_highpoly = None
+
+    def highpoly():
+        nonlocal asteroid_highpoly
+        if asteroid_highpoly is None:
+            asteroid_highpoly = cached_stage(stage_cache, keys, "highpoly", name, build_highpoly)
+        return asteroid_highpoly
+
+    def build_lowpoly():
+        if settings["lowpoly_mode"] == "direct":
+            # Make the low-poly mesh straight from the metaball
+            asteroid_metaball, sampled_elements = build_metaball()
+            if sampled_elements is None:
+                sampled_elements = metaball_elements(asteroid_metaball)
+            bpy.context.scene.objects.unlink(asteroid_metaball)
+
+            return make_lowpoly_direct(sampled_elements, name,
+                target_triangles=settings["target_triangles"],
+                noise_scale=settings["noise_scale"],
+                strength=settings["strength"],
+                weights=settings["weights"],
+                displacement=settings["displacement"])
+
+        # Make a low-poly version of the rock mesh
+        return make_lowpoly_object(highpoly(), decimate_ratio=settings["decimate_ratio"])
+
+    def build_unwrapped():
+        asteroid_lowpoly = cached_stage(stage_cache, keys, "lowpoly", name + " Lowpoly", build_lowpoly)
+
+        # Unwrap the low-poly object so we can create a texture
+        if settings["unwrapper"] == "numpy":
+            uv_unwrap_numpy(asteroid_lowpoly, island_margin=settings["island_margin"])
+        else:
+            uv_unwrap(asteroid_lowpoly, island_margin=settings["island_margin"])
+
+        return asteroid_lowpoly
+
+    # If the unwrapped mesh is cached, we don't need to make the low-poly
+    # mesh at all
+    asteroid_lowpoly = cached_stage(stage_cache, keys, "unwrapped", name + " Lowpoly", build_unwrapped)
+
+    # Pack the UV islands tightly for the textures they'll be baked into.
+    # This depends on the texture sizes, so it isn't cached with the
+    # unwrapped mesh.
+    def pack(settings):
+        if settings["uv_packing"] != "skyline":
+            return uv_layout_utilization(asteroid_lowpoly)
+        texture_size = min(settings["normal_size"][0], settings["diffuse_size"][0])
+        return pack_uv_islands(asteroid_lowpoly, texture_size=texture_size, padding=settings["uv_padding"])
 
-# Generate asteroid shapes
-asteroid_metaball = make_asteroid_metaball()
+    utilization = pack(settings)
 
-# Make a mesh from those shapes
-asteroid_highpoly = make_mesh_from_metaball(asteroid_metaball)
+    # Work out whether smaller textures would do, here rather than in
+    # bake_asteroid, so that the islands can be packed again with padding
+    # that's the right number of pixels at the smaller size
+    bake_settings = settings
+    if settings["progressive_bake"]:
+        bake_settings = progressive_bake_settings(highpoly(), asteroid_lowpoly, settings)
+        if bake_settings["normal_size"] != settings["normal_size"]:
+            utilization = pack(bake_settings)
+        bake_settings = dict(bake_settings, progressive_bake=False)
 
-# Add modifiers to make the shape look like rock
-add_modifiers(asteroid_highpoly)
+    print("%s: UV islands cover %.1f%% of the texture" % (name, 100.0 * utilization))
+    if report is not None:
+        report["uv_utilization"] = utilization
 
-# Make a low-poly version of the rock mesh
-asteroid_lowpoly = make_lowpoly_object(asteroid_highpoly)
+    # Bake the textures and save them
+    if atlas is None:
+        bake_size = bake_asteroid(highpoly(), asteroid_lowpoly, paths, bake_settings)
+    else:
+        # Bake into the atlas, then move the UVs into this asteroid's cell
+        # (before the levels of detail are made, so they get the same UVs)
+        bake_size = bake_asteroid(highpoly(), asteroid_lowpoly, paths, bake_settings,
+            writer=AtlasSlot(atlas, atlas_index, dict((role, bpy.path.abspath(path)) for role, path in paths.items())))
 
-# Unwrap the low-poly object so we can create a texture
-uv_unwrap(asteroid_lowpoly)
+        scale, offset = atlas.uv_transform(atlas_index)
+        transform_uvs(asteroid_lowpoly, scale, offset)
+        asteroid_lowpoly.active_material = atlas_material(atlas)
 
-# Create a material for baking textures with
-bake_material = create_bake_material(asteroid_lowpoly)
+        if report is not None:
+            report["atlas"] = atlas.name
+            report["atlas_rect"] = [offset[0], offset[1], scale, scale]
 
-# Prepare Blender for baking by setting the render engine and some other settings
-prepare_for_bake()
+    if report is not None:
+        report["bake_size"] = list(bake_size)
 
-# Generate a normal map from the high-poly object and save it
-bake_normals(asteroid_highpoly, asteroid_lowpoly, bake_material, path='//Procgen/Assets/Asteroid_Nrm.png')
+    # Make the levels of detail, if there are any. They're named the way
+    # Unity expects, so it makes an LOD group out of them when it imports
+    # the FBX; without them, the low-poly object keeps its usual name.
+    lod_objects = []
+    if settings["lod_ratios"]:
+        lod_objects = make_lod_objects(asteroid_lowpoly, name, ratios=settings["lod_ratios"])
+    if lod_objects:
+        asteroid_lowpoly.name = name + "_LOD0"
 
-# Locate the pre-prepared asteroid material
-source_material = bpy.data.materials["Asteroid Source"]
+    # Export the low-poly object (and its levels of detail) as an FBX
+    export_fbx(asteroid_lowpoly, path=paths["fbx"], lod_objects=lod_objects)
 
-# Generate a diffuse map from the high-poly object 
-bake_diffuse(asteroid_highpoly, asteroid_lowpoly, source_material, bake_material, path='//Procgen/Assets/Asteroid_Dif.png')
+# Only run the pipeline when this file is run as a script, so that other
+# scripts (like asteroid_batch.py) can import the functions above.
+if __name__ == "__main__":
 
-# Export the low-poly object as an FBX
-export_fbx(asteroid_lowpoly, path='//Procgen/Assets/Asteroid.fbx')
+    # Erase the scene
+    reset()
 
+    # Generate, texture and export the asteroid
+    make_asteroid()
 
+    # Make sure every texture has been saved
+    for path, error in background_writer.wait():
+        print("Couldn't save %s: %s" % (path, error))
@@ -0,0 +1,165 @@
+import os, sys, json, time, random, argparse, subprocess, tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Generates asteroids in parallel, by splitting a range of asteroids into
+# shards and running each shard through asteroid_batch.py in its own
+# Blender process. This script doesn't need Blender's Python - run it with
+# a normal Python 3:
+#
+#   python3 scripts/asteroid_farm.py --count 1000 --workers 16
+#
+# Each Blender process only gets its share of the machine's cores, so the
+# workers don't fight each other for CPU time during the bakes.
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BATCH_SCRIPT = os.path.join(SCRIPTS_DIR, "asteroid_batch.py")
+DEFAULT_BLEND = os.path.join(os.path.dirname(SCRIPTS_DIR), "GCAP 2018.blend")
+
+# Splits 'count' asteroids starting at 'start' into at most 'shards'
+# contiguous (start, count) pairs of as close to equal size as possible
+def make_shards(start, count, shards):
+    shards = max(1, min(shards, count))
+    size, extra = divmod(count, shards)
+
+    result = []
+    for i in range(shards):
+        shard_count = size + (1 if i < extra else 0)
+        result.append((start, shard_count))
+        start += shard_count
+    return result
+
+# Runs one shard in its own Blender process, and returns the results that
+# asteroid_batch.py reported for it
+def run_shard(shard, master_seed, blender, blend_file, threads, extra_args, work_dir):
+    start, count = shard
+    manifest = os.path.join(work_dir, "shard_%d.json" % start)
+    log_path = os.path.join(work_dir, "shard_%d.log" % start)
+
+    command = [
+        blender, "-b", blend_file,
+        "--threads", str(threads),
+        "--python", BATCH_SCRIPT,
+        "--",
+        "--start", str(start),
+        "--count", str(count),
+        "--seed", str(master_seed),
+        "--manifest", manifest,
+    ] + list(extra_args)
+
+    # Don't mistake a manifest left behind by an earlier run in the same
+    # work folder for this one's
+    if os.path.exists(manifest):
+        os.remove(manifest)
+
+    def shard_failed(error):
+        return [{"index": index, "ok": False, "error": error}
+            for index in range(start, start + count)]
+
+    # If Blender can't be started at all (like a bad --blender path), say
+    # so in the log and fail this shard, rather than the whole farm
+    with open(log_path, "w") as log:
+        try:
+            process = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT)
+        except OSError as e:
+            log.write("Couldn't start %s: %s\n" % (blender, e))
+            return shard_failed("Couldn't start Blender: %s: %s (see %s)" % (type(e).__name__, e, log_path))
+
+    exit_error = "Blender exited with code %d before finishing (see %s)" % (process.returncode, log_path)
+
+    # asteroid_batch.py exits with 1 if some of its asteroids failed, and
+    # says which ones in the manifest. Any other exit code, or no manifest,
+    # means Blender fell over, so count every asteroid in the shard as a
+    # failure.
+    if process.returncode not in (0, 1) or not os.path.exists(manifest):
+        return shard_failed(exit_error)
+
+    with open(manifest) as f:
+        results = json.load(f)["results"]
+
+    if process.returncode != 0 and all(result["ok"] for result in results):
+        return shard_failed(exit_error)
+    return results
+
+# Generates 'count' asteroids, starting at 'start', across 'workers'
+# Blender processes. Every shard uses the same master seed, so the results
+# don't depend on how many workers there were. Returns the combined
+# results of every shard.
+def run_farm(start, count, workers, master_seed, blender="blender", blend_file=DEFAULT_BLEND,
+        threads=None, extra_args=(), work_dir=None):
+
+    # Divide the machine's cores between the workers
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix="asteroid_farm_")
+    os.makedirs(work_dir, exist_ok=True)
+
+    shards = make_shards(start, count, workers)
+
+    # The real work happens in the Blender processes, so threads are all we
+    # need to wait on them
+    results = []
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [executor.submit(run_shard, shard, master_seed, blender, blend_file, threads, extra_args, work_dir)
+            for shard in shards]
+        for future in futures:
+            results.extend(future.result())
+
+    return results
+
+# Prints how the farm did
+def report(results, seconds):
+    succeeded = [r for r in results if r["ok"]]
+    failed = [r for r in results if not r["ok"]]
+
+    print("Generated %d asteroids in %.1fs (%.2f asteroids/s, %.2fs each)" % (
+        len(succeeded), seconds,
+        len(succeeded) / seconds if seconds > 0 else 0,
+        seconds / len(succeeded) if succeeded else 0))
+
+    if failed:
+        print("%d asteroids failed:" % len(failed))
+        for result in failed:
+            print("  %d: %s" % (result["index"], result.get("error", "unknown error")))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate asteroids across several Blender processes.")
+    parser.add_argument("--count", type=int, default=100,
+        help="how many asteroids to generate")
+    parser.add_argument("--start", type=int, default=0,
+        help="the index of the first asteroid")
+    parser.add_argument("--seed", type=int,
+        help="the master seed for every shard (default: pick one at random)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+        help="how many Blender processes to run at once")
+    parser.add_argument("--threads", type=int,
+        help="how many threads each Blender process may use (default: cores / workers)")
+    parser.add_argument("--blender", default="blender",
+        help="the Blender executable to run")
+    parser.add_argument("--blend", default=DEFAULT_BLEND,
+        help="the .blend file to generate asteroids with")
+    parser.add_argument("--work-dir",
+        help="where to keep each worker's log and manifest")
+    parser.add_argument("batch_args", nargs=argparse.REMAINDER,
+        help="extra arguments to pass to asteroid_batch.py, after a '--'")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    extra_args = args.batch_args
+    if extra_args and extra_args[0] == "--":
+        extra_args = extra_args[1:]
+
+    master_seed = args.seed if args.seed is not None else random.randrange(2**32)
+    print("Master seed: %d" % master_seed)
+
+    started = time.perf_counter()
+    results = run_farm(args.start, args.count, args.workers, master_seed, args.blender, args.blend,
+        args.threads, extra_args, args.work_dir)
+    report(results, time.perf_counter() - started)
+
+    if not all(result["ok"] for result in results):
+        sys.exit(1)
@@ -0,0 +1,71 @@
+import math
+import numpy as np
+
+from progressive import upsample
+
+# Bakes several asteroids into one shared set of textures, so a whole
+# batch can be drawn with one material. The atlas is a grid of square
+# cells, one per asteroid. Each asteroid is baked as usual, at the size of
+# a cell, and its textures are copied into its cell instead of being saved;
+# its UVs are then squeezed into the cell so that they match.
+#
+# Images are (height, width, channels) arrays with the bottom row first,
+# like Blender's, so cell 0 is in the bottom left corner, the same as UV
+# (0, 0).
+#
+# The smaller mips of a DDS atlas blur neighbouring cells into each other,
+# the same as they do neighbouring UV islands; the padding around each
+# asteroid's islands keeps that out of the mips that get used up close.
+
+class TextureAtlas:
+
+    # 'name' is what the atlas's textures and material are called
+    def __init__(self, name, count, size=2048, roles=("normal", "diffuse")):
+        self.name = name
+        self.count = count
+        self.size = size
+        self.columns = int(math.ceil(math.sqrt(count)))
+        self.cell = size // self.columns
+
+        self.images = {}
+        for role in roles:
+            image = np.zeros((size, size, 4), dtype=np.float32)
+            image[:, :, 3] = 1.0
+            self.images[role] = image
+
+    # The corner of a cell, in pixels from the bottom left
+    def cell_corner(self, index):
+        return (index % self.columns) * self.cell, (index // self.columns) * self.cell
+
+    # How to move UVs from the whole 0-1 square into a cell: multiply by
+    # 'scale' and add 'offset'
+    def uv_transform(self, index):
+        x, y = self.cell_corner(index)
+        return float(self.cell) / self.size, (float(x) / self.size, float(y) / self.size)
+
+    # Copies an image into a cell of the atlas. Images that were baked
+    # smaller than a cell (by a progressive bake) are stretched to fit.
+    def add(self, role, index, pixels):
+        pixels = np.asarray(pixels)
+        if pixels.dtype == np.uint8:
+            pixels = pixels / 255.0
+        if pixels.shape[:2] != (self.cell, self.cell):
+            pixels = upsample(pixels, (self.cell, self.cell))
+
+        x, y = self.cell_corner(index)
+        channels = min(pixels.shape[2], 4)
+        self.images[role][y:y + self.cell, x:x + self.cell, :channels] = pixels[:self.cell, :self.cell, :channels]
+
+# Stands in for an image_io.BackgroundWriter while an asteroid is baked,
+# so that the bake functions "save" each texture into the asteroid's cell
+# of the atlas instead of into a file. 'paths' are the asteroid's texture
+# paths, by role, which is how we tell its textures apart.
+class AtlasSlot:
+
+    def __init__(self, atlas, index, paths):
+        self.atlas = atlas
+        self.index = index
+        self.roles = dict((path, role) for role, path in paths.items())
+
+    def submit(self, path, pixels, write=None, **options):
+        self.atlas.add(self.roles[path], self.index, pixels)
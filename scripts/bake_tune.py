@@ -0,0 +1,139 @@
+import bpy, os, sys, json, time, argparse, platform, tempfile
+
+# Blender doesn't add the folder that a --python script lives in to the
+# module search path, so add it ourselves
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from util import *
+from asteroid_complete import *
+
+# Finds the fastest way for Cycles to bake on this machine. Run it once on
+# each kind of render node, like this:
+#
+#   blender -b "GCAP 2018.blend" --python scripts/bake_tune.py -- --output bake_config.json
+#
+# It makes one asteroid, then bakes it over and over with different thread
+# counts and tile sizes, and writes the fastest settings to a JSON file.
+# Pass that file to asteroid_batch.py with --bake-config to use them.
+#
+# Every candidate uses prepare_for_bake's fast path. The .blend's own
+# settings are timed too, so you can see what the tuning bought.
+
+# The tile sizes to try
+TILE_SIZES = (16, 32, 64, 128, 256)
+
+# The thread counts to try on a machine with 'cores' cores: all of them,
+# one spare for Blender's main thread, and half (in case they're
+# hyperthreads)
+def thread_counts(cores):
+    return sorted(set(count for count in (cores, cores - 1, cores // 2) if count > 0), reverse=True)
+
+# Makes the asteroid that every candidate bakes
+def make_test_asteroid(seed, settings):
+    reset()
+
+    metaball = make_asteroid_metaball(
+        radius=settings["radius"],
+        element_range=settings["element_range"],
+        element_size_range=settings["element_size_range"],
+        negative_chance=settings["negative_chance"],
+        resolution=settings["resolution"],
+        seed=seed)
+
+    highpoly = make_mesh_from_metaball(metaball, name="BakeTune")
+    add_modifiers(highpoly,
+        noise_scale=settings["noise_scale"],
+        strength=settings["strength"],
+        weights=settings["weights"])
+
+    lowpoly = make_lowpoly_object(highpoly, decimate_ratio=settings["decimate_ratio"])
+    uv_unwrap(lowpoly, island_margin=settings["island_margin"])
+
+    return highpoly, lowpoly
+
+# Bakes the asteroid 'repeats' times with the given settings, and returns
+# the fastest time
+def time_bake(highpoly, lowpoly, paths, settings, repeats):
+    best = None
+    for repeat in range(repeats):
+        started = time.perf_counter()
+        bake_asteroid(highpoly, lowpoly, paths, settings)
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+# Times every candidate. Returns the best settings and a list of every
+# timing, slowest first.
+def tune(bake_size=1024, repeats=2, seed=1, cores=None):
+    cores = cores or os.cpu_count() or 1
+    directory = tempfile.mkdtemp(prefix="asteroid_bake_tune_") + "/"
+
+    settings = asteroid_settings({
+        "normal_size": (bake_size, bake_size),
+        "diffuse_size": (bake_size, bake_size),
+    })
+    paths = asteroid_paths(directory, "BakeTune", settings)
+    highpoly, lowpoly = make_test_asteroid(seed, settings)
+
+    # Bake once first, so the first candidate doesn't pay for Cycles
+    # starting up
+    bake_asteroid(highpoly, lowpoly, paths, settings)
+
+    timings = []
+    baseline = time_bake(highpoly, lowpoly, paths, settings, repeats)
+    timings.append({"threads": 0, "tile_size": 0, "fast": False, "seconds": baseline})
+    print("The .blend's own settings: %.3fs" % baseline)
+
+    for threads in thread_counts(cores):
+        for tile_size in TILE_SIZES:
+            candidate = dict(settings, bake_threads=threads, bake_tile_size=tile_size, bake_fast=True)
+            seconds = time_bake(highpoly, lowpoly, paths, candidate, repeats)
+            timings.append({"threads": threads, "tile_size": tile_size, "fast": True, "seconds": seconds})
+            print("%d threads, %dpx tiles: %.3fs" % (threads, tile_size, seconds))
+
+    best = min(timings, key=lambda timing: timing["seconds"])
+    tuned = {
+        "bake_threads": best["threads"],
+        "bake_tile_size": best["tile_size"],
+        "bake_fast": best["fast"],
+    }
+
+    timings.sort(key=lambda timing: -timing["seconds"])
+    return tuned, timings
+
+def parse_args(argv=None):
+    if argv is None:
+        argv = sys.argv
+        argv = argv[argv.index("--") + 1:] if "--" in argv else []
+
+    parser = argparse.ArgumentParser(
+        prog="bake_tune.py",
+        description="Find the fastest Cycles bake settings for this machine.")
+    parser.add_argument("--output", default="//bake_config.json",
+        help="the JSON file to write the best settings to (// is the .blend's folder)")
+    parser.add_argument("--size", type=int, default=1024,
+        help="how many pixels across the test bakes are")
+    parser.add_argument("--repeats", type=int, default=2,
+        help="how many times to bake with each candidate (the fastest counts)")
+    parser.add_argument("--cores", type=int,
+        help="how many cores to tune for (default: all of this machine's)")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    settings, timings = tune(args.size, args.repeats, cores=args.cores)
+    print("Fastest: %d threads, %dpx tiles (%.3fs, down from %.3fs)" % (
+        settings["bake_threads"], settings["bake_tile_size"], timings[-1]["seconds"],
+        next(timing["seconds"] for timing in timings if not timing["fast"])))
+
+    with open(bpy.path.abspath(args.output), "w") as f:
+        json.dump({
+            "time": time.time(),
+            "blender": bpy.app.version_string,
+            "host": platform.node(),
+            "cores": args.cores or os.cpu_count(),
+            "size": args.size,
+            "settings": settings,
+            "timings": timings,
+        }, f, indent=2)
@@ -0,0 +1,236 @@
+import bpy, os, sys, json, time, argparse, platform, tempfile
+
+# Blender doesn't add the folder that a --python script lives in to the
+# module search path, so add it ourselves
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from util import *
+from asteroid_complete import *
+
+# Times the asteroid pipeline, so that we can tell whether a Blender
+# upgrade or a change to the settings made it slower. Run it like this:
+#
+#   blender -b "GCAP 2018.blend" --python scripts/benchmark.py
+#
+# Each case generates the same fixed seeds at a given metaball resolution
+# and bake size, timing every step along the way. The steps run in order,
+# so the time to reach a stage (metaball only, +mesh, +modifiers, and so
+# on) is the sum of the steps up to it.
+#
+# Every run is appended to a history file. Each stage is compared with the
+# median of the last few runs on the same machine (the same host, CPU count
+# and Blender version, or the Blender version given with --baseline-blender
+# when checking an upgrade). If it got slower by more than the threshold,
+# it's reported as a regression and the script exits with an error.
+
+# The steps of the pipeline, in order
+STAGES = ("metaball", "mesh", "modifiers", "decimate", "unwrap", "bakes", "export")
+
+# The seeds that every case generates
+SEEDS = (1, 2, 3)
+
+# (metaball resolution, bake size) pairs to benchmark
+CASES = (
+    (0.2, 256),
+    (0.1, 512),
+    (0.1, 1024),
+    (0.05, 1024),
+)
+
+# Generates one asteroid, and returns how long each step took
+def time_pipeline(seed, resolution, bake_size, directory, bake_mode="separate"):
+    settings = asteroid_settings({
+        "resolution": resolution,
+        "normal_size": (bake_size, bake_size),
+        "diffuse_size": (bake_size, bake_size),
+        "bake_mode": bake_mode,
+    })
+    paths = asteroid_paths(directory, "Benchmark", settings)
+    timings = {}
+
+    def step(stage, func, *args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings[stage] = time.perf_counter() - started
+        return result
+
+    reset()
+
+    metaball = step("metaball", make_asteroid_metaball,
+        radius=settings["radius"],
+        element_range=settings["element_range"],
+        element_size_range=settings["element_size_range"],
+        negative_chance=settings["negative_chance"],
+        resolution=settings["resolution"],
+        seed=seed)
+
+    highpoly = step("mesh", make_mesh_from_metaball, metaball, name="Benchmark")
+
+    step("modifiers", add_modifiers, highpoly,
+        noise_scale=settings["noise_scale"],
+        strength=settings["strength"],
+        weights=settings["weights"])
+
+    lowpoly = step("decimate", make_lowpoly_object, highpoly, decimate_ratio=settings["decimate_ratio"])
+
+    step("unwrap", uv_unwrap, lowpoly, island_margin=settings["island_margin"])
+
+    step("bakes", bake_asteroid, highpoly, lowpoly, paths, settings)
+
+    step("export", export_fbx, lowpoly, path=paths["fbx"])
+
+    return timings
+
+# Runs every case, and returns a dictionary mapping each case's name to the
+# mean time of each of its stages
+def run_benchmarks(cases=CASES, seeds=SEEDS, repeats=1, bake_mode="separate"):
+    directory = tempfile.mkdtemp(prefix="asteroid_benchmark_") + "/"
+    results = {}
+
+    for resolution, bake_size in cases:
+        # Combined bakes are different cases, so they're never compared
+        # with separate ones
+        case = "res=%g bake=%d" % (resolution, bake_size)
+        if bake_mode != "separate":
+            case += " " + bake_mode
+        print("Benchmarking %s" % case)
+
+        totals = dict((stage, 0.0) for stage in STAGES)
+        runs = 0
+        for repeat in range(repeats):
+            for seed in seeds:
+                for stage, seconds in time_pipeline(seed, resolution, bake_size, directory, bake_mode).items():
+                    totals[stage] += seconds
+                runs += 1
+
+        results[case] = dict((stage, totals[stage] / runs) for stage in STAGES)
+
+    return results
+
+# Loads every previous run from the history file
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# Adds a run to the end of the history file
+def append_history(path, record):
+    with open(path, "a") as f:
+        f.write(json.dumps(record, sort_keys=True) + "\n")
+
+# Works out what to compare a run against: for each case and stage, the
+# median time of the last 'window' runs on the same host, with the same
+# number of CPUs and the same version of Blender. Runs that were slower
+# than their own baseline are left out (unless they were accepted with
+# --accept), so a slowdown can't become the new normal just by being
+# recorded. Returns None if there aren't any runs to compare against.
+def baseline_results(history, host, cpus, blender, window=5):
+    runs = [run for run in history
+        if run.get("host") == host and run.get("cpus") == cpus and run.get("blender") == blender
+        and (not run.get("regressed") or run.get("accepted"))]
+    runs = runs[-window:]
+    if not runs:
+        return None
+
+    baseline = {}
+    for case in set(case for run in runs for case in run["results"]):
+        stages = set(stage for run in runs for stage in run["results"].get(case, {}))
+        baseline[case] = {}
+        for stage in stages:
+            times = sorted(run["results"][case][stage] for run in runs if stage in run["results"].get(case, {}))
+            middle = len(times) // 2
+            baseline[case][stage] = times[middle] if len(times) % 2 else 0.5 * (times[middle - 1] + times[middle])
+    return baseline
+
+# Compares a run against a baseline run. Returns a list of (case, stage,
+# baseline seconds, new seconds) for every stage that got slower by more
+# than 'threshold' (0.1 means 10%). Stages that take less than 'min_seconds'
+# are ignored, since they're mostly noise.
+def find_regressions(results, baseline, threshold=0.1, min_seconds=0.01):
+    regressions = []
+    for case, stages in results.items():
+        if case not in baseline:
+            continue
+        for stage, seconds in stages.items():
+            before = baseline[case].get(stage)
+            if before is None or before < min_seconds:
+                continue
+            if seconds > before * (1 + threshold):
+                regressions.append((case, stage, before, seconds))
+    return regressions
+
+# Prints a run as a table of cumulative times, one row per case
+def print_results(results):
+    print("%-20s" % "case" + "".join("%11s" % ("+" + stage if i else stage) for i, stage in enumerate(STAGES)))
+    for case in sorted(results):
+        cumulative = 0.0
+        row = "%-20s" % case
+        for stage in STAGES:
+            cumulative += results[case][stage]
+            row += "%11.3f" % cumulative
+        print(row)
+
+def parse_args(argv=None):
+    if argv is None:
+        argv = sys.argv
+        argv = argv[argv.index("--") + 1:] if "--" in argv else []
+
+    parser = argparse.ArgumentParser(
+        prog="benchmark.py",
+        description="Time the asteroid pipeline and check for regressions.")
+    parser.add_argument("--history", default="//benchmark_history.jsonl",
+        help="the file that results are recorded in (// is the .blend's folder)")
+    parser.add_argument("--threshold", type=float, default=0.1,
+        help="how much slower a stage can get before it's a regression (0.1 = 10%%)")
+    parser.add_argument("--repeats", type=int, default=1,
+        help="how many times to run each seed")
+    parser.add_argument("--no-record", action="store_true",
+        help="compare against the history, but don't add this run to it")
+    parser.add_argument("--window", type=int, default=5,
+        help="how many earlier runs from this machine the baseline is the median of")
+    parser.add_argument("--baseline-blender",
+        help="compare against runs from this version of Blender (default: the one running)")
+    parser.add_argument("--bake-mode", choices=("separate", "combined"), default="separate",
+        help="which way to bake the textures")
+    parser.add_argument("--accept", action="store_true",
+        help="record this run as part of the baseline even if it's slower (for intended slowdowns)")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    history_path = bpy.path.abspath(args.history)
+
+    results = run_benchmarks(repeats=args.repeats, bake_mode=args.bake_mode)
+    print_results(results)
+
+    # Compare against earlier runs on this machine
+    host, cpus, blender = platform.node(), os.cpu_count(), bpy.app.version_string
+    baseline = baseline_results(load_history(history_path), host, cpus,
+        args.baseline_blender or blender, args.window)
+    regressions = []
+    if baseline is None:
+        print("No earlier runs from this machine to compare against.")
+    else:
+        regressions = find_regressions(results, baseline, args.threshold)
+        for case, stage, before, after in regressions:
+            print("REGRESSION: %s %s took %.3fs, up from %.3fs (%+.0f%%)" % (
+                case, stage, after, before, 100.0 * (after / before - 1)))
+        if not regressions:
+            print("No regressions against the baseline.")
+
+    if not args.no_record:
+        append_history(history_path, {
+            "time": time.time(),
+            "blender": blender,
+            "host": host,
+            "cpus": cpus,
+            "regressed": bool(regressions),
+            "accepted": args.accept,
+            "repeats": args.repeats,
+            "seeds": list(SEEDS),
+            "results": results,
+        })
+
+    if regressions and not args.accept:
+        sys.exit(1)
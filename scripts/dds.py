@@ -0,0 +1,317 @@
+import struct
+import numpy as np
+
+from image_io import to_bytes
+
+# Writes block-compressed DDS textures, with their mip chains, out of
+# NumPy arrays, so a game engine can load them straight onto the GPU
+# without recompressing PNGs first. The formats are:
+#
+# - "bc1": RGB at 4 bits per pixel (DXT1)
+# - "bc4": one channel at 4 bits per pixel (ATI1)
+# - "bc5": two channels at 8 bits per pixel (ATI2), for normal maps; only
+#   X and Y are kept, and Z is rebuilt from them when the map is sampled
+# - "bc7": RGBA at 8 bits per pixel, using mode 6 for every block
+#
+# The encoders go for speed over the last bit of quality: each block's
+# endpoints are the ends of the line that best fits its colours (found by
+# a few rounds of power iteration), and each pixel gets the nearest colour
+# on that line.
+#
+# Images are arrays of shape (height, width, channels) with values from 0
+# to 1, like image_io's. A mip chain is built by averaging 2x2 squares:
+# colour maps are averaged in linear space, and normal maps are
+# renormalised at every level.
+#
+# Colour maps are marked as sRGB, so the GPU converts them to linear when
+# it samples them. The old FourCC codes can't say that, so colour maps
+# always get a DX10 header; everything else is UNORM, with a FourCC where
+# there is one.
+
+# DDS header flags
+DDSD_CAPS, DDSD_HEIGHT, DDSD_WIDTH, DDSD_PIXELFORMAT = 0x1, 0x2, 0x4, 0x1000
+DDSD_MIPMAPCOUNT, DDSD_LINEARSIZE = 0x20000, 0x80000
+DDPF_FOURCC = 0x4
+DDSCAPS_COMPLEX, DDSCAPS_TEXTURE, DDSCAPS_MIPMAP = 0x8, 0x1000, 0x400000
+
+# The FourCC code (None if there isn't one), DXGI format, sRGB DXGI format
+# (None if there isn't one) and bytes per 4x4 block of each format
+DDS_FORMATS = {
+    "bc1": (b"DXT1", 71, 72, 8),     # DXGI_FORMAT_BC1_UNORM(_SRGB)
+    "bc4": (b"ATI1", 80, None, 8),   # DXGI_FORMAT_BC4_UNORM
+    "bc5": (b"ATI2", 83, None, 16),  # DXGI_FORMAT_BC5_UNORM
+    "bc7": (None, 98, 99, 16),       # DXGI_FORMAT_BC7_UNORM(_SRGB)
+}
+
+# BC7's 4-bit interpolation weights, out of 64
+BC7_WEIGHTS = np.array([0, 4, 9, 13, 17, 21, 26, 30, 34, 38, 43, 47, 51, 55, 60, 64])
+
+def srgb_to_linear(c):
+    return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+
+def linear_to_srgb(c):
+    c = np.maximum(c, 0.0)
+    return np.where(c <= 0.0031308, c * 12.92, 1.055 * c ** (1 / 2.4) - 0.055)
+
+# Halves an image's size by averaging 2x2 squares (or pairs, once one side
+# is down to a single pixel)
+def downsample(pixels):
+    height, width = pixels.shape[:2]
+    if height > 1:
+        pixels = 0.5 * (pixels[0:height // 2 * 2:2] + pixels[1:height // 2 * 2:2])
+    if width > 1:
+        pixels = 0.5 * (pixels[:, 0:width // 2 * 2:2] + pixels[:, 1:width // 2 * 2:2])
+    return pixels
+
+# Returns a list of images, from full size down to 1x1. 'kind' is "color"
+# (sRGB colours), "normal" (a tangent-space normal map) or "data"
+# (anything else, averaged as it is).
+def mip_chain(pixels, kind="color"):
+    pixels = np.asarray(pixels, dtype=np.float64)
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, None]
+
+    # Convert to a space where averaging makes sense...
+    work = pixels.copy()
+    if kind == "color":
+        work[..., :3] = srgb_to_linear(work[..., :3])
+    elif kind == "normal":
+        work[..., :3] = work[..., :3] * 2 - 1
+
+    levels = [pixels]
+    while max(work.shape[:2]) > 1:
+        work = downsample(work)
+        level = work.copy()
+
+        # ...and back again
+        if kind == "color":
+            level[..., :3] = linear_to_srgb(level[..., :3])
+        elif kind == "normal":
+            normals = work[..., :3]
+            normals /= np.maximum(np.sqrt((normals ** 2).sum(axis=-1, keepdims=True)), 1e-12)
+            level[..., :3] = normals * 0.5 + 0.5
+
+        levels.append(level)
+
+    return levels
+
+# Splits an image into 4x4 blocks, padding the edges by repeating the
+# last row and column. Returns an array of shape (blocks, 16, channels),
+# with the blocks in rows from the top left, and the pixels of each block
+# in rows too.
+def to_blocks(pixels):
+    height, width, channels = pixels.shape
+    padded_height = (height + 3) // 4 * 4
+    padded_width = (width + 3) // 4 * 4
+    pixels = np.pad(pixels, ((0, padded_height - height), (0, padded_width - width), (0, 0)), mode="edge")
+
+    blocks = pixels.reshape(padded_height // 4, 4, padded_width // 4, 4, channels)
+    return blocks.transpose(0, 2, 1, 3, 4).reshape(-1, 16, channels)
+
+# Finds the ends of the line through each block's colours that fits them
+# best. 'blocks' has shape (blocks, 16, channels); returns (low, high),
+# each of shape (blocks, channels).
+def principal_endpoints(blocks, iterations=4):
+    mean = blocks.mean(axis=1)
+    centred = blocks - mean[:, None, :]
+    covariance = np.einsum("nki,nkj->nij", centred, centred)
+
+    # Start from the diagonal of the block's bounding box
+    axis = blocks.max(axis=1) - blocks.min(axis=1) + 1e-3
+    for iteration in range(iterations):
+        axis = np.einsum("nij,nj->ni", covariance, axis)
+        axis /= np.maximum(np.sqrt((axis ** 2).sum(axis=1, keepdims=True)), 1e-12)
+
+    t = np.einsum("nki,ni->nk", centred, axis)
+    low = mean + t.min(axis=1)[:, None] * axis
+    high = mean + t.max(axis=1)[:, None] * axis
+    return np.clip(low, 0, 255), np.clip(high, 0, 255)
+
+# Returns how far along the line from 'start' to 'end' each pixel of each
+# block is, from 0 to 1
+def project(blocks, start, end):
+    direction = end - start
+    length = np.maximum((direction ** 2).sum(axis=1), 1e-12)
+    t = np.einsum("nki,ni->nk", blocks - start[:, None, :], direction) / length[:, None]
+    return np.clip(t, 0, 1)
+
+def pack_565(colours):
+    c = np.round(colours * np.array([31, 63, 31]) / 255.0).astype(np.uint16)
+    return (c[:, 0] << 11) | (c[:, 1] << 5) | c[:, 2]
+
+def unpack_565(packed):
+    packed = packed.astype(np.int64)
+    c = np.stack([(packed >> 11) & 31, (packed >> 5) & 63, packed & 31], axis=1)
+    return c * 255.0 / np.array([31, 63, 31])
+
+def encode_bc1(pixels):
+    blocks = to_blocks(to_bytes(pixels)[..., :3]).astype(np.float64)
+    low, high = principal_endpoints(blocks)
+
+    # The first colour has to be the larger one for four-colour blocks
+    colour_0, colour_1 = pack_565(high), pack_565(low)
+    swap = colour_0 < colour_1
+    colour_0[swap], colour_1[swap] = colour_1[swap], colour_0[swap].copy()
+    end_0, end_1 = unpack_565(colour_0), unpack_565(colour_1)
+
+    # Index 0 is colour 0, 1 is colour 1, and 2 and 3 are in between
+    t = np.round(project(blocks, end_0, end_1) * 3).astype(np.uint32)
+    indices = np.array([0, 2, 3, 1], dtype=np.uint32)[t]
+
+    # Blocks with one colour would be three-colour blocks, where index 3
+    # means transparent
+    indices[colour_0 == colour_1] = 0
+
+    bits = (indices << (2 * np.arange(16, dtype=np.uint32))).sum(axis=1, dtype=np.uint32)
+
+    out = np.zeros(len(blocks), dtype=[("c0", "<u2"), ("c1", "<u2"), ("bits", "<u4")])
+    out["c0"], out["c1"], out["bits"] = colour_0, colour_1, bits
+    return out.tobytes()
+
+# Returns each block of a single channel as BC4, as an array of shape
+# (blocks, 8)
+def bc4_blocks(values):
+    blocks = to_blocks(to_bytes(values)[..., None]).astype(np.int64)[:, :, 0]
+    high = blocks.max(axis=1)
+    low = blocks.min(axis=1)
+
+    # With the first value larger, there are six values in between; index
+    # 0 is the first, 1 is the second, and 2-7 step from one to the other
+    span = np.maximum(high - low, 1)
+    t = np.round((high[:, None] - blocks) * 7.0 / span[:, None]).astype(np.uint64)
+    indices = np.array([0, 2, 3, 4, 5, 6, 7, 1], dtype=np.uint64)[t]
+    indices[high == low] = 0
+
+    bits = (indices << (np.uint64(3) * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+
+    out = np.zeros((len(blocks), 8), dtype=np.uint8)
+    out[:, 0] = high
+    out[:, 1] = low
+    out[:, 2:] = bits.astype("<u8").view(np.uint8).reshape(-1, 8)[:, :6]
+    return out
+
+def encode_bc4(pixels):
+    return bc4_blocks(pixels[..., 0]).tobytes()
+
+def encode_bc5(pixels):
+    return np.concatenate([bc4_blocks(pixels[..., 0]), bc4_blocks(pixels[..., 1])], axis=1).tobytes()
+
+# Writes fields into 128-bit blocks, held as two 64-bit halves
+class BitWriter:
+
+    def __init__(self, count):
+        self.halves = np.zeros((count, 2), dtype=np.uint64)
+        self.position = 0
+
+    def write(self, values, bits):
+        values = np.asarray(values).astype(np.uint64) & np.uint64((1 << bits) - 1)
+        start = self.position
+        if start >= 64:
+            self.halves[:, 1] |= values << np.uint64(start - 64)
+        else:
+            self.halves[:, 0] |= values << np.uint64(start)
+            if start + bits > 64:
+                self.halves[:, 1] |= values >> np.uint64(64 - start)
+        self.position += bits
+
+def encode_bc7(pixels):
+    pixels = to_bytes(pixels)
+    if pixels.shape[2] < 4:
+        pixels = np.concatenate([pixels, np.full(pixels.shape[:2] + (1,), 255, dtype=np.uint8)], axis=2)
+    blocks = to_blocks(pixels).astype(np.float64)
+    low, high = principal_endpoints(blocks)
+
+    # Mode 6 endpoints have 7 bits per channel, plus one shared extra bit
+    # (the p-bit) per endpoint. Try both p-bits and keep the closer one.
+    def quantize(endpoint):
+        options = []
+        for p in (0, 1):
+            value = np.clip(np.round((endpoint - p) / 2.0), 0, 127)
+            error = (((value * 2 + p) - endpoint) ** 2).sum(axis=1)
+            options.append((value, error))
+        use_one = options[1][1] < options[0][1]
+        value = np.where(use_one[:, None], options[1][0], options[0][0]).astype(np.int64)
+        return value, use_one.astype(np.int64)
+
+    value_0, p_0 = quantize(low)
+    value_1, p_1 = quantize(high)
+    end_0 = (value_0 * 2 + p_0[:, None]).astype(np.float64)
+    end_1 = (value_1 * 2 + p_1[:, None]).astype(np.float64)
+
+    t = project(blocks, end_0, end_1) * 64
+    indices = np.abs(t[:, :, None] - BC7_WEIGHTS[None, None, :]).argmin(axis=2)
+
+    # The first pixel's index has to start with a 0 bit, since it's only
+    # stored with 3 bits; if it doesn't, swap the endpoints around
+    swap = indices[:, 0] >= 8
+    value_0[swap], value_1[swap] = value_1[swap], value_0[swap].copy()
+    p_0[swap], p_1[swap] = p_1[swap], p_0[swap].copy()
+    indices[swap] = 15 - indices[swap]
+
+    writer = BitWriter(len(blocks))
+    writer.write(np.full(len(blocks), 1 << 6), 7)
+    for channel in range(4):
+        writer.write(value_0[:, channel], 7)
+        writer.write(value_1[:, channel], 7)
+    writer.write(p_0, 1)
+    writer.write(p_1, 1)
+    writer.write(indices[:, 0], 3)
+    for pixel in range(1, 16):
+        writer.write(indices[:, pixel], 4)
+
+    return writer.halves.astype("<u8").tobytes()
+
+ENCODERS = {
+    "bc1": encode_bc1,
+    "bc4": encode_bc4,
+    "bc5": encode_bc5,
+    "bc7": encode_bc7,
+}
+
+# Encodes an image as a DDS file with a full mip chain, and returns the
+# bytes. 'kind' says how to build the mips (see mip_chain).
+def encode_dds(pixels, format="bc7", kind="color", bottom_up=True, mipmaps=True):
+    fourcc, dxgi_format, srgb_format, block_bytes = DDS_FORMATS[format]
+    encode = ENCODERS[format]
+
+    # Use a DX10 header for sRGB colour maps, and for formats without a
+    # FourCC
+    if kind == "color" and srgb_format is not None:
+        fourcc, dxgi_format = b"DX10", srgb_format
+    elif fourcc is None:
+        fourcc = b"DX10"
+    else:
+        dxgi_format = None
+
+    pixels = np.asarray(pixels)
+    if pixels.dtype == np.uint8:
+        pixels = pixels / 255.0
+    if bottom_up:
+        pixels = pixels[::-1]
+
+    levels = mip_chain(pixels, kind) if mipmaps else [np.asarray(pixels, dtype=np.float64)]
+    height, width = pixels.shape[:2]
+    top_size = ((width + 3) // 4) * ((height + 3) // 4) * block_bytes
+
+    flags = DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT | DDSD_MIPMAPCOUNT | DDSD_LINEARSIZE
+    caps = DDSCAPS_TEXTURE
+    if len(levels) > 1:
+        caps |= DDSCAPS_COMPLEX | DDSCAPS_MIPMAP
+
+    header = struct.pack("<4s7I11I2I4s5I5I", b"DDS ",
+        124, flags, height, width, top_size, 0, len(levels),
+        *([0] * 11),
+        32, DDPF_FOURCC, fourcc, 0, 0, 0, 0, 0,
+        caps, 0, 0, 0, 0)
+
+    if dxgi_format is not None:
+        # DXGI format, 2D texture, no flags, one texture, no alpha mode
+        header += struct.pack("<5I", dxgi_format, 3, 0, 1, 0)
+
+    return header + b"".join(encode(level) for level in levels)
+
+# Saves an image as a DDS file
+def write_dds(path, pixels, format="bc7", kind="color", bottom_up=True, mipmaps=True):
+    data = encode_dds(pixels, format, kind, bottom_up, mipmaps)
+    with open(path, "wb") as f:
+        f.write(data)
@@ -0,0 +1,262 @@
+import heapq, warnings
+import numpy as np
+
+# Simplifies triangle meshes using quadric error metrics (Garland and
+# Heckbert), to make levels of detail. Every vertex keeps a quadric: the
+# sum of the squared distances to the planes of the triangles around it.
+# The edge collapse that adds the least error is always done next, using a
+# priority queue.
+#
+# Collapses are half-edge collapses: one end of the edge is merged into the
+# other, which stays where it is. That means every vertex in a simplified
+# mesh is a vertex from the original, so the UVs that the original was
+# baked with still fit it, and each level of detail can carry on from the
+# previous one rather than starting from scratch.
+#
+# Vertices on the edge of a hole, and corners where three or more UV
+# islands meet, are never merged away, which keeps holes and the corners
+# of the islands in place. Other vertices on a UV seam have one UV on each
+# side of it; they can only be merged along the seam, into the next vertex
+# on it, so that both islands lose the same seam edge and their outlines
+# still match each other.
+
+# Returns the quadric of every triangle's plane, weighted by its area, as
+# an array of 4x4 matrices
+def face_quadrics(vertices, faces):
+    v0, v1, v2 = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+    normals = np.cross(v1 - v0, v2 - v0)
+    double_area = np.sqrt(np.einsum("ij,ij->i", normals, normals))
+    normals /= np.maximum(double_area, 1e-12)[:, None]
+
+    planes = np.concatenate([normals, -np.einsum("ij,ij->i", normals, v0)[:, None]], axis=1)
+    return 0.5 * double_area[:, None, None] * planes[:, :, None] * planes[:, None, :]
+
+# Returns a mask of the vertices that can't be merged away: those on an
+# edge that doesn't have exactly two triangles, and those whose corners
+# have more than two different UVs
+def locked_vertices(faces, uvs, vertex_count):
+    locked = np.zeros(vertex_count, dtype=bool)
+
+    edges = np.sort(np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]]), axis=1)
+    edges, uses = np.unique(edges, axis=0, return_counts=True)
+    locked[edges[uses != 2].ravel()] = True
+
+    if uvs is not None:
+        corners = np.concatenate([faces.reshape(-1, 1), uvs.reshape(-1, 2)], axis=1)
+        distinct = np.unique(corners, axis=0)
+        locked[np.bincount(distinct[:, 0].astype(np.int64), minlength=vertex_count) > 2] = True
+
+    return locked
+
+# Returns twice the signed area of each triangle of UVs
+def uv_area(uvs):
+    e1 = uvs[:, 1] - uvs[:, 0]
+    e2 = uvs[:, 2] - uvs[:, 0]
+    return e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0]
+
+class Decimator:
+
+    # 'uvs' has one UV per triangle corner, with shape (triangles, 3, 2),
+    # like mesh_arrays returns; it can be None
+    def __init__(self, vertices, faces, uvs=None, min_cosine=0.2):
+        self.vertices = np.asarray(vertices, dtype=np.float64)
+        faces = np.asarray(faces, dtype=np.int64)
+        self.min_cosine = min_cosine
+
+        self.faces = faces.tolist()
+        self.face_alive = np.ones(len(faces), dtype=bool)
+        self.face_count = len(faces)
+
+        self.has_uvs = uvs is not None
+        self.uvs = np.zeros(faces.shape + (2,)) if uvs is None else np.array(uvs, dtype=np.float64)
+
+        self.quadrics = np.zeros((len(self.vertices), 4, 4))
+        corner_quadrics = face_quadrics(self.vertices, faces)
+        for corner in range(3):
+            np.add.at(self.quadrics, faces[:, corner], corner_quadrics)
+
+        self.locked = locked_vertices(faces, uvs, len(self.vertices))
+
+        self.vertex_faces = [set() for vertex in range(len(self.vertices))]
+        for face, corners in enumerate(self.faces):
+            for vertex in corners:
+                self.vertex_faces[vertex].add(face)
+
+        # A vertex's version goes up every time its quadric changes; queued
+        # collapses made with an older version are out of date
+        self.version = [0] * len(self.vertices)
+        self.queue = []
+        for vertex in range(len(self.vertices)):
+            self._queue_collapses(vertex)
+
+    def _neighbours(self, vertex):
+        neighbours = set()
+        for face in self.vertex_faces[vertex]:
+            neighbours.update(self.faces[face])
+        neighbours.discard(vertex)
+        return neighbours
+
+    # Queues up merging 'vertex' into each of its neighbours, and each
+    # neighbour into it
+    def _queue_collapses(self, vertex, both_ways=False):
+        neighbours = np.array(sorted(self._neighbours(vertex)), dtype=np.int64)
+        if not len(neighbours):
+            return
+
+        # Merging u into v costs v's error under the sum of their quadrics
+        if not self.locked[vertex]:
+            points = np.concatenate([self.vertices[neighbours], np.ones((len(neighbours), 1))], axis=1)
+            quadrics = self.quadrics[vertex] + self.quadrics[neighbours]
+            costs = np.einsum("ni,nij,nj->n", points, quadrics, points)
+            for target, cost in zip(neighbours.tolist(), costs.tolist()):
+                heapq.heappush(self.queue, (cost, vertex, target, self.version[vertex], self.version[target]))
+
+        if both_ways:
+            sources = neighbours[~self.locked[neighbours]]
+            point = np.append(self.vertices[vertex], 1.0)
+            quadrics = self.quadrics[vertex] + self.quadrics[sources]
+            costs = np.einsum("i,nij,j->n", point, quadrics, point)
+            for source, cost in zip(sources.tolist(), costs.tolist()):
+                heapq.heappush(self.queue, (cost, source, vertex, self.version[source], self.version[vertex]))
+
+    # Works out where u's UVs go when it's merged into v: a dictionary from
+    # each of u's UVs to v's UV on the same side of any seam. Returns None
+    # if u is on a seam and the edge to v isn't part of that seam.
+    def _moved_uvs(self, u, v, removed):
+        uvs = set(tuple(self._uv_of(u, face)) for face in self.vertex_faces[u])
+        if len(uvs) == 1:
+            return {uvs.pop(): self._uv_of(v, removed[0])}
+
+        # u is on a seam, so the edge to v has to have a different UV for u
+        # on each side, and be one of only two seam edges at u (more than
+        # that means islands meet at u more than twice)
+        sides = dict((tuple(self._uv_of(u, face)), self._uv_of(v, face)) for face in removed)
+        if len(sides) != 2 or set(sides) != uvs:
+            return None
+
+        seam_edges = 0
+        for neighbour in self._neighbours(u):
+            shared = [face for face in self.vertex_faces[u] if neighbour in self.faces[face]]
+            if len(set(tuple(self._uv_of(u, face)) for face in shared)) > 1:
+                seam_edges += 1
+        if seam_edges != 2:
+            return None
+
+        return sides
+
+    # Checks whether merging u into v keeps the mesh manifold, keeps UV
+    # seams in place, and doesn't flip any triangles over (in 3D or in UV
+    # space). Returns the triangles that would be removed, and where u's UVs
+    # go, or None if the collapse isn't allowed.
+    def _check_collapse(self, u, v):
+        removed = [face for face in self.vertex_faces[u] if v in self.faces[face]]
+        if not removed:
+            return None
+
+        # The link condition: the only vertices next to both u and v must
+        # be the ones opposite the edge between them
+        if len(self._neighbours(u) & self._neighbours(v)) != len(removed):
+            return None
+
+        moved_uvs = self._moved_uvs(u, v, removed) if self.has_uvs else None
+        if self.has_uvs and moved_uvs is None:
+            return None
+
+        moved = [face for face in self.vertex_faces[u] if face not in removed]
+        if not moved:
+            return removed, moved_uvs
+
+        corners = np.array([self.faces[face] for face in moved])
+        before = self.vertices[corners]
+        after = before.copy()
+        after[corners == u] = self.vertices[v]
+
+        normal_before = np.cross(before[:, 1] - before[:, 0], before[:, 2] - before[:, 0])
+        normal_after = np.cross(after[:, 1] - after[:, 0], after[:, 2] - after[:, 0])
+        dot = np.einsum("ij,ij->i", normal_before, normal_after)
+        lengths = np.linalg.norm(normal_before, axis=1) * np.linalg.norm(normal_after, axis=1)
+        if np.any(lengths <= 0) or np.any(dot < self.min_cosine * lengths):
+            return None
+
+        if self.has_uvs:
+            uv_before = self.uvs[moved]
+            uv_after = uv_before.copy()
+            uv_after[corners == u] = [moved_uvs[tuple(self._uv_of(u, face))] for face in moved]
+            if np.any(uv_area(uv_before) * uv_area(uv_after) <= 0):
+                return None
+
+        return removed, moved_uvs
+
+    # The UV of a vertex at its corner of a triangle
+    def _uv_of(self, vertex, face):
+        return self.uvs[face, self.faces[face].index(vertex)]
+
+    # Merges u into v; 'moved_uvs' is where each of u's UVs goes, from
+    # _check_collapse
+    def _collapse(self, u, v, removed, moved_uvs):
+        for face in removed:
+            self.face_alive[face] = False
+            for vertex in self.faces[face]:
+                self.vertex_faces[vertex].discard(face)
+        self.face_count -= len(removed)
+
+        for face in self.vertex_faces[u]:
+            corner = self.faces[face].index(u)
+            self.faces[face][corner] = v
+            if moved_uvs is not None:
+                self.uvs[face, corner] = moved_uvs[tuple(self.uvs[face, corner])]
+            self.vertex_faces[v].add(face)
+        self.vertex_faces[u] = set()
+
+        self.quadrics[v] += self.quadrics[u]
+        self.version[u] += 1
+        self.version[v] += 1
+        self._queue_collapses(v, both_ways=True)
+
+    # Collapses edges until there are no more than 'face_count' triangles
+    # left, or nothing else can be collapsed
+    def collapse_to(self, face_count):
+        while self.face_count > face_count and self.queue:
+            cost, u, v, u_version, v_version = heapq.heappop(self.queue)
+            if self.version[u] != u_version or self.version[v] != v_version:
+                continue
+
+            allowed = self._check_collapse(u, v)
+            if allowed is not None:
+                self._collapse(u, v, *allowed)
+
+    # Returns the mesh as it is now, as (vertices, faces, uvs), with the
+    # unused vertices taken out. 'uvs' is None if the mesh didn't have any.
+    def mesh(self):
+        alive = np.flatnonzero(self.face_alive)
+        faces = np.array([self.faces[face] for face in alive], dtype=np.int64).reshape(-1, 3)
+
+        used, faces = np.unique(faces, return_inverse=True)
+        faces = faces.reshape(-1, 3)
+
+        uvs = self.uvs[alive] if self.has_uvs else None
+        return self.vertices[used], faces, uvs
+
+# Makes a chain of levels of detail from a mesh, in one go. 'ratios' are
+# the fraction of the mesh's triangles each level keeps, from most to
+# least detailed; each level carries on collapsing from the one before.
+# Returns a list of (vertices, faces, uvs), one per ratio that could be
+# reached. A level that ends up more than 'tolerance' over its target
+# (because nothing else could be collapsed) is left out, along with the
+# levels after it, rather than repeating the level before, and a warning
+# says so.
+def decimate_lods(vertices, faces, ratios, uvs=None, tolerance=0.1):
+    decimator = Decimator(vertices, faces, uvs)
+    face_count = len(faces)
+
+    lods = []
+    for ratio in sorted(ratios, reverse=True):
+        target = int(round(face_count * ratio))
+        decimator.collapse_to(target)
+        if decimator.face_count > target * (1 + tolerance):
+            warnings.warn("Couldn't simplify below %d triangles (wanted %d); skipping the last %d levels of detail" % (
+                decimator.face_count, target, len(ratios) - len(lods)))
+            break
+        lods.append(decimator.mesh())
+
+    return lods
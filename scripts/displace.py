@@ -0,0 +1,68 @@
+import numpy as np
+
+from metaball_sampler import mix64, GOLDEN_GAMMA
+
+# Displaces vertices with Voronoi (Worley) noise in NumPy, like the VORONOI
+# texture and DISPLACE modifier that add_modifiers sets up, but over the
+# whole vertex array at once and without making a new mesh.
+#
+# The noise works the same way as Blender's: space is split into unit
+# cells, each with one feature point in it, and a point's value is the
+# weighted sum of its distances to the nearest four feature points
+# (F1..F4), scaled by one over the sum of the weights. Blender places its
+# feature points with a fixed lookup table; we hash the cell coordinates
+# instead, so the pattern has the same character but isn't the same rock.
+
+# The 27 cells around (and including) a cell
+NEIGHBOUR_OFFSETS = np.array([(x, y, z)
+    for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)], dtype=np.int64)
+
+# Returns the feature point in each of an (n, 3) array of integer cells,
+# as an offset from the cell's corner between 0 and 1
+def feature_points(cells):
+    cells = cells.astype(np.uint64)
+
+    with np.errstate(over="ignore"):
+        key = mix64(cells[..., 0] * GOLDEN_GAMMA)
+        key = mix64(key ^ (cells[..., 1] + GOLDEN_GAMMA))
+        key = mix64(key ^ (cells[..., 2] + GOLDEN_GAMMA * np.uint64(2)))
+
+        # One number per axis, from different runs of the same hash
+        axes = [mix64(key + GOLDEN_GAMMA * np.uint64(axis + 1)) for axis in range(3)]
+
+    return np.stack([(a >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53)) for a in axes], axis=-1)
+
+# Returns the distances from each point to its nearest four feature
+# points, with shape (n, 4), nearest first
+def worley(points):
+    base = np.floor(points).astype(np.int64)
+    cells = base[:, None, :] + NEIGHBOUR_OFFSETS[None, :, :]
+
+    offsets = points[:, None, :] - (cells + feature_points(cells))
+    distances = np.sqrt(np.einsum("nki,nki->nk", offsets, offsets))
+
+    nearest = np.partition(distances, 3, axis=1)[:, :4]
+    return np.sort(nearest, axis=1)
+
+# Returns the Voronoi texture's value at each point, like Blender's
+# "intensity"
+def voronoi_value(points, noise_scale=0.5, weights=(2,2,2,2)):
+    weights = np.asarray(weights, dtype=np.float64)
+    scale = np.abs(weights).sum()
+    scale = 1.0 / scale if scale else 0.0
+
+    distances = worley(np.asarray(points, dtype=np.float64) / noise_scale)
+    return scale * np.abs(distances @ weights)
+
+# Moves each vertex along its normal by (texture value - midlevel) *
+# strength, as the DISPLACE modifier does. 'vertices' is changed in place;
+# it's worked through 'chunk_size' vertices at a time, so that huge meshes
+# don't need huge temporary arrays.
+def displace_vertices(vertices, normals, noise_scale=0.5, strength=0.5, weights=(2,2,2,2),
+                      midlevel=0.5, chunk_size=65536):
+    for first in range(0, len(vertices), chunk_size):
+        chunk = slice(first, first + chunk_size)
+        value = voronoi_value(vertices[chunk], noise_scale, weights)
+        vertices[chunk] += ((value - midlevel) * strength)[:, None] * normals[chunk]
+
+    return vertices
@@ -0,0 +1,88 @@
+import zlib, struct
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Writes images out of NumPy arrays, without needing Blender. Blender stores
+# image rows from the bottom up, and so do the bakers; PNG stores them from
+# the top down, so rows are flipped on the way out unless told otherwise.
+
+# Converts a float image (0-1) to 8 bits per channel. 8-bit images are
+# passed through untouched.
+def to_bytes(pixels):
+    if pixels.dtype == np.uint8:
+        return pixels
+    return (np.clip(pixels, 0.0, 1.0) * 255.0 + 0.5).astype(np.uint8)
+
+# Encodes an (height, width, channels) image as a PNG, and returns the
+# bytes. One channel is greyscale, three is RGB and four is RGBA.
+def encode_png(pixels, bottom_up=True, compression=6):
+    pixels = to_bytes(np.asarray(pixels))
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, None]
+    if bottom_up:
+        pixels = pixels[::-1]
+
+    height, width, channels = pixels.shape
+    colour_type = {1: 0, 2: 4, 3: 2, 4: 6}[channels]
+
+    # Every row starts with a filter type byte; 0 means "no filter"
+    rows = np.zeros((height, width * channels + 1), dtype=np.uint8)
+    rows[:, 1:] = pixels.reshape(height, width * channels)
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", width, height, 8, colour_type, 0, 0, 0)
+
+    return (b"\x89PNG\r\n\x1a\n" +
+        chunk(b"IHDR", header) +
+        chunk(b"IDAT", zlib.compress(rows.tobytes(), compression)) +
+        chunk(b"IEND", b""))
+
+# Saves an (height, width, channels) image as a PNG file
+def write_png(path, pixels, bottom_up=True, compression=6):
+    data = encode_png(pixels, bottom_up, compression)
+    with open(path, "wb") as f:
+        f.write(data)
+
+# Writes images on background threads, so that whoever made the pixels can
+# get on with something else while they're compressed and saved. zlib lets
+# go of the interpreter lock while it works, so the writes really do run
+# alongside Blender.
+#
+# At most 'max_pending' images wait to be written at once; submitting
+# another one first waits for the oldest, so a fast producer can't fill up
+# memory with images. Errors are kept until wait() is called.
+class BackgroundWriter:
+
+    def __init__(self, workers=2, max_pending=8):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = max_pending
+        self.pending = []
+        self.failures = []
+
+    # Queues up writing an image with write(path, pixels, **options),
+    # which is write_png unless told otherwise. The writer keeps 'pixels',
+    # so don't change it afterwards.
+    def submit(self, path, pixels, write=write_png, **options):
+        self._collect(self.max_pending - 1)
+        self.pending.append((path, self.executor.submit(write, path, pixels, **options)))
+
+    # Waits until no more than 'keep' writes are pending
+    def _collect(self, keep):
+        while len(self.pending) > max(keep, 0):
+            path, future = self.pending.pop(0)
+            error = future.exception()
+            if error is not None:
+                self.failures.append((path, error))
+
+    # Waits for every write to finish. Returns a list of (path, exception)
+    # for each one that failed since the last wait.
+    def wait(self):
+        self._collect(0)
+        failures, self.failures = self.failures, []
+        return failures
+
+# The writer that the bake functions use
+background_writer = BackgroundWriter()
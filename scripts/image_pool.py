@@ -0,0 +1,92 @@
+import bpy
+import numpy as np
+
+# Keeps the images that textures are baked into, so that each asteroid
+# reuses the previous one's images instead of making new ones. Images are
+# kept by (width, height, kind, colour space): the bake functions borrow an
+# image, bake into it, save it, and give it back.
+#
+# Pooled images have a fake user, so reset() doesn't free them along with
+# everything else an asteroid made. Cycles only writes the texels that the
+# bake covers, so a borrowed image is cleared first; otherwise bits of the
+# previous asteroid's texture would show through in the gaps between UV
+# islands.
+
+class ImagePool:
+
+    def __init__(self):
+        # The images that are free to borrow, as lists of (name, address)
+        # by key. We keep names rather than the images themselves, since
+        # touching an image that someone else has removed crashes Blender.
+        self.free = {}
+
+        # The key of every image we've handed out, by address
+        self.keys = {}
+
+        # A cleared image's pixels, by size (for Blenders that can copy
+        # them in with foreach_set)
+        self.blank = {}
+
+    # Finds an image that we made, if it's still around
+    def _find(self, name, address):
+        image = bpy.data.images.get(name)
+        if image is None or image.as_pointer() != address:
+            return None
+        return image
+
+    # Returns an image of the given size, kind and colour space, cleared to
+    # opaque black (like a new image). 'name' is only used if a new image
+    # has to be made.
+    def borrow(self, name, size, kind, colorspace='sRGB'):
+        width, height = size
+        key = (width, height, kind, colorspace)
+
+        free = self.free.get(key, [])
+        while free:
+            image = self._find(*free.pop())
+            if image is not None:
+                self._clear(image)
+                return image
+
+        image = bpy.data.images.new(name, width, height)
+        image.colorspace_settings.name = colorspace
+        image.use_fake_user = True
+        self.keys[image.as_pointer()] = key
+        return image
+
+    # Gives an image back to the pool, so it can be borrowed again
+    def release(self, image):
+        key = self.keys.get(image.as_pointer())
+        if key is None:
+            return
+        self.free.setdefault(key, []).append((image.name, image.as_pointer()))
+
+    # Clears an image to opaque black
+    def _clear(self, image):
+        # Newer Blenders can copy the pixels in one go
+        if hasattr(image.pixels, "foreach_set"):
+            image.pixels.foreach_set(self._blank(*image.size))
+            return
+
+        # Blender 2.79 can't, and assigning a slice goes through the pixels
+        # one float at a time, which is slower than making a new image.
+        # Instead, set the image's generated settings again: that makes
+        # Blender free its pixels, and fill in new ones in C the next time
+        # they're used, just like for a new image.
+        width, height = self.keys[image.as_pointer()][:2]
+        image.source = 'GENERATED'
+        image.generated_type = 'BLANK'
+        image.generated_width = width
+        image.generated_height = height
+        image.generated_color = (0, 0, 0, 1)
+
+    def _blank(self, width, height):
+        blank = self.blank.get((width, height))
+        if blank is None:
+            blank = np.zeros((width * height, 4), dtype=np.float32)
+            blank[:, 3] = 1.0
+            blank = self.blank[(width, height)] = blank.ravel()
+        return blank
+
+# The pool that the bake functions use
+bake_images = ImagePool()
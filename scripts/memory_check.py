@@ -0,0 +1,89 @@
+import bpy, os, sys, argparse, tempfile
+
+# Blender doesn't add the folder that a --python script lives in to the
+# module search path, so add it ourselves
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from util import *
+from asteroid_complete import make_asteroid
+from profiling import current_rss_mb
+
+# Checks that generating asteroid after asteroid in one Blender process
+# doesn't leak: that reset() frees everything each run made, so the number
+# of datablocks and the memory the process uses stay level. Run it like
+# this:
+#
+#   blender -b "GCAP 2018.blend" --python scripts/memory_check.py -- --iterations 1000
+#
+# The asteroids are small (low resolution, tiny bakes), since it's the
+# number of runs that matters here rather than their size. The script exits
+# with an error if the datablocks or the memory kept growing.
+
+# Small settings, so that a thousand runs doesn't take all day
+CHECK_SETTINGS = {
+    "resolution": 0.2,
+    "normal_size": (64,64),
+    "diffuse_size": (64,64),
+}
+
+# Returns how many of each kind of datablock there are
+def datablock_counts():
+    return dict((kind, len(getattr(bpy.data, kind))) for kind in DATABLOCK_TYPES)
+
+def parse_args(argv=None):
+    if argv is None:
+        argv = sys.argv
+        argv = argv[argv.index("--") + 1:] if "--" in argv else []
+
+    parser = argparse.ArgumentParser(
+        prog="memory_check.py",
+        description="Check that generating many asteroids in one process doesn't leak.")
+    parser.add_argument("--iterations", type=int, default=1000,
+        help="how many asteroids to generate")
+    parser.add_argument("--warmup", type=int, default=10,
+        help="how many asteroids to generate before taking the baseline")
+    parser.add_argument("--tolerance", type=float, default=64,
+        help="how many megabytes the process may grow by after the warmup")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    directory = tempfile.mkdtemp(prefix="asteroid_memory_check_") + "/"
+
+    baseline_counts = None
+    baseline_rss = None
+
+    for iteration in range(args.iterations):
+        reset()
+        make_asteroid(directory, "Memory", seed=iteration, settings=CHECK_SETTINGS)
+
+        if iteration + 1 == args.warmup:
+            reset()
+            baseline_counts = datablock_counts()
+            baseline_rss = current_rss_mb()
+
+        if (iteration + 1) % 100 == 0:
+            rss = current_rss_mb()
+            print("%d asteroids: %s MB, %s" % (iteration + 1,
+                "?" if rss is None else "%.1f" % rss, datablock_counts()))
+
+    reset()
+    counts = datablock_counts()
+    rss = current_rss_mb()
+    failed = False
+
+    if baseline_counts is not None:
+        for kind in DATABLOCK_TYPES:
+            if counts[kind] > baseline_counts[kind]:
+                print("LEAK: %d %s after the warmup, %d now" % (baseline_counts[kind], kind, counts[kind]))
+                failed = True
+
+    if baseline_rss is not None and rss is not None:
+        print("Memory: %.1f MB after the warmup, %.1f MB now" % (baseline_rss, rss))
+        if rss - baseline_rss > args.tolerance:
+            print("LEAK: memory grew by %.1f MB" % (rss - baseline_rss))
+            failed = True
+
+    if failed:
+        sys.exit(1)
+    print("No leaks after %d asteroids." % args.iterations)
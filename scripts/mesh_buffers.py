@@ -0,0 +1,151 @@
+import numpy as np
+
+from numpy_bake import triangulate
+
+# Moves mesh data between Blender and NumPy in bulk. A MeshBuffers reads a
+# mesh's vertices, normals, loops, polygons and UVs into arrays with
+# foreach_get, and writes them back (or into a brand new mesh) with
+# foreach_set, so nothing goes through per-vertex Python access.
+#
+# The arrays are kept between uses and only grow when a bigger mesh comes
+# along, so a batch that reuses one MeshBuffers for every asteroid doesn't
+# allocate new arrays for each one. The attributes are views of the
+# right length into those arrays:
+#
+# - vertices, normals: (vertex count, 3)
+# - loop_vertices: (loop count,)
+# - uvs: (loop count, 2), or None if the mesh has no UV layer
+# - loop_start, loop_total, use_smooth: (polygon count,)
+#
+# (read_loop_normals reads split normals separately, since they need
+# calculating first.)
+#
+# The views change when the buffers are reused, so copy anything that needs
+# to outlive the next read.
+
+class MeshBuffers:
+
+    def __init__(self):
+        self._storage = {}
+        self.vertices = self.normals = None
+        self.loop_vertices = self.uvs = None
+        self.loop_start = self.loop_total = self.use_smooth = None
+
+    # Returns a flat array of 'size' items, reusing the storage called
+    # 'name' if it's big enough
+    def _buffer(self, name, size, dtype):
+        storage = self._storage.get(name)
+        if storage is None or len(storage) < size:
+            storage = np.empty(max(size, 1), dtype=dtype)
+            self._storage[name] = storage
+        return storage[:size]
+
+    # Makes the views the right size for a mesh with these counts
+    def resize(self, vertex_count, loop_count, polygon_count, uvs=False):
+        self.vertices = self._buffer("vertices", vertex_count * 3, np.float32).reshape(-1, 3)
+        self.normals = self._buffer("normals", vertex_count * 3, np.float32).reshape(-1, 3)
+        self.loop_vertices = self._buffer("loop_vertices", loop_count, np.int32)
+        self.uvs = self._buffer("uvs", loop_count * 2, np.float32).reshape(-1, 2) if uvs else None
+        self.loop_start = self._buffer("loop_start", polygon_count, np.int32)
+        self.loop_total = self._buffer("loop_total", polygon_count, np.int32)
+        self.use_smooth = self._buffer("use_smooth", polygon_count, np.bool_)
+        return self
+
+    # Reads everything from a mesh. Normals are the vertex normals.
+    def read(self, mesh):
+        uv_layer = mesh.uv_layers.active
+        self.resize(len(mesh.vertices), len(mesh.loops), len(mesh.polygons), uvs=uv_layer is not None)
+
+        mesh.vertices.foreach_get("co", self.vertices.ravel())
+        mesh.vertices.foreach_get("normal", self.normals.ravel())
+        mesh.loops.foreach_get("vertex_index", self.loop_vertices)
+        mesh.polygons.foreach_get("loop_start", self.loop_start)
+        mesh.polygons.foreach_get("loop_total", self.loop_total)
+        mesh.polygons.foreach_get("use_smooth", self.use_smooth)
+        if uv_layer is not None:
+            uv_layer.data.foreach_get("uv", self.uvs.ravel())
+
+        return self
+
+    # Fills the buffers with a triangle mesh. 'uvs', if given, has one UV
+    # per triangle corner, with shape (triangles, 3, 2).
+    def set_triangles(self, vertices, faces, smooth=True, uvs=None):
+        vertices = np.asarray(vertices)
+        faces = np.asarray(faces)
+        self.resize(len(vertices), faces.size, len(faces), uvs=uvs is not None)
+
+        self.vertices[:] = vertices
+        self.normals[:] = 0
+        self.loop_vertices[:] = faces.ravel()
+        self.loop_start[:] = np.arange(0, faces.size, 3)
+        self.loop_total[:] = 3
+        self.use_smooth[:] = smooth
+        if uvs is not None:
+            self.uvs[:] = np.asarray(uvs).reshape(-1, 2)
+
+        return self
+
+    # Writes the vertex positions (and UVs, if there are any) back into the
+    # mesh they were read from, and updates its normals
+    def write_vertices(self, mesh):
+        mesh.vertices.foreach_set("co", self.vertices.ravel())
+        if self.uvs is not None and mesh.uv_layers.active is not None:
+            mesh.uv_layers.active.data.foreach_set("uv", self.uvs.ravel())
+        mesh.update()
+
+    # Writes a UV for every loop into the mesh's active UV layer, adding
+    # one if it doesn't have any
+    def write_uvs(self, mesh, uvs):
+        self.uvs = self._buffer("uvs", len(mesh.loops) * 2, np.float32).reshape(-1, 2)
+        self.uvs[:] = uvs
+
+        if mesh.uv_layers.active is None:
+            mesh.uv_textures.new()
+        mesh.uv_layers.active.data.foreach_set("uv", self.uvs.ravel())
+
+    # Makes a new mesh datablock out of the buffers
+    def to_mesh(self, mesh):
+        mesh.vertices.add(len(self.vertices))
+        mesh.vertices.foreach_set("co", self.vertices.ravel())
+
+        mesh.loops.add(len(self.loop_vertices))
+        mesh.loops.foreach_set("vertex_index", self.loop_vertices)
+
+        mesh.polygons.add(len(self.loop_start))
+        mesh.polygons.foreach_set("loop_start", self.loop_start)
+        mesh.polygons.foreach_set("loop_total", self.loop_total)
+        mesh.polygons.foreach_set("use_smooth", self.use_smooth)
+
+        mesh.update(calc_edges=True)
+
+        if self.uvs is not None:
+            mesh.uv_textures.new()
+            mesh.uv_layers.active.data.foreach_set("uv", self.uvs.ravel())
+
+        return mesh
+
+    # Reads the mesh's shading normal at each loop (its split normals),
+    # which is what it actually looks like when smooth and flat faces are
+    # mixed. Returns a (loop count, 3) view.
+    def read_loop_normals(self, mesh):
+        mesh.calc_normals_split()
+        normals = self._buffer("loop_normals", len(mesh.loops) * 3, np.float32)
+        mesh.loops.foreach_get("normal", normals)
+        return normals.reshape(-1, 3)
+
+    # Splits the polygons into triangles. Returns (triangle loops,
+    # polygon): the loop index of each triangle's corners, and which
+    # polygon each triangle came from.
+    def triangle_loops(self):
+        return triangulate(self.loop_start, self.loop_total)
+
+    # Returns (vertices, triangles, uvs), with the UVs given per triangle
+    # corner (or None). The arrays are copies.
+    def triangles(self):
+        triangle_loops, polygon = self.triangle_loops()
+        uvs = None if self.uvs is None else self.uvs[triangle_loops]
+        return self.vertices.copy(), self.loop_vertices[triangle_loops], uvs
+
+# The buffers that the pipeline's functions use unless they're given some,
+# so that every stage of every asteroid in a batch shares one set of arrays
+shared_buffers = MeshBuffers()
@@ -0,0 +1,103 @@
+import numpy as np
+
+# Chooses the metaball elements for lots of asteroids at once, with NumPy,
+# instead of making several random.uniform calls per element like
+# make_asteroid_metaball does. The result is a structured array with one
+# row per element, which make_metaball_from_elements turns into a metaball.
+#
+# The random numbers come from a counter-based generator (splitmix64): each
+# number is a hash of the asteroid's seed and which number it is. That
+# means every asteroid's elements depend only on its own seed, so sampling
+# asteroids one at a time, in a big batch, or across several processes
+# always gives the same shapes.
+#
+# This uses different random numbers to make_asteroid_metaball, so the same
+# seed makes a different (but equally random) asteroid. It also picks
+# rotations uniformly from all possible rotations, rather than picking
+# three uniform Euler angles.
+
+ELEMENT_DTYPE = np.dtype([
+    ("asteroid", np.int32),        # which asteroid in the batch this belongs to
+    ("co", np.float32, 3),         # position
+    ("size", np.float32, 3),       # size_x, size_y and size_z
+    ("rotation", np.float32, 4),   # quaternion, as (w, x, y, z)
+    ("negative", np.bool_),        # use_negative
+])
+
+# How many random numbers each element uses
+NUMBERS_PER_ELEMENT = 10
+
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+# The splitmix64 finaliser, applied to every number in an array
+def mix64(x):
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+# Returns uniform random numbers in [0, 1): the counters[j]'th number for
+# each seed. 'seeds' has shape (n,) and 'counters' has shape (m,), and the
+# result has shape (n, m).
+def uniform(seeds, counters):
+    seeds = np.asarray(seeds, dtype=np.uint64)[:, None]
+    counters = np.asarray(counters, dtype=np.uint64)[None, :]
+
+    with np.errstate(over="ignore"):
+        x = mix64(seeds + (counters + np.uint64(1)) * GOLDEN_GAMMA)
+
+    # Use the top 53 bits, which is as many as a double can hold
+    return (x >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+# Chooses the elements for one asteroid per seed. The arguments mean the
+# same as make_asteroid_metaball's. Returns an array of ELEMENT_DTYPE,
+# sorted by asteroid.
+def sample_metaball_elements(seeds, radius=1, element_range=(2,3), element_size_range=(0.5,1.5), negative_chance=0.2):
+    seeds = np.asarray(seeds, dtype=np.uint64).ravel()
+    low, high = element_range
+    size_low, size_high = element_size_range
+
+    # Number 0 decides how many elements each asteroid has
+    counts = low + np.floor(uniform(seeds, [0])[:, 0] * (high - low + 1)).astype(np.int64)
+    counts = np.minimum(counts, high)
+
+    # Draw numbers for as many elements as the biggest asteroid needs, then
+    # throw away the ones that asteroids with fewer elements don't use
+    counters = 1 + np.arange(high * NUMBERS_PER_ELEMENT)
+    numbers = uniform(seeds, counters).reshape(len(seeds), high, NUMBERS_PER_ELEMENT)
+
+    used = np.arange(high)[None, :] < counts[:, None]
+    numbers = numbers[used]
+    slot = np.nonzero(used)[1]
+
+    elements = np.zeros(len(numbers), dtype=ELEMENT_DTYPE)
+    elements["asteroid"] = np.nonzero(used)[0]
+
+    # Randomly-sized ellipsoids
+    elements["size"] = size_low + numbers[:, 0:3] * (size_high - size_low)
+
+    # A uniformly distributed point inside the sphere
+    phi = numbers[:, 3] * 2 * np.pi
+    cos_theta = numbers[:, 4] * 2 - 1
+    r = radius * np.cbrt(numbers[:, 5])
+    sin_theta = np.sqrt(1 - cos_theta ** 2)
+    elements["co"] = np.stack([
+        r * sin_theta * np.cos(phi),
+        r * sin_theta * np.sin(phi),
+        r * cos_theta], axis=1)
+
+    # A uniformly distributed rotation (Shoemake's method)
+    u1, u2, u3 = numbers[:, 6], numbers[:, 7] * 2 * np.pi, numbers[:, 8] * 2 * np.pi
+    a = np.sqrt(1 - u1)
+    b = np.sqrt(u1)
+    elements["rotation"] = np.stack([b * np.cos(u3), a * np.sin(u2), a * np.cos(u2), b * np.sin(u3)], axis=1)
+
+    # Any element but the first might be a negative shape
+    elements["negative"] = (slot != 0) & (numbers[:, 9] < negative_chance)
+
+    return elements
+
+# Splits an array of elements up by asteroid. Returns a list with one
+# array per asteroid, for 'count' asteroids.
+def split_by_asteroid(elements, count):
+    bounds = np.searchsorted(elements["asteroid"], np.arange(count + 1))
+    return [elements[bounds[i]:bounds[i + 1]] for i in range(count)]
@@ -0,0 +1,544 @@
+import numpy as np
+
+# A normal map baker written in NumPy, as a faster alternative to baking
+# normals with Cycles. Baking a normal map doesn't need a path tracer: for
+# every texel of the low-poly object's UV layout, we find the matching point
+# on the low-poly surface, fire a ray inwards from just outside it (the
+# "cage"), and record the normal of the high-poly surface where it lands,
+# expressed relative to the low-poly surface (tangent space).
+#
+# Everything here works on plain arrays of vertices and triangles, so it
+# can be used (and tested) outside of Blender. Images are arrays of shape
+# (height, width, 4), with the bottom row first, like Blender's.
+
+# Scales vectors to unit length. Zero-length vectors are left alone.
+def normalize(v):
+    length = np.sqrt(np.einsum("...i,...i->...", v, v))[..., None]
+    return v / np.maximum(length, 1e-12)
+
+# Splits polygons into triangles by fanning out from each polygon's first
+# corner. Takes each polygon's first loop and number of loops, and returns
+# (triangles, polygon): the loop indices of each triangle's corners, and
+# which polygon each triangle came from.
+def triangulate(loop_start, loop_total):
+    loop_start = np.asarray(loop_start, dtype=np.int64)
+    loop_total = np.asarray(loop_total, dtype=np.int64)
+
+    count = loop_total - 2
+    polygon = np.repeat(np.arange(len(loop_start)), count)
+
+    # Which triangle of its polygon each triangle is
+    offset = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+
+    first = loop_start[polygon]
+    triangles = np.stack([first, first + offset + 1, first + offset + 2], axis=1)
+    return triangles, polygon
+
+# Returns the unit normal of each triangle
+def face_normals(vertices, faces):
+    corners = vertices[faces]
+    return normalize(np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]))
+
+# Returns a smooth normal for each vertex, by averaging the normals of the
+# triangles around it (weighted by their area)
+def vertex_normals(vertices, faces):
+    corners = vertices[faces]
+    weighted = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+
+    normals = np.zeros_like(vertices, dtype=np.float64)
+    for k in range(3):
+        np.add.at(normals, faces[:, k], weighted)
+    return normalize(normals)
+
+# A bounding volume hierarchy over a triangle mesh, for finding where rays
+# hit it. Rays are traced in bulk: every ray walks the tree depth first
+# with its own stack of nodes to visit, and each step moves every ray on by
+# one node at once. Each ray visits the nearer of a node's children first,
+# so it usually finds its hit early and can skip any box beyond it.
+class BVH:
+
+    def __init__(self, vertices, faces, leaf_size=4):
+        vertices = np.asarray(vertices, dtype=np.float64)
+        faces = np.asarray(faces, dtype=np.int64)
+
+        corners = vertices[faces]
+        lower = corners.min(axis=1)
+        upper = corners.max(axis=1)
+        centroids = corners.mean(axis=1)
+
+        triangle_count = len(faces)
+        max_nodes = max(1, 2 * triangle_count - 1)
+
+        self.node_min = np.zeros((max_nodes, 3))
+        self.node_max = np.zeros((max_nodes, 3))
+        self.left = np.zeros(max_nodes, dtype=np.int64)
+        self.right = np.zeros(max_nodes, dtype=np.int64)
+        self.start = np.zeros(max_nodes, dtype=np.int64)
+        self.count = np.zeros(max_nodes, dtype=np.int64)
+        self.axis = np.zeros(max_nodes, dtype=np.int64)
+        self.leaf_size = leaf_size
+        self.depth = 1
+
+        # The tree is built a level at a time, splitting every node on the
+        # level at once. Each node covers a range of 'order'.
+        order = np.arange(triangle_count)
+        node_total = 1
+        first = np.zeros(1, dtype=np.int64)
+        last = np.full(1, triangle_count, dtype=np.int64)
+        nodes = np.zeros(1, dtype=np.int64)
+
+        while nodes.size and triangle_count:
+            sizes = last - first
+            offsets = np.cumsum(sizes) - sizes
+            segment = np.repeat(np.arange(len(nodes)), sizes)
+            positions = np.repeat(first, sizes) + np.arange(sizes.sum()) - np.repeat(offsets, sizes)
+            members = order[positions]
+
+            self.node_min[nodes] = np.minimum.reduceat(lower[members], offsets, axis=0)
+            self.node_max[nodes] = np.maximum.reduceat(upper[members], offsets, axis=0)
+
+            leaf = sizes <= leaf_size
+            self.start[nodes[leaf]] = first[leaf]
+            self.count[nodes[leaf]] = sizes[leaf]
+
+            # Split the other nodes' triangles in half along the longest side
+            # of the box around their centres
+            centres = centroids[members]
+            low = np.minimum.reduceat(centres, offsets, axis=0)
+            extent = np.maximum.reduceat(centres, offsets, axis=0) - low
+            axis = np.argmax(extent, axis=1)
+
+            # Sort each node's triangles along its axis. Scaling every
+            # node's centres into 0-1 and adding the node's index sorts
+            # them all in one go.
+            along = centres[np.arange(len(members)), axis[segment]] - low[segment, axis[segment]]
+            scale = 0.5 / np.maximum(extent[np.arange(len(nodes)), axis], 1e-300)
+            order[positions] = members[np.argsort(segment + along * scale[segment], kind="stable")]
+
+            split = ~leaf
+            split_nodes = nodes[split]
+            children = node_total + 2 * np.arange(len(split_nodes))
+            node_total += 2 * len(split_nodes)
+
+            self.axis[split_nodes] = axis[split]
+            self.left[split_nodes] = children
+            self.right[split_nodes] = children + 1
+
+            middle = first[split] + sizes[split] // 2
+            first = np.stack([first[split], middle], axis=1).ravel()
+            last = np.stack([middle, last[split]], axis=1).ravel()
+            nodes = np.stack([children, children + 1], axis=1).ravel()
+            if nodes.size:
+                self.depth += 1
+
+        # The boxes, an axis at a time, for tracing
+        self.axis_min = [np.ascontiguousarray(self.node_min[:, axis]) for axis in range(3)]
+        self.axis_max = [np.ascontiguousarray(self.node_max[:, axis]) for axis in range(3)]
+
+        # Store the triangles in the order the leaves refer to them
+        self.triangle_index = order
+        self.v0 = corners[order, 0]
+        self.e1 = corners[order, 1] - self.v0
+        self.e2 = corners[order, 2] - self.v0
+
+    # Finds the nearest hit for every ray. Returns (t, triangle, u, v):
+    # the distance along each ray, the triangle it hit (-1 for a miss), and
+    # the barycentric coordinates of the hit within that triangle.
+    def intersect(self, origins, directions, t_max=np.inf, batch_size=32768):
+        origins = np.asarray(origins, dtype=np.float64)
+        directions = np.asarray(directions, dtype=np.float64)
+        count = len(origins)
+
+        t = np.full(count, np.inf)
+        triangle = np.full(count, -1, dtype=np.int64)
+        u = np.zeros(count)
+        v = np.zeros(count)
+        if not len(self.triangle_index):
+            return t, triangle, u, v
+
+        for first in range(0, count, batch_size):
+            batch = slice(first, first + batch_size)
+            t[batch], triangle[batch], u[batch], v[batch] = self._intersect_batch(
+                origins[batch], directions[batch], t_max)
+
+        return t, triangle, u, v
+
+    def _intersect_batch(self, origins, directions, t_max):
+        count = len(origins)
+        best_t = np.full(count, t_max, dtype=np.float64)
+        best_triangle = np.full(count, -1, dtype=np.int64)
+        best_u = np.zeros(count)
+        best_v = np.zeros(count)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inverse = 1.0 / directions
+
+        # The rays still walking the tree, and their stacks. Every ray
+        # starts with just the root on its stack. These are copied down to
+        # the rays that are left whenever enough of them have finished,
+        # which is cheaper than picking them out on every step. Origins and
+        # directions are kept an axis at a time, which NumPy gets through
+        # faster than short rows.
+        rays = np.arange(count)
+        ray_origins = np.ascontiguousarray(origins.T)
+        ray_directions = np.ascontiguousarray(directions.T)
+        ray_inverse = np.ascontiguousarray(inverse.T)
+        stack = np.zeros((count, self.depth + 1), dtype=np.int64)
+        top = np.ones(count, dtype=np.int64)
+        leaf_offsets = np.arange(self.leaf_size)
+
+        while rays.size:
+            walking = top > 0
+            if walking.sum() < 0.75 * len(rays):
+                rays, ray_origins, ray_directions, ray_inverse, stack, top = (
+                    rays[walking], ray_origins[:, walking], ray_directions[:, walking],
+                    ray_inverse[:, walking], stack[walking], top[walking])
+                walking = np.ones(len(rays), dtype=bool)
+                if not rays.size:
+                    break
+
+            # Finished rays keep looking at the root, but never visit it
+            top -= walking
+            nodes = stack[np.arange(len(rays)), top]
+
+            # Skip nodes whose box the ray misses, or that are further away
+            # than a hit we've already found. fmin and fmax ignore the NaNs
+            # from rays that run parallel to a face of a box.
+            near = far = None
+            with np.errstate(invalid="ignore"):
+                for axis in range(3):
+                    t1 = (self.axis_min[axis][nodes] - ray_origins[axis]) * ray_inverse[axis]
+                    t2 = (self.axis_max[axis][nodes] - ray_origins[axis]) * ray_inverse[axis]
+                    axis_near = np.fmin(t1, t2)
+                    axis_far = np.fmax(t1, t2)
+                    near = axis_near if near is None else np.fmax(near, axis_near)
+                    far = axis_far if far is None else np.fmin(far, axis_far)
+            visit = walking & (near <= far) & (far >= 0) & (near <= best_t[rays])
+
+            leaf = self.count[nodes] > 0
+            is_leaf = np.flatnonzero(visit & leaf)
+            if is_leaf.size:
+                leaf_rays = rays[is_leaf]
+                leaf_nodes = nodes[is_leaf]
+
+                # Test every ray against every triangle in its leaf, as a
+                # (rays, leaf size) grid
+                triangles = self.start[leaf_nodes][:, None] + leaf_offsets
+                valid = leaf_offsets < self.count[leaf_nodes][:, None]
+                triangles = np.where(valid, triangles, 0).ravel()
+
+                hit_t, hit_u, hit_v = intersect_triangles(
+                    np.repeat(ray_origins[:, is_leaf].T, self.leaf_size, axis=0),
+                    np.repeat(ray_directions[:, is_leaf].T, self.leaf_size, axis=0),
+                    self.v0[triangles], self.e1[triangles], self.e2[triangles])
+                hit_t = np.where(valid.ravel(), hit_t, np.inf).reshape(-1, self.leaf_size)
+
+                nearest = np.argmin(hit_t, axis=1)
+                rows = np.arange(len(leaf_rays))
+                nearest_t = hit_t[rows, nearest]
+                closer = nearest_t < best_t[leaf_rays]
+
+                hit_rays = leaf_rays[closer]
+                picked = (rows * self.leaf_size + nearest)[closer]
+                best_t[hit_rays] = nearest_t[closer]
+                best_triangle[hit_rays] = self.triangle_index[triangles[picked]]
+                best_u[hit_rays] = hit_u[picked]
+                best_v[hit_rays] = hit_v[picked]
+
+            # Push the children of every inner node that was hit, so that
+            # the nearer one comes off the stack first
+            is_inner = np.flatnonzero(visit & ~leaf)
+            if is_inner.size:
+                inner_nodes = nodes[is_inner]
+                inner_top = top[is_inner]
+                heading_up = ray_directions[self.axis[inner_nodes], is_inner] > 0
+                left = self.left[inner_nodes]
+                right = self.right[inner_nodes]
+
+                stack[is_inner, inner_top] = np.where(heading_up, right, left)
+                stack[is_inner, inner_top + 1] = np.where(heading_up, left, right)
+                top[is_inner] += 2
+
+            if not top.any():
+                break
+
+        best_t[best_triangle < 0] = np.inf
+        return best_t, best_triangle, best_u, best_v
+
+# Intersects each ray with one triangle (Moller-Trumbore), where each
+# triangle is given as a corner and two edges. Returns (t, u, v), with t
+# set to infinity where the ray misses.
+def intersect_triangles(origins, directions, v0, e1, e2, epsilon=1e-9):
+    # np.cross is slow on lots of short rows, so the cross products are
+    # written out an axis at a time
+    def cross(a, b):
+        return (a[:, 1] * b[:, 2] - a[:, 2] * b[:, 1],
+            a[:, 2] * b[:, 0] - a[:, 0] * b[:, 2],
+            a[:, 0] * b[:, 1] - a[:, 1] * b[:, 0])
+
+    def dot(a, b):
+        return a[:, 0] * b[0] + a[:, 1] * b[1] + a[:, 2] * b[2]
+
+    p = cross(directions, e2)
+    determinant = dot(e1, p)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inverse = 1.0 / determinant
+
+        s = origins - v0
+        u = dot(s, p) * inverse
+        q = cross(s, e1)
+        v = dot(directions, q) * inverse
+        t = dot(e2, q) * inverse
+
+        hit = ((np.abs(determinant) > epsilon) &
+            (u >= 0) & (v >= 0) & (u + v <= 1) & (t > epsilon))
+
+    return np.where(hit, t, np.inf), u, v
+
+# Finds the texels whose centres lie inside each triangle of a UV layout.
+# 'uvs' holds the UV of each triangle corner, shape (triangles, 3, 2).
+# Returns (x, y, triangle, weights): the texel's column and row, the
+# triangle it's in, and its barycentric weights within that triangle. Each
+# texel is only reported once.
+def rasterize(uvs, width, height, chunk_size=1 << 22):
+    # Texel centres sit on whole numbers in these coordinates
+    points = np.asarray(uvs, dtype=np.float64).reshape(-1, 3, 2) * (width, height) - 0.5
+    a, b, c = points[:, 0], points[:, 1], points[:, 2]
+
+    # The texels in each triangle's bounding box
+    x0 = np.maximum(np.ceil(points[..., 0].min(axis=1)), 0).astype(np.int64)
+    x1 = np.minimum(np.floor(points[..., 0].max(axis=1)), width - 1).astype(np.int64)
+    y0 = np.maximum(np.ceil(points[..., 1].min(axis=1)), 0).astype(np.int64)
+    y1 = np.minimum(np.floor(points[..., 1].max(axis=1)), height - 1).astype(np.int64)
+
+    ab = b - a
+    ac = c - a
+    area = ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0]
+
+    box_width = np.maximum(x1 - x0 + 1, 0)
+    sizes = box_width * np.maximum(y1 - y0 + 1, 0)
+    sizes[np.abs(area) < 1e-12] = 0
+
+    # Test every texel of every box at once, a chunk of triangles at a
+    # time so that big layouts don't need too much memory
+    ends = np.cumsum(sizes)
+    bounds = np.unique(np.concatenate([[0],
+        np.searchsorted(ends, np.arange(chunk_size, ends[-1] if len(ends) else 0, chunk_size)),
+        [len(sizes)]]))
+
+    xs, ys, triangles, weights = [], [], [], []
+
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        chunk_sizes = sizes[first:last]
+        triangle = np.repeat(np.arange(first, last), chunk_sizes)
+        if not triangle.size:
+            continue
+        position = np.arange(triangle.size) - np.repeat(np.cumsum(chunk_sizes) - chunk_sizes, chunk_sizes)
+
+        grid_x = x0[triangle] + position % box_width[triangle]
+        grid_y = y0[triangle] + position // box_width[triangle]
+        px = grid_x - a[triangle, 0]
+        py = grid_y - a[triangle, 1]
+
+        # Solve p = a + s * ab + t * ac
+        s = (px * ac[triangle, 1] - py * ac[triangle, 0]) / area[triangle]
+        t = (ab[triangle, 0] * py - ab[triangle, 1] * px) / area[triangle]
+        inside = (s >= -1e-9) & (t >= -1e-9) & (s + t <= 1 + 1e-9)
+
+        xs.append(grid_x[inside])
+        ys.append(grid_y[inside])
+        triangles.append(triangle[inside])
+        weights.append(np.stack([1 - s[inside] - t[inside], s[inside], t[inside]], axis=1))
+
+    if not xs:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=np.int64), np.zeros((0, 3)))
+
+    xs = np.concatenate(xs)
+    ys = np.concatenate(ys)
+    triangles = np.concatenate(triangles)
+    weights = np.concatenate(weights)
+
+    # Texels on an edge shared by two triangles were found twice
+    texels, unique = np.unique(ys * width + xs, return_index=True)
+    return xs[unique], ys[unique], triangles[unique], weights[unique]
+
+# Works out a tangent frame for each triangle corner, for turning normals
+# into tangent space. Corners that share a vertex and a UV share a tangent,
+# which is the average of their triangles' tangents. Returns (tangents,
+# signs): unit tangents of shape (triangles, 3, 3), and whether each
+# corner's bitangent is flipped (+1 or -1), shape (triangles, 3).
+def tangent_frames(vertices, faces, uvs, normals):
+    corners = vertices[faces]
+    uvs = np.asarray(uvs, dtype=np.float64)
+
+    dp1 = corners[:, 1] - corners[:, 0]
+    dp2 = corners[:, 2] - corners[:, 0]
+    duv1 = uvs[:, 1] - uvs[:, 0]
+    duv2 = uvs[:, 2] - uvs[:, 0]
+
+    r = duv1[:, 0] * duv2[:, 1] - duv2[:, 0] * duv1[:, 1]
+    r = np.where(np.abs(r) < 1e-12, 1e-12, r)[:, None]
+
+    face_tangents = (dp1 * duv2[:, 1:2] - dp2 * duv1[:, 1:2]) / r
+    face_bitangents = (dp2 * duv1[:, 0:1] - dp1 * duv2[:, 0:1]) / r
+
+    # Group the corners by (vertex, UV)
+    keys = np.concatenate([faces.reshape(-1, 1).astype(np.float64), uvs.reshape(-1, 2)], axis=1)
+    unique_keys, group = np.unique(keys, axis=0, return_inverse=True)
+    group = group.ravel()
+
+    tangent_sum = np.zeros((len(unique_keys), 3))
+    bitangent_sum = np.zeros((len(unique_keys), 3))
+    np.add.at(tangent_sum, group, np.repeat(face_tangents, 3, axis=0))
+    np.add.at(bitangent_sum, group, np.repeat(face_bitangents, 3, axis=0))
+
+    normals = normals.reshape(-1, 3)
+    tangents = tangent_sum[group]
+    bitangents = bitangent_sum[group]
+
+    # Make the tangent perpendicular to the normal
+    tangents = normalize(tangents - normals * np.einsum("ij,ij->i", normals, tangents)[:, None])
+    signs = np.where(np.einsum("ij,ij->i", np.cross(normals, tangents), bitangents) < 0, -1.0, 1.0)
+
+    return tangents.reshape(-1, 3, 3), signs.reshape(-1, 3)
+
+# Grows the baked area of an image outwards by 'margin' texels, by filling
+# each empty texel next to a baked one with the average of its baked
+# neighbours. This stops seams showing up when the texture is filtered.
+#
+# Only the texels on the edge of the baked area (the "frontier") are looked
+# at on each step, rather than the whole image. The image is padded by a
+# texel on every side, so that every texel's neighbours are a fixed offset
+# away in the flattened image, and the padding is never filled.
+def dilate(image, mask, margin):
+    height, width, channels = image.shape
+    padded_width = width + 2
+
+    padded = np.zeros((height + 2, padded_width, channels), dtype=np.float32)
+    padded[1:-1, 1:-1] = image
+    filled = np.zeros((height + 2, padded_width), dtype=bool)
+    filled[1:-1, 1:-1] = mask
+    inside = np.zeros((height + 2, padded_width), dtype=bool)
+    inside[1:-1, 1:-1] = True
+
+    padded = padded.reshape(-1, channels)
+    filled = filled.ravel()
+    inside = inside.ravel()
+    offsets = np.array([dy * padded_width + dx for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx])
+
+    # The empty texels next to a baked one
+    def frontier(texels):
+        neighbours = (texels[:, None] + offsets).ravel()
+        neighbours = neighbours[inside[neighbours] & ~filled[neighbours]]
+        return np.unique(neighbours)
+
+    grow = frontier(np.flatnonzero(filled))
+    for i in range(margin):
+        if not grow.size:
+            break
+
+        neighbours = grow[:, None] + offsets
+        baked = filled[neighbours]
+        total = (padded[neighbours] * baked[..., None]).sum(axis=1)
+        padded[grow] = total / baked.sum(axis=1)[:, None]
+        filled[grow] = True
+
+        grow = frontier(grow)
+
+    padded = padded.reshape(height + 2, padded_width, channels)
+    filled = filled.reshape(height + 2, padded_width)
+    return padded[1:-1, 1:-1].copy(), filled[1:-1, 1:-1].copy()
+
+# Bakes a tangent-space normal map from a high-poly mesh onto a low-poly
+# one.
+#
+# - low_vertices, low_faces: the low-poly mesh, as (n, 3) positions and
+#   (m, 3) vertex indices
+# - low_uvs: the UV of each low-poly triangle corner, shape (m, 3, 2)
+# - high_vertices, high_faces: the high-poly mesh
+# - low_normals: the shading normal of each low-poly corner, shape
+#   (m, 3, 3); if None, smooth vertex normals are used
+# - high_normals: a normal for each high-poly vertex, for smooth-shaded
+#   meshes; if None, the high-poly mesh's face normals are used
+#
+# Rays start 'cage_extrusion' outside the low-poly surface (along its
+# smooth normals) and travel inwards; the first high-poly triangle they hit
+# is the one that's baked. Texels whose rays miss get a flat normal.
+#
+# If 'texels' is a (height, width) boolean array, only the texels it marks
+# are baked, which is much quicker when they're a small part of the image.
+# Returns an (height, width, 4) float image.
+def bake_normal_map(low_vertices, low_faces, low_uvs, high_vertices, high_faces,
+        size=(1024,1024), cage_extrusion=0.1, low_normals=None, high_normals=None,
+        margin=16, bvh=None, texels=None):
+    width, height = size
+    low_vertices = np.asarray(low_vertices, dtype=np.float64)
+    low_faces = np.asarray(low_faces, dtype=np.int64)
+    high_vertices = np.asarray(high_vertices, dtype=np.float64)
+    high_faces = np.asarray(high_faces, dtype=np.int64)
+
+    # The cage always uses smooth normals, so that it has no gaps in it
+    smooth_normals = vertex_normals(low_vertices, low_faces)[low_faces]
+    if low_normals is None:
+        low_normals = smooth_normals
+    low_normals = normalize(np.asarray(low_normals, dtype=np.float64))
+
+    tangents, signs = tangent_frames(low_vertices, low_faces, low_uvs, low_normals)
+
+    # Find the point on the low-poly surface under each texel
+    xs, ys, triangles, weights = rasterize(low_uvs, width, height)
+    if texels is not None:
+        keep = texels[ys, xs]
+        xs, ys, triangles, weights = xs[keep], ys[keep], triangles[keep], weights[keep]
+
+    def interpolate(per_corner):
+        return np.einsum("ij,ijk->ik", weights, per_corner[triangles])
+
+    points = interpolate(low_vertices[low_faces])
+    cage_normals = normalize(interpolate(smooth_normals))
+
+    # Fire the rays
+    if bvh is None:
+        bvh = BVH(high_vertices, high_faces)
+    t, hit_triangles, u, v = bvh.intersect(points + cage_normals * cage_extrusion, -cage_normals)
+    hit = hit_triangles >= 0
+
+    # Find the high-poly normal at each hit
+    normals = interpolate(low_normals)
+    if high_normals is None:
+        hit_normals = face_normals(high_vertices, high_faces[hit_triangles[hit]])
+    else:
+        high_normals = np.asarray(high_normals, dtype=np.float64)
+        hit_corners = high_normals[high_faces[hit_triangles[hit]]]
+        hit_normals = ((1 - u[hit] - v[hit])[:, None] * hit_corners[:, 0] +
+            u[hit][:, None] * hit_corners[:, 1] + v[hit][:, None] * hit_corners[:, 2])
+    baked = normals.copy()
+    baked[hit] = normalize(hit_normals)
+
+    # Express them relative to the low-poly surface
+    tangent = interpolate(tangents)
+    normal = normalize(normals)
+    sign = np.einsum("ij,ij->i", weights, signs[triangles])
+    sign = np.where(sign < 0, -1.0, 1.0)
+    bitangent = np.cross(normal, tangent) * sign[:, None]
+
+    tangent_space = normalize(np.stack([
+        np.einsum("ij,ij->i", tangent, baked),
+        np.einsum("ij,ij->i", bitangent, baked),
+        np.einsum("ij,ij->i", normal, baked)], axis=1))
+
+    image = np.zeros((height, width, 4), dtype=np.float32)
+    image[..., :3] = 0.5
+    image[ys, xs, :3] = tangent_space * 0.5 + 0.5
+    image[ys, xs, 3] = 1.0
+
+    mask = np.zeros((height, width), dtype=bool)
+    mask[ys, xs] = True
+    image, mask = dilate(image, mask, margin)
+
+    # Flat normal wherever nothing was baked, but keep the image opaque
+    image[~mask, 2] = 1.0
+    image[..., 3] = 1.0
+    return image
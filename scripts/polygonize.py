@@ -0,0 +1,365 @@
+import numpy as np
+from multiprocessing import Pool
+
+# Turns an asteroid's metaball elements into a mesh without Blender. This
+# evaluates the same field that Blender's metaballs use, on a grid with the
+# same spacing as the metaball's resolution, and then extracts the surface
+# with marching tetrahedra (marching cubes, with each cube split into six
+# tetrahedra, which needs a much smaller table and never leaves holes).
+#
+# The elements come from metaball_sampler.py (or from a Blender metaball,
+# via util.metaball_elements). Everything here is plain NumPy, so it can
+# run in worker processes that don't have Blender at all.
+
+# Blender's defaults for new metaball elements and metaballs
+ELEMENT_RADIUS = 2.0
+ELEMENT_STIFFNESS = 2.0
+THRESHOLD = 0.6
+
+# Returns the rotation matrix for each (w, x, y, z) quaternion
+def quaternion_matrices(quaternions):
+    q = np.asarray(quaternions, dtype=np.float64)
+    q = q / np.linalg.norm(q, axis=-1, keepdims=True)
+    w, x, y, z = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+
+    return np.stack([
+        np.stack([1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w)], axis=-1),
+        np.stack([2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w)], axis=-1),
+        np.stack([2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y)], axis=-1),
+    ], axis=-2)
+
+# Evaluates the metaball field at each point. Like Blender, each ellipsoid
+# element adds stiffness * (1 - d^2 / radius^2)^3 where d is the distance
+# from its centre in its own rotated and scaled space, and negative
+# elements subtract it. The surface is where the field equals the
+# threshold.
+def metaball_field(points, elements, radius=ELEMENT_RADIUS, stiffness=ELEMENT_STIFFNESS):
+    points = np.asarray(points, dtype=np.float64)
+    field = np.zeros(len(points))
+
+    matrices = quaternion_matrices(elements["rotation"])
+
+    for element, matrix in zip(elements, matrices):
+        # Move the points into the element's space: undo its position, then
+        # its rotation, then its size
+        local = (points - element["co"]).dot(matrix) / element["size"]
+        falloff = 1 - np.einsum("ij,ij->i", local, local) / (radius * radius)
+        contribution = stiffness * np.maximum(falloff, 0) ** 3
+
+        if element["negative"]:
+            field -= contribution
+        else:
+            field += contribution
+
+    return field
+
+# Returns the (lower, upper) corners of a box that contains every positive
+# element's area of influence. Negative elements can only take away from
+# the shape, so they don't make it any bigger.
+def field_bounds(elements, radius=ELEMENT_RADIUS):
+    positive = elements[~elements["negative"]]
+    reach = radius * positive["size"].max(axis=1)[:, None]
+    return (positive["co"] - reach).min(axis=0), (positive["co"] + reach).max(axis=0)
+
+# The corners of a cube, numbered so that bit 0 is x, bit 1 is y and bit 2
+# is z
+CUBE_CORNERS = np.array([[(c >> 0) & 1, (c >> 1) & 1, (c >> 2) & 1] for c in range(8)])
+
+# Six tetrahedra that fill a cube, all sharing the diagonal from corner 0
+# to corner 7. Neighbouring cubes split their shared faces the same way,
+# so the surface has no cracks.
+CUBE_TETRAHEDRA = np.array([
+    [0, 1, 3, 7], [0, 1, 5, 7],
+    [0, 2, 3, 7], [0, 2, 6, 7],
+    [0, 4, 5, 7], [0, 4, 6, 7],
+])
+
+# For each of the 16 ways a tetrahedron's corners can be inside or outside
+# the surface, the triangles to make: each triangle is three (corner,
+# corner) edges for its vertices to sit on, followed by one inside and one
+# outside corner, which decide which way the triangle faces.
+def _tetrahedron_table():
+    table = []
+    for case in range(16):
+        inside = [c for c in range(4) if case & (1 << c)]
+        outside = [c for c in range(4) if not case & (1 << c)]
+        triangles = []
+
+        if len(inside) == 1 or len(outside) == 1:
+            # One corner is on its own; cut it off
+            lone = inside[0] if len(inside) == 1 else outside[0]
+            others = [c for c in range(4) if c != lone]
+            edges = [(lone, other) for other in others]
+            triangles.append(edges + [inside[0], outside[0]])
+
+        elif len(inside) == 2:
+            # The surface cuts through the middle, making a quad
+            a, b = inside
+            c, d = outside
+            triangles.append([(a, c), (a, d), (b, d), a, c])
+            triangles.append([(a, c), (b, d), (b, c), a, c])
+
+        table.append(triangles)
+    return table
+
+TETRAHEDRON_TABLE = _tetrahedron_table()
+
+# Extracts the surface where a grid of values crosses zero (values above
+# zero are inside). 'values' has shape (nx, ny, nz), and grid point (i, j,
+# k) is at origin + (i, j, k) * step. If 'cells' is given, only those
+# cells (an (n, 3) array of their lowest corners) are looked at; otherwise
+# every cell is. Returns (vertices, faces).
+def march_grid(values, origin, step, cells=None):
+    values = np.asarray(values, dtype=np.float64)
+    nx, ny, nz = values.shape
+    inside = values > 0
+
+    if cells is None:
+        # Only cells whose corners aren't all inside or all outside can
+        # contain any surface
+        corners = [inside[dx:nx - 1 + dx, dy:ny - 1 + dy, dz:nz - 1 + dz] for dx, dy, dz in CUBE_CORNERS]
+        any_inside = np.logical_or.reduce(corners)
+        all_inside = np.logical_and.reduce(corners)
+        cells = np.argwhere(any_inside & ~all_inside)
+
+    # The grid index of every corner of every cell
+    corner_ids = np.ravel_multi_index(
+        tuple((cells[:, None, :] + CUBE_CORNERS[None, :, :]).transpose(2, 0, 1)), values.shape)
+
+    def position(ids):
+        return np.asarray(origin) + np.stack(np.unravel_index(ids, values.shape), axis=1) * step
+
+    return _march_tetrahedra(corner_ids, values.ravel(), position)
+
+# Marches the tetrahedra in a set of cells, and returns (vertices, faces).
+# 'corner_ids' holds the index of each cell's eight corners in 'values',
+# and 'position' turns indices into points in space.
+def _march_tetrahedra(corner_ids, flat_values, position):
+    flat_inside = flat_values > 0
+    edge_a, edge_b, inner, outer = [], [], [], []
+
+    for tetrahedron in CUBE_TETRAHEDRA:
+        ids = corner_ids[:, tetrahedron]
+        case = (flat_inside[ids] * (1 << np.arange(4))).sum(axis=1)
+
+        for c in range(1, 15):
+            selected = ids[case == c]
+            if not len(selected):
+                continue
+            for triangle in TETRAHEDRON_TABLE[c]:
+                edges = triangle[:3]
+                edge_a.append(np.stack([selected[:, p] for p, q in edges], axis=1))
+                edge_b.append(np.stack([selected[:, q] for p, q in edges], axis=1))
+                inner.append(selected[:, triangle[3]])
+                outer.append(selected[:, triangle[4]])
+
+    if not edge_a:
+        return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64)
+
+    edge_a = np.concatenate(edge_a)
+    edge_b = np.concatenate(edge_b)
+    inner = np.concatenate(inner)
+    outer = np.concatenate(outer)
+
+    # Every triangle corner sits on a grid edge; corners on the same edge
+    # are the same vertex
+    low = np.minimum(edge_a, edge_b)
+    high = np.maximum(edge_a, edge_b)
+    point_count = len(flat_values)
+    keys = low.astype(np.int64) * point_count + high
+    unique_keys, faces = np.unique(keys.ravel(), return_inverse=True)
+    faces = faces.reshape(-1, 3)
+
+    # Place each vertex where the field crosses zero along its edge
+    a = unique_keys // point_count
+    b = unique_keys % point_count
+    va = flat_values[a]
+    vb = flat_values[b]
+    t = (va / (va - vb))[:, None]
+
+    vertices = position(a) + (position(b) - position(a)) * t
+
+    # Make every triangle face outwards, away from the inside corner
+    corners = vertices[faces]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    backwards = np.einsum("ij,ij->i", normals, position(outer) - position(inner)) < 0
+    faces[backwards] = faces[backwards][:, ::-1]
+
+    # Throw away triangles that collapsed to a line or a point
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 2] != faces[:, 0])
+    return vertices, faces[keep]
+
+# Makes a mesh from an asteroid's metaball elements, evaluating the field
+# on a grid 'resolution' apart, like a Blender metaball's resolution
+# setting. Returns (vertices, faces).
+def polygonize_metaball(elements, resolution=0.1, threshold=THRESHOLD, chunk_size=262144):
+    lower, upper = field_bounds(elements)
+
+    # Leave a cell of room on each side so the surface is always closed
+    lower = lower - resolution
+    shape = tuple(int(n) for n in np.ceil((upper + resolution - lower) / resolution) + 1)
+
+    grid = np.stack(np.meshgrid(*[np.arange(n) for n in shape], indexing="ij"), axis=-1).reshape(-1, 3)
+    values = np.empty(len(grid))
+    for first in range(0, len(grid), chunk_size):
+        points = lower + grid[first:first + chunk_size] * resolution
+        values[first:first + chunk_size] = metaball_field(points, elements) - threshold
+
+    return march_grid(values.reshape(shape), lower, resolution)
+
+# Returns the lowest and highest values that the field could possibly take
+# inside spheres of radius 'reach' around each point. Each element's field
+# only depends on the distance from its centre in its own space, and gets
+# weaker with distance, so its range inside a sphere comes from the
+# nearest and furthest that sphere can get to the element's centre.
+def field_range(points, reach, elements, radius=ELEMENT_RADIUS, stiffness=ELEMENT_STIFFNESS):
+    points = np.asarray(points, dtype=np.float64)
+    low = np.zeros(len(points))
+    high = np.zeros(len(points))
+
+    matrices = quaternion_matrices(elements["rotation"])
+
+    for element, matrix in zip(elements, matrices):
+        local = (points - element["co"]).dot(matrix) / element["size"]
+        distance = np.sqrt(np.einsum("ij,ij->i", local, local))
+
+        # A sphere in world space fits inside a sphere this big in the
+        # element's (scaled) space
+        local_reach = reach / element["size"].min()
+        nearest = np.maximum(distance - local_reach, 0)
+        furthest = distance + local_reach
+
+        strongest = stiffness * np.maximum(1 - (nearest / radius) ** 2, 0) ** 3
+        weakest = stiffness * np.maximum(1 - (furthest / radius) ** 2, 0) ** 3
+
+        if element["negative"]:
+            low -= strongest
+            high -= weakest
+        else:
+            low += weakest
+            high += strongest
+
+    return low, high
+
+# Makes a mesh from an asteroid's metaball elements like
+# polygonize_metaball does, but only evaluates the field close to the
+# surface. The space around the asteroid is split into an octree of
+# blocks; a block is only subdivided (and, once it's 'block_size' cells
+# across, evaluated at full resolution) if the surface could pass through
+# it, judging by the range of values the field could take inside the
+# block. Empty space is skipped after a handful of evaluations,
+# so the cost grows with the area of the surface rather than with the
+# volume around it. Returns (vertices, faces), the same as
+# polygonize_metaball.
+def polygonize_metaball_adaptive(elements, resolution=0.1, threshold=THRESHOLD, block_size=8):
+    lower, upper = field_bounds(elements)
+    lower = lower - resolution
+    cells = np.ceil((upper + resolution - lower) / resolution).astype(np.int64)
+
+    # Start with blocks big enough that a few of them cover everything
+    size = block_size
+    while size * 2 < cells.max():
+        size *= 2
+
+    counts = -(-cells // size)
+    blocks = np.stack(np.meshgrid(*[np.arange(n) for n in counts], indexing="ij"), axis=-1).reshape(-1, 3) * size
+
+    while True:
+        # Keep only the blocks that the surface could pass through
+        centres = lower + (blocks + size / 2.0) * resolution
+        low, high = field_range(centres, np.sqrt(3) * size * resolution / 2, elements)
+        blocks = blocks[(low <= threshold) & (high >= threshold)]
+
+        if size == block_size or not len(blocks):
+            break
+
+        # Split each remaining block into eight
+        size //= 2
+        blocks = (blocks[:, None, :] + CUBE_CORNERS[None, :, :] * size).reshape(-1, 3)
+
+    if not len(blocks):
+        return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64)
+
+    # Every grid point of every remaining block, without repeating the
+    # points that neighbouring blocks share
+    offsets = np.stack(np.meshgrid(*[np.arange(block_size + 1)] * 3, indexing="ij"), axis=-1).reshape(-1, 3)
+    points = (blocks[:, None, :] + offsets[None, :, :]).reshape(-1, 3)
+    span = points.max() + 1
+    point_keys = np.ravel_multi_index(tuple(points.T), (span, span, span))
+    unique_keys, point_index = np.unique(point_keys, return_inverse=True)
+    grid = np.stack(np.unravel_index(unique_keys, (span, span, span)), axis=1)
+
+    values = metaball_field(lower + grid * resolution, elements) - threshold
+
+    # The corners of every cell in every block, as indices into 'values'
+    point_index = point_index.reshape(len(blocks), block_size + 1, block_size + 1, block_size + 1)
+    corner_ids = np.stack([
+        point_index[:, dx:block_size + dx, dy:block_size + dy, dz:block_size + dz].reshape(-1)
+        for dx, dy, dz in CUBE_CORNERS], axis=1)
+
+    # Only march the cells that actually have the surface in them
+    inside = values[corner_ids] > 0
+    crossing = inside.any(axis=1) & ~inside.all(axis=1)
+
+    def position(ids):
+        return lower + grid[ids] * resolution
+
+    return _march_tetrahedra(corner_ids[crossing], values, position)
+
+# Makes a mesh from an asteroid's metaball elements with roughly
+# 'target_triangles' triangles, by picking the resolution to polygonize
+# at. The number of triangles goes with the surface area divided by the
+# resolution squared, so each attempt corrects the resolution by the square
+# root of how far off it was, but by no more than a factor of four. Once
+# one resolution has given too many triangles and another too few, the
+# next guess always falls between them, halving the gap if the correction
+# would leave it.
+#
+# Meshes with fewer than 'min_triangles' triangles don't count, since
+# they're too coarse to be the right shape; if every attempt makes one,
+# this raises a ValueError. Returns (vertices, faces, resolution).
+def polygonize_to_budget(elements, target_triangles, resolution=0.1, attempts=8, tolerance=0.1, min_triangles=8):
+    best = None
+
+    # The coarsest resolution that made too many triangles, and the finest
+    # that made too few
+    finer = coarser = None
+
+    for attempt in range(attempts):
+        vertices, faces = polygonize_metaball_adaptive(elements, resolution)
+        usable = len(faces) >= min_triangles
+
+        if usable:
+            error = abs(len(faces) - target_triangles) / float(target_triangles)
+            if best is None or error < best[3]:
+                best = (vertices, faces, resolution, error)
+            if error <= tolerance:
+                break
+
+        if usable and len(faces) > target_triangles:
+            finer = resolution if finer is None else max(finer, resolution)
+            correction = np.sqrt(len(faces) / float(target_triangles))
+        else:
+            coarser = resolution if coarser is None else min(coarser, resolution)
+            correction = np.sqrt(len(faces) / float(target_triangles)) if usable else 0.25
+
+        resolution *= min(max(correction, 0.25), 4.0)
+        if finer is not None and coarser is not None and not finer < resolution < coarser:
+            resolution = np.sqrt(finer * coarser)
+
+    if best is None:
+        raise ValueError("Couldn't polygonize the metaball with at least %d triangles" % min_triangles)
+    return best[:3]
+
+def _polygonize_job(job):
+    elements, resolution, adaptive = job
+    if adaptive:
+        return polygonize_metaball_adaptive(elements, resolution)
+    return polygonize_metaball(elements, resolution)
+
+# Polygonizes lots of asteroids at once, spread over 'processes' worker
+# processes. 'element_lists' holds one element array per asteroid (see
+# metaball_sampler.split_by_asteroid). Returns a list of (vertices, faces).
+def polygonize_many(element_lists, resolution=0.1, processes=None, adaptive=False):
+    with Pool(processes) as pool:
+        return pool.map(_polygonize_job, [(elements, resolution, adaptive) for elements in element_lists])
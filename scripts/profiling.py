@@ -0,0 +1,207 @@
+import bpy, os, sys, json, time, functools
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# Measures how long each step of the asteroid pipeline takes. A Profiler
+# wraps the pipeline's functions, and every time one of them is called it
+# records:
+#
+# - the wall-clock time and CPU time that it took
+# - the process's peak memory use (resident set size) afterwards
+# - how many vertices and faces the object it worked on had, before and
+#   after
+#
+# Stages are grouped by asteroid; each asteroid can be written out as one
+# line of JSON, and a whole batch can be summarised as a table.
+#
+# Some stages call others (make_lowpoly_direct calls add_modifiers, which
+# calls displace_numpy). Each record's "wall" and "cpu" include the stages
+# it called, and "self_wall" and "self_cpu" don't, so adding up the self
+# times never counts anything twice. "depth" is how many stages it was
+# called from.
+
+# The functions in asteroid_complete.py that make up the pipeline
+PIPELINE_FUNCTIONS = (
+    "make_asteroid_metaball",
+    "make_metaball_from_elements",
+    "make_mesh_from_metaball",
+    "make_mesh_from_metaball_numpy",
+    "add_modifiers",
+    "displace_numpy",
+    "make_lowpoly_object",
+    "make_lowpoly_direct",
+    "uv_unwrap",
+    "uv_unwrap_numpy",
+    "pack_uv_islands",
+    "make_lod_objects",
+    "create_bake_material",
+    "prepare_for_bake",
+    "progressive_bake_settings",
+    "bake_normals",
+    "bake_normals_numpy",
+    "bake_diffuse",
+    "bake_combined",
+    "export_fbx",
+)
+
+# Returns the peak resident set size of this process, in megabytes, or
+# None if we can't find out
+def peak_rss_mb():
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS reports bytes
+    if sys.platform == 'darwin':
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
+
+# Returns how much memory this process is using right now, in megabytes,
+# or None if we can't find out (only Linux says)
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+
+# Returns the (vertices, faces) in an object's mesh, or None if it isn't a
+# mesh object
+def mesh_counts(obj):
+    if not isinstance(obj, bpy.types.Object) or obj.type != 'MESH':
+        return None
+    return (len(obj.data.vertices), len(obj.data.polygons))
+
+class Profiler:
+
+    def __init__(self):
+        # The stages of the asteroid that's being made right now
+        self.stages = []
+
+        # Every asteroid that has been finished, as dictionaries
+        self.asteroids = []
+
+        # The time spent in the stages called by each stage that's running
+        # right now, innermost last, as [wall, cpu] pairs
+        self.running = []
+
+    # Records a call to 'func' under the name 'stage'
+    def call(self, stage, func, *args, **kwargs):
+
+        # The object that the function works on is the first one it's given
+        target = next((a for a in args if isinstance(a, bpy.types.Object)), None)
+        counts_in = mesh_counts(target)
+
+        wall_started = time.perf_counter()
+        cpu_started = time.process_time()
+        depth = len(self.running)
+        self.running.append([0.0, 0.0])
+
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            wall = time.perf_counter() - wall_started
+            cpu = time.process_time() - cpu_started
+            nested_wall, nested_cpu = self.running.pop()
+            if self.running:
+                self.running[-1][0] += wall
+                self.running[-1][1] += cpu
+
+        record = {
+            "stage": stage,
+            "wall": wall,
+            "cpu": cpu,
+            "self_wall": wall - nested_wall,
+            "self_cpu": cpu - nested_cpu,
+            "depth": depth,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+        # Functions that make a new object return it; the rest change the
+        # object they were given
+        counts_out = mesh_counts(result if isinstance(result, bpy.types.Object) else target)
+
+        if counts_in is not None:
+            record["vertices_in"], record["faces_in"] = counts_in
+        if counts_out is not None:
+            record["vertices_out"], record["faces_out"] = counts_out
+
+        self.stages.append(record)
+        return result
+
+    # Returns a version of 'func' that records every call to it
+    def wrap(self, func, stage=None):
+        stage = stage or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.call(stage, func, *args, **kwargs)
+        return wrapper
+
+    # Replaces the pipeline functions in a module (like asteroid_complete)
+    # with wrapped versions. Since make_asteroid looks its steps up in the
+    # module, this profiles everything it does.
+    def instrument(self, module, names=PIPELINE_FUNCTIONS):
+        for name in names:
+            func = getattr(module, name, None)
+            if func is not None and not hasattr(func, "__wrapped__"):
+                setattr(module, name, self.wrap(func, name))
+
+    # Finishes the current asteroid, and returns its report
+    def finish_asteroid(self, name, **extra):
+        report = {
+            "asteroid": name,
+            "wall": sum(s["self_wall"] for s in self.stages),
+            "cpu": sum(s["self_cpu"] for s in self.stages),
+            "stages": self.stages,
+        }
+        report.update(extra)
+
+        self.asteroids.append(report)
+        self.stages = []
+        return report
+
+    # Appends an asteroid's report to a JSON-lines file
+    def write_report(self, path, report):
+        with open(path, "a") as f:
+            f.write(json.dumps(report) + "\n")
+
+    # Returns a table summarising every stage across every finished
+    # asteroid, as a string
+    def summary(self):
+        totals = {}
+        order = []
+        for asteroid in self.asteroids:
+            for s in asteroid["stages"]:
+                if s["stage"] not in totals:
+                    totals[s["stage"]] = {"calls": 0, "wall": 0.0, "self_wall": 0.0, "cpu": 0.0, "peak": None}
+                    order.append(s["stage"])
+                total = totals[s["stage"]]
+                total["calls"] += 1
+                total["wall"] += s["wall"]
+                total["self_wall"] += s["self_wall"]
+                total["cpu"] += s["cpu"]
+                if s["peak_rss_mb"] is not None:
+                    total["peak"] = max(total["peak"] or 0, s["peak_rss_mb"])
+
+        # Shares are of self time, so they add up to 100% even when stages
+        # call each other
+        all_wall = sum(t["self_wall"] for t in totals.values()) or 1.0
+
+        lines = ["%-24s %6s %10s %10s %10s %7s %10s" % (
+            "stage", "calls", "wall (s)", "mean (s)", "cpu (s)", "share", "peak (MB)")]
+        for stage in order:
+            t = totals[stage]
+            lines.append("%-24s %6d %10.3f %10.3f %10.3f %6.1f%% %10s" % (
+                stage, t["calls"], t["wall"], t["wall"] / t["calls"], t["cpu"],
+                100.0 * t["self_wall"] / all_wall,
+                "%.1f" % t["peak"] if t["peak"] is not None else "-"))
+        lines.append("%d asteroids, %.3fs in total" % (len(self.asteroids), all_wall))
+
+        return "\n".join(lines)
@@ -0,0 +1,177 @@
+import numpy as np
+
+from numpy_bake import bake_normal_map, rasterize, normalize, BVH
+
+# Works out whether an asteroid's textures need baking at full size. Small,
+# smooth, or far-away rocks often look the same with much smaller textures,
+# which take a fraction of the time to bake.
+#
+# To find out, we bake the normal map at a low resolution, stretch it up to
+# full size, and compare it with a few tiles of the normal map baked at full
+# size. Both bakes use numpy_bake.py, since it can bake just the tiles
+# rather than the whole image. If the stretched map is close enough to the
+# real thing, the low resolution will do.
+#
+# The probe only looks at the tiles, so it only bakes the low resolution
+# map under them too, and only builds a BVH for the high-poly triangles
+# near them. Building a BVH for a whole high-poly rock takes longer than
+# the rest of the probe put together.
+#
+# Images are (height, width, channels) arrays with the bottom row first,
+# like Blender's.
+
+# Resizes an image to 'size' (width, height) with bilinear filtering,
+# treating each texel as a sample at its centre, like a GPU would. If
+# 'rows' and 'columns' are given, only those rows and columns of the
+# resized image are made.
+def upsample(image, size, rows=None, columns=None):
+    image = np.asarray(image)
+    width, height = size
+    source_height, source_width = image.shape[:2]
+
+    def samples(count, source_count):
+        position = (np.arange(count) + 0.5) * source_count / count - 0.5
+        position = np.clip(position, 0, source_count - 1)
+        low = np.minimum(np.floor(position).astype(np.int64), source_count - 1)
+        high = np.minimum(low + 1, source_count - 1)
+        return low, high, (position - low)
+
+    y0, y1, fy = samples(height, source_height)
+    x0, x1, fx = samples(width, source_width)
+    if rows is not None:
+        y0, y1, fy = y0[rows], y1[rows], fy[rows]
+    if columns is not None:
+        x0, x1, fx = x0[columns], x1[columns], fx[columns]
+    fx = fx[None, :, None]
+    fy = fy[:, None, None]
+
+    top = image[y0][:, x0] * (1 - fx) + image[y0][:, x1] * fx
+    bottom = image[y1][:, x0] * (1 - fx) + image[y1][:, x1] * fx
+    return top * (1 - fy) + bottom * fy
+
+# Picks the 'count' tiles ('tile_size' texels square) of a (width, height)
+# image that the UV layout covers the most of. Returns a (height, width)
+# boolean array of the covered texels inside them.
+def choose_tiles(xs, ys, size, tile_size=32, count=4):
+    width, height = size
+    columns = (width + tile_size - 1) // tile_size
+    tile = (ys // tile_size) * columns + xs // tile_size
+
+    coverage = np.bincount(tile, minlength=columns * ((height + tile_size - 1) // tile_size))
+    chosen = np.argsort(-coverage, kind="stable")[:count]
+    chosen = chosen[coverage[chosen] > 0]
+
+    texels = np.zeros((height, width), dtype=bool)
+    inside = np.isin(tile, chosen)
+    texels[ys[inside], xs[inside]] = True
+    return texels
+
+# Returns a (height, width) boolean array of the texels of a 'size' image
+# that bilinear filtering reads from when stretching it up to the size of
+# 'texels', a boolean array of the texels that are wanted
+def source_texels(texels, size):
+    width, height = size
+    full_height, full_width = texels.shape
+    ys, xs = np.nonzero(texels)
+
+    source = np.zeros((height, width), dtype=bool)
+    x = np.clip(((xs + 0.5) * width / full_width - 0.5).astype(np.int64), 0, width - 1)
+    y = np.clip(((ys + 0.5) * height / full_height - 0.5).astype(np.int64), 0, height - 1)
+    for dy in (-1, 0, 1, 2):
+        for dx in (-1, 0, 1, 2):
+            source[np.clip(y + dy, 0, height - 1), np.clip(x + dx, 0, width - 1)] = True
+    return source
+
+# Returns the points on the low-poly surface under the wanted 'texels'
+# of a 'size' image
+def surface_points(vertices, faces, uvs, size, texels):
+    xs, ys, triangles, weights = rasterize(uvs, size[0], size[1])
+    keep = texels[ys, xs]
+    return np.einsum("ij,ijk->ik", weights[keep], vertices[faces][triangles[keep]])
+
+# Returns a mask of the triangles that rays fired at 'points' can hit, if
+# they land no more than 'distance' from where they're aimed. Space is
+# split into cubes at least 'distance' across, and at least as big as any
+# triangle (but no more than 128 to a side). A triangle is kept if its
+# centre is within two cubes of one with a point in it, which is always far
+# enough to reach any triangle that a ray lands on.
+def nearby_triangles(vertices, faces, points, distance):
+    corners = vertices[faces]
+    centres = corners.mean(axis=1)
+    extent = (corners.max(axis=1) - corners.min(axis=1)).max()
+
+    low = points.min(axis=0)
+    high = points.max(axis=0)
+    cell = max(distance, extent, (high - low).max() / 128, 1e-9)
+    reach = 2
+
+    # Pad the grid on every side, so that the cubes around occupied ones
+    # are always inside it
+    shape = np.floor((high - low) / cell).astype(np.int64) + 1 + 2 * reach
+    occupied = np.unique(np.floor((points - low) / cell).astype(np.int64) + reach, axis=0)
+    grid = np.zeros(shape, dtype=bool)
+    for dx in range(-reach, reach + 1):
+        for dy in range(-reach, reach + 1):
+            for dz in range(-reach, reach + 1):
+                grid[occupied[:, 0] + dx, occupied[:, 1] + dy, occupied[:, 2] + dz] = True
+
+    cells = np.floor((centres - low) / cell).astype(np.int64) + reach
+    inside = ((cells >= 0) & (cells < shape)).all(axis=1)
+    near = np.zeros(len(faces), dtype=bool)
+    near[inside] = grid[cells[inside, 0], cells[inside, 1], cells[inside, 2]]
+    return near
+
+# Returns the mean angle, in degrees, between the normals encoded in two
+# arrays of normal map texels
+def normal_error(a, b):
+    a = normalize(np.asarray(a, dtype=np.float64)[..., :3] * 2 - 1)
+    b = normalize(np.asarray(b, dtype=np.float64)[..., :3] * 2 - 1)
+    cosine = np.clip(np.einsum("...i,...i->...", a, b), -1.0, 1.0)
+    return float(np.degrees(np.arccos(cosine)).mean()) if cosine.size else 0.0
+
+# Works out how big a normal map needs to be. Takes the same meshes as
+# bake_normal_map, the full 'size', and the low 'start_size' to try first.
+# Returns the size to bake at (start_size if its error is no more than
+# 'tolerance' degrees, or size otherwise), and the error.
+def progressive_size(low_vertices, low_faces, low_uvs, high_vertices, high_faces,
+        size=(1024,1024), start_size=(256,256), tolerance=2.0, tiles=4, tile_size=32,
+        cage_extrusion=0.1, low_normals=None, high_normals=None):
+
+    if start_size[0] >= size[0] and start_size[1] >= size[1]:
+        return size, 0.0
+
+    low_vertices = np.asarray(low_vertices, dtype=np.float64)
+    low_faces = np.asarray(low_faces, dtype=np.int64)
+    high_vertices = np.asarray(high_vertices, dtype=np.float64)
+    high_faces = np.asarray(high_faces, dtype=np.int64)
+
+    # Only compare texels that the UV layout covers. The rest are padding,
+    # so there's no need to fill them in either.
+    width, height = size
+    xs, ys, triangles, weights = rasterize(low_uvs, width, height)
+    texels = choose_tiles(xs, ys, size, tile_size, tiles)
+    low_texels = source_texels(texels, start_size)
+
+    # Rays start 'cage_extrusion' out from the surface, and the high-poly
+    # surface is inside the cage, so only the triangles near the tiles can
+    # be hit
+    points = np.concatenate([
+        surface_points(low_vertices, low_faces, low_uvs, size, texels),
+        surface_points(low_vertices, low_faces, low_uvs, start_size, low_texels)])
+    if not len(points):
+        return size, 0.0
+    high_faces = high_faces[nearby_triangles(high_vertices, high_faces, points, cage_extrusion)]
+
+    options = {"cage_extrusion": cage_extrusion, "low_normals": low_normals,
+        "high_normals": high_normals, "bvh": BVH(high_vertices, high_faces)}
+
+    low = bake_normal_map(low_vertices, low_faces, low_uvs, high_vertices, high_faces,
+        size=start_size, texels=low_texels, margin=2, **options)
+    full = bake_normal_map(low_vertices, low_faces, low_uvs, high_vertices, high_faces,
+        size=size, texels=texels, margin=0, **options)
+
+    rows = np.flatnonzero(texels.any(axis=1))
+    columns = np.flatnonzero(texels.any(axis=0))
+    inside = np.ix_(rows, columns)
+    error = normal_error(upsample(low, size, rows, columns)[texels[inside]], full[inside][texels[inside]])
+    return (start_size if error <= tolerance else size), error
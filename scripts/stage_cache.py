@@ -0,0 +1,100 @@
+import bpy, os, tempfile
+
+from asset_cache import cache_key
+
+# Caches the meshes that the asteroid pipeline makes along the way, so that
+# changing a late setting (like the bake size) doesn't mean rebuilding the
+# geometry from scratch. The stages are:
+#
+# - "highpoly": the rocky mesh, after make_mesh_from_metaball and add_modifiers
+# - "lowpoly": the result of make_lowpoly_object
+# - "unwrapped": the low-poly mesh, after uv_unwrap
+#
+# Each stage's key is made from the previous stage's key plus the settings
+# that the stage itself uses, so changing a setting only invalidates the
+# stages from that point onwards. Meshes are stored as little .blend files
+# in an AssetCache.
+
+# The settings that each stage uses
+STAGE_SETTINGS = {
+    "highpoly": ("radius", "element_range", "element_size_range", "negative_chance",
+                 "sampler", "polygonizer", "resolution", "noise_scale", "strength", "weights",
+                 "displacement"),
+    "lowpoly": ("lowpoly_mode", "decimate_ratio", "target_triangles"),
+    "unwrapped": ("unwrapper", "island_margin"),
+}
+
+STAGE_ORDER = ("highpoly", "lowpoly", "unwrapped")
+
+# Works out the key for every stage of the asteroid with this seed and
+# these settings. Returns None if the seed isn't an integer (if it's None,
+# or a random number generator), since then the asteroid can't be
+# reproduced and so can't be cached.
+def stage_keys(seed, settings):
+    if not isinstance(seed, int):
+        return None
+
+    keys = {}
+    previous = {"seed": seed, "blender": list(bpy.app.version)}
+
+    for stage in STAGE_ORDER:
+        params = {
+            "stage": stage,
+            "previous": previous,
+            "settings": dict((k, settings[k]) for k in STAGE_SETTINGS[stage]),
+        }
+        keys[stage] = cache_key(params)
+        previous = keys[stage]
+
+    return keys
+
+# Saves an object's mesh into the cache under 'key'
+def save_mesh_stage(cache, key, obj):
+    handle, path = tempfile.mkstemp(suffix=".blend")
+    os.close(handle)
+
+    try:
+        bpy.data.libraries.write(path, {obj.data}, fake_user=True)
+        cache.store(key, {"mesh": path})
+    finally:
+        os.remove(path)
+
+# Loads a mesh from the cache, and adds a new object that uses it to the
+# scene. Returns None if the mesh isn't in the cache.
+def load_mesh_stage(cache, key, name):
+    files = cache.lookup(key)
+    if files is None or "mesh" not in files:
+        return None
+
+    try:
+        with bpy.data.libraries.load(files["mesh"]) as (data_from, data_to):
+            data_to.meshes = list(data_from.meshes)
+    except (OSError, RuntimeError):
+        # The entry may have been evicted since we looked it up
+        return None
+
+    if len(data_to.meshes) != 1 or data_to.meshes[0] is None:
+        return None
+
+    mesh = data_to.meshes[0]
+    mesh.use_fake_user = False
+
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.scene.objects.link(obj)
+    return obj
+
+# Returns the object for a stage: loaded from the cache if it's there, and
+# otherwise made by calling 'build' (and then stored in the cache). If
+# there's no cache or no key, this just calls 'build'.
+def cached_stage(cache, keys, stage, name, build):
+    if cache is None or keys is None:
+        return build()
+
+    obj = load_mesh_stage(cache, keys[stage], name)
+    if obj is not None:
+        print("Using cached %s mesh for %s" % (stage, name))
+        return obj
+
+    obj = build()
+    save_mesh_stage(cache, keys[stage], obj)
+    return obj
@@ -0,0 +1,183 @@
+import numpy as np
+
+# Unwraps meshes without Blender's operators, working on the arrays that a
+# MeshBuffers reads. It follows the same plan as Smart UV Project:
+#
+# 1. Split the mesh into charts: starting from the biggest polygon not in
+#    a chart yet, keep adding neighbouring polygons that face within
+#    'angle_limit' degrees of it.
+# 2. Flatten each chart by projecting it onto the plane that faces along
+#    its average normal, and turn it so its bounding box is as small as
+#    possible.
+# 3. Pack the charts into the unit square.
+#
+# Everything is done per loop, so polygons of any size are fine, and the
+# result can be written straight into a UV layer.
+
+# Works out which loop follows each loop around its polygon, and which
+# polygon each loop is in
+def loop_topology(loop_start, loop_total):
+    loop_polygon = np.repeat(np.arange(len(loop_start)), loop_total)
+    position = np.arange(len(loop_polygon)) - loop_start[loop_polygon]
+    next_loop = loop_start[loop_polygon] + (position + 1) % loop_total[loop_polygon]
+    return loop_polygon, next_loop
+
+# Returns each polygon's normal and area
+def polygon_normals(vertices, loop_vertices, loop_start, loop_total):
+    loop_polygon, next_loop = loop_topology(loop_start, loop_total)
+
+    # Newell's method: sum the cross products of each edge's ends, relative
+    # to the polygon's first corner
+    first = vertices[loop_vertices[loop_start[loop_polygon]]]
+    a = vertices[loop_vertices] - first
+    b = vertices[loop_vertices[next_loop]] - first
+    normals = np.zeros((len(loop_start), 3))
+    np.add.at(normals, loop_polygon, np.cross(a, b))
+
+    length = np.sqrt((normals ** 2).sum(axis=1))
+    return normals / np.maximum(length, 1e-12)[:, None], 0.5 * length
+
+# Returns a list of the polygons next to each polygon (sharing an edge)
+def polygon_neighbours(loop_vertices, loop_start, loop_total):
+    loop_polygon, next_loop = loop_topology(loop_start, loop_total)
+
+    edges = np.sort(np.stack([loop_vertices, loop_vertices[next_loop]], axis=1), axis=1)
+    edges, edge_index = np.unique(edges, axis=0, return_inverse=True)
+    edge_index = edge_index.ravel()
+
+    # Pair up the loops that run along the same edge
+    order = np.argsort(edge_index, kind="stable")
+    sorted_edges = edge_index[order]
+    pairs = np.flatnonzero(sorted_edges[1:] == sorted_edges[:-1])
+
+    neighbours = [[] for polygon in range(len(loop_start))]
+    for a, b in zip(loop_polygon[order[pairs]].tolist(), loop_polygon[order[pairs + 1]].tolist()):
+        if a != b:
+            neighbours[a].append(b)
+            neighbours[b].append(a)
+    return neighbours
+
+# Splits the polygons into charts. Returns the chart each polygon is in.
+def segment_charts(normals, areas, neighbours, angle_limit=66.0):
+    limit = np.cos(np.radians(angle_limit))
+    chart = np.full(len(normals), -1, dtype=np.int64)
+    count = 0
+
+    for seed in np.argsort(-areas, kind="stable").tolist():
+        if chart[seed] >= 0:
+            continue
+
+        # Polygons have to face close enough to both the seed and the
+        # chart so far, or charts can curl round far enough to overlap
+        # themselves once they're flattened
+        direction = normals[seed]
+        total = normals[seed] * areas[seed]
+        chart[seed] = count
+        queue = [seed]
+        while queue:
+            polygon = queue.pop(0)
+            for neighbour in neighbours[polygon]:
+                if chart[neighbour] >= 0 or normals[neighbour] @ direction < limit:
+                    continue
+                if normals[neighbour] @ total < limit * np.sqrt(total @ total):
+                    continue
+                chart[neighbour] = count
+                total = total + normals[neighbour] * areas[neighbour]
+                queue.append(neighbour)
+        count += 1
+
+    return chart
+
+# Returns two unit vectors that, with 'axis', make a right-handed frame
+def plane_basis(axis):
+    helper = np.array([1.0, 0.0, 0.0]) if abs(axis[0]) < 0.9 else np.array([0.0, 1.0, 0.0])
+    u = np.cross(helper, axis)
+    u /= np.linalg.norm(u)
+    return u, np.cross(axis, u)
+
+# Flattens every chart. Returns the UV of every loop, in the same units as
+# the mesh, with each chart's bounding box starting at (0, 0), and the
+# size of each chart's bounding box.
+def flatten_charts(vertices, loop_vertices, loop_polygon, chart, normals, areas):
+    chart_count = chart.max() + 1 if len(chart) else 0
+    loop_chart = chart[loop_polygon]
+    positions = vertices[loop_vertices]
+
+    axes = np.zeros((chart_count, 3))
+    np.add.at(axes, chart, normals * areas[:, None])
+
+    uvs = np.zeros((len(loop_vertices), 2))
+    sizes = np.zeros((chart_count, 2))
+
+    loops_by_chart = np.argsort(loop_chart, kind="stable")
+    bounds = np.searchsorted(loop_chart[loops_by_chart], np.arange(chart_count + 1))
+
+    for index in range(chart_count):
+        loops = loops_by_chart[bounds[index]:bounds[index + 1]]
+        axis = axes[index]
+        length = np.linalg.norm(axis)
+        axis = axis / length if length > 1e-12 else normals[chart == index][0]
+
+        u, v = plane_basis(axis)
+        flat = np.stack([positions[loops] @ u, positions[loops] @ v], axis=1)
+
+        # Line the chart up with its longest direction, which usually gives
+        # a tight bounding box
+        centred = flat - flat.mean(axis=0)
+        eigenvalues, eigenvectors = np.linalg.eigh(centred.T @ centred)
+        rotation = eigenvectors[:, ::-1]
+        if np.linalg.det(rotation) < 0:
+            rotation[:, 1] = -rotation[:, 1]
+        flat = centred @ rotation
+
+        low = flat.min(axis=0)
+        uvs[loops] = flat - low
+        sizes[index] = flat.max(axis=0) - low
+
+    return uvs, sizes
+
+# Places boxes of the given sizes in rows (tallest first), in a square-ish
+# area. Returns the corner of each box and the size of the whole area.
+def shelf_pack(sizes):
+    order = np.argsort(-sizes[:, 1], kind="stable")
+    width = max(np.sqrt((sizes[:, 0] * sizes[:, 1]).sum() * 1.2), sizes[:, 0].max())
+
+    corners = np.zeros_like(sizes)
+    x = y = row_height = 0.0
+    used_width = 0.0
+    for box in order.tolist():
+        box_width, box_height = sizes[box]
+        if x > 0 and x + box_width > width:
+            x, y = 0.0, y + row_height
+            row_height = 0.0
+        corners[box] = (x, y)
+        x += box_width
+        used_width = max(used_width, x)
+        row_height = max(row_height, box_height)
+
+    return corners, (used_width, y + row_height)
+
+# Unwraps a mesh given as MeshBuffers-style arrays. 'margin' is the space
+# to leave around each chart, in the mesh's units, like Smart UV Project's
+# island margin. Returns the UV of every loop, with shape (loops, 2), and
+# the chart each polygon ended up in.
+def unwrap(vertices, loop_vertices, loop_start, loop_total, angle_limit=66.0, margin=0.1):
+    vertices = np.asarray(vertices, dtype=np.float64)
+    loop_vertices = np.asarray(loop_vertices, dtype=np.int64)
+    loop_start = np.asarray(loop_start, dtype=np.int64)
+    loop_total = np.asarray(loop_total, dtype=np.int64)
+
+    normals, areas = polygon_normals(vertices, loop_vertices, loop_start, loop_total)
+    neighbours = polygon_neighbours(loop_vertices, loop_start, loop_total)
+    chart = segment_charts(normals, areas, neighbours, angle_limit)
+
+    loop_polygon, next_loop = loop_topology(loop_start, loop_total)
+    uvs, sizes = flatten_charts(vertices, loop_vertices, loop_polygon, chart, normals, areas)
+
+    corners, (width, height) = shelf_pack(sizes + 2 * margin)
+
+    # Move every chart into place, and scale everything to fit in 0-1
+    uvs += corners[chart[loop_polygon]] + margin
+    uvs /= max(width, height, 1e-12)
+
+    return uvs, chart
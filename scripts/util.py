@@ -1,4 +1,8 @@
-import bpy, random, math; from mathutils import Euler
+import bpy, random, math, hashlib; from mathutils import Euler
+import numpy as np
+
+from mesh_buffers import shared_buffers
+from metaball_sampler import ELEMENT_DTYPE
 
 # Selects or deselects all objects in the scene.
 def select_all(select=True):
@@ -6,27 +10,87 @@ def select_all(select=True):
             o.select = select
     
 
-# Deletes all objects in the scene.
-def reset():    
+# The kinds of datablock that generating an asteroid makes, in the order
+# they have to be removed in: each kind is only used by the kinds before it
+# (objects use meshes and metaballs, meshes use materials, and so on)
+DATABLOCK_TYPES = ("objects", "meshes", "metaballs", "materials", "textures", "images")
+
+# The datablocks that were in the file before the first reset; reset never
+# removes these
+original_datablocks = None
+
+# Returns the address of every datablock of the kinds we clean up
+def datablock_snapshot():
+    return dict((kind, set(block.as_pointer() for block in getattr(bpy.data, kind)))
+        for kind in DATABLOCK_TYPES)
+
+# Removes every datablock that isn't in 'keep' (a datablock_snapshot), isn't
+# kept with a fake user, and isn't used by anything. Returns how many were
+# removed.
+def purge_datablocks(keep):
+    removed = 0
+    for kind in DATABLOCK_TYPES:
+        collection = getattr(bpy.data, kind)
+        for block in list(collection):
+            if block.as_pointer() in keep[kind] or block.use_fake_user or block.users > 0:
+                continue
+            collection.remove(block)
+            removed += 1
+    return removed
+
+# Deletes all objects in the scene. Unless 'purge' is False, it also frees
+# everything that earlier runs made (meshes, metaballs, materials, textures
+# and images), so that a long batch doesn't keep using more memory, and
+# names don't pile up .001, .002 suffixes.
+def reset(purge=True):
+    global original_datablocks
+    if original_datablocks is None:
+        original_datablocks = datablock_snapshot()
+
     # Unlink all objects in the scene
     for obj in bpy.context.scene.objects:
         bpy.context.scene.objects.unlink(obj)
     bpy.context.scene.update()
+
+    if purge:
+        purge_datablocks(original_datablocks)
     
 
-def random_rotation():
+# Returns a random number generator for a seed. If you pass in a
+# random.Random, you get the same one back, so that several functions can
+# share a generator. A seed of None gives an unpredictable generator.
+def make_rng(seed=None):
+    if isinstance(seed, random.Random):
+        return seed
+    return random.Random(seed)
+
+# Works out the seed for one asteroid in a batch from the batch's master
+# seed. This uses a hash rather than Python's hash() so that every process
+# (and every run) agrees on the result.
+def derive_seed(master_seed, index):
+    digest = hashlib.sha256(("%d:%d" % (master_seed, index)).encode("ascii")).digest()
+    return int.from_bytes(digest[:8], "little")
+
+# Turns a seed (an int, a random.Random or None) into a 64-bit number, for
+# random number generators that need one, like metaball_sampler.py's
+def seed_bits(seed):
+    if isinstance(seed, int):
+        return seed % 2**64
+    return make_rng(seed).getrandbits(64)
+
+def random_rotation(rng=random):
     angles = (
-            random.uniform(0, 2*math.pi),
-            random.uniform(0, 2*math.pi),    
-            random.uniform(0, 2*math.pi)
+            rng.uniform(0, 2*math.pi),
+            rng.uniform(0, 2*math.pi),    
+            rng.uniform(0, 2*math.pi)
         )
     return Euler(angles, 'XYZ').to_quaternion()
  
 # Generates a random point inside a sphere
-def point_inside_sphere(radius):
-    phi = random.uniform(0,2 * math.pi)
-    costheta = random.uniform(-1,1)
-    u = random.uniform(0,1)
+def point_inside_sphere(radius, rng=random):
+    phi = rng.uniform(0,2 * math.pi)
+    costheta = rng.uniform(-1,1)
+    u = rng.uniform(0,1)
 
     theta = math.acos( costheta )
     r = radius * math.pow(u, 1/3.)
@@ -35,4 +99,64 @@ def point_inside_sphere(radius):
     y = r * math.sin( theta) * math.sin( phi )
     z = r * math.cos( theta )
 
-    return (x,y,z)
\ No newline at end of file
+    return (x,y,z)
+
+# Reads a mesh into NumPy arrays, splitting its polygons into triangles.
+# Returns (vertices, triangles, uvs): vertex positions, the vertex indices
+# of each triangle's corners, and the UV of each triangle corner from the
+# active UV map (or None if the mesh doesn't have one). The mesh is read
+# with the shared MeshBuffers, unless another is passed in.
+def mesh_arrays(mesh, buffers=None):
+    buffers = (buffers or shared_buffers).read(mesh)
+    return buffers.triangles()
+
+# Returns the shading normal of each triangle corner of a mesh, in the same
+# order as the triangles from mesh_arrays
+def mesh_corner_normals(mesh, buffers=None):
+    buffers = (buffers or shared_buffers).read(mesh)
+    triangle_loops, polygon = buffers.triangle_loops()
+    return buffers.read_loop_normals(mesh)[triangle_loops]
+
+# Reads a metaball object's elements into an array of
+# metaball_sampler.ELEMENT_DTYPE, for polygonize.py
+def metaball_elements(mball_object):
+    metaball = mball_object.data
+    count = len(metaball.elements)
+    elements = np.zeros(count, dtype=ELEMENT_DTYPE)
+
+    def read(attribute, width=1, dtype=np.float32):
+        values = np.empty(count * width, dtype=dtype)
+        metaball.elements.foreach_get(attribute, values)
+        return values.reshape(-1, width) if width > 1 else values
+
+    elements["co"] = read("co", 3)
+    elements["size"] = np.stack([read("size_x"), read("size_y"), read("size_z")], axis=1)
+    elements["rotation"] = read("rotation", 4)
+    elements["negative"] = read("use_negative", dtype=np.bool_)
+
+    return elements
+
+# Copies an image's pixels into an array of shape (height, width, 4),
+# bottom row first
+def image_pixels(image):
+    width, height = image.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+
+    # Newer Blenders can copy the pixels in one go
+    if hasattr(image.pixels, "foreach_get"):
+        image.pixels.foreach_get(pixels)
+    else:
+        pixels[:] = image.pixels[:]
+
+    return pixels.reshape(height, width, 4)
+
+# Makes a new mesh object from arrays of vertex positions and triangles,
+# and adds it to the scene. 'uvs', if given, has one UV per triangle
+# corner, like mesh_arrays returns.
+def mesh_object_from_arrays(name, vertices, faces, smooth=True, uvs=None, buffers=None):
+    buffers = (buffers or shared_buffers).set_triangles(vertices, faces, smooth=smooth, uvs=uvs)
+    mesh = buffers.to_mesh(bpy.data.meshes.new(name))
+
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.scene.objects.link(obj)
+    return obj
@@ -0,0 +1,189 @@
+import numpy as np
+
+from unwrap import loop_topology
+
+# Packs the islands of a UV map as tightly as possible, so more of each
+# baked texture is spent on the asteroid and less on empty space. The
+# space between islands is given in pixels of the texture they'll be baked
+# into, so the padding that stops colours bleeding across islands is the
+# same no matter how the islands end up scaled.
+#
+# Islands are placed with a skyline packer: the packer tracks the outline
+# of the top of everything placed so far, and puts each island (biggest
+# first, turned 90 degrees if that fits better) wherever its top ends up
+# lowest. This is tried with a few different widths, and the squarest
+# result wins.
+
+# Works out which island of the UV map each polygon is in. Polygons are in
+# the same island if they share an edge, and the edge has the same UVs on
+# both sides.
+def uv_islands(loop_vertices, loop_start, loop_total, uvs):
+    loop_polygon, next_loop = loop_topology(loop_start, loop_total)
+
+    # Key each loop's edge by its vertices and UVs, in a fixed direction
+    # so both sides of a shared edge get the same key
+    start = np.concatenate([loop_vertices[:, None], uvs], axis=1)
+    end = np.concatenate([loop_vertices[next_loop][:, None], uvs[next_loop]], axis=1)
+    flip = loop_vertices > loop_vertices[next_loop]
+    keys = np.concatenate([np.where(flip[:, None], end, start), np.where(flip[:, None], start, end)], axis=1)
+
+    keys, edge = np.unique(keys, axis=0, return_inverse=True)
+    edge = edge.ravel()
+    order = np.argsort(edge, kind="stable")
+    pairs = np.flatnonzero(edge[order][1:] == edge[order][:-1])
+    a = loop_polygon[order[pairs]]
+    b = loop_polygon[order[pairs + 1]]
+
+    # Spread the smallest polygon index through each island
+    labels = np.arange(len(loop_start))
+    while True:
+        lowest = np.minimum(labels[a], labels[b])
+        updated = labels.copy()
+        np.minimum.at(updated, a, lowest)
+        np.minimum.at(updated, b, lowest)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            break
+        labels = updated
+
+    return np.unique(labels, return_inverse=True)[1].ravel()
+
+# Returns the height of the skyline under a box of width 'width' whose
+# left side is at the start of segment 'index', or None if it doesn't fit
+def skyline_fit(skyline, index, width, bin_width):
+    x = skyline[index][0]
+    if x + width > bin_width + 1e-9:
+        return None
+
+    y = 0.0
+    remaining = width
+    while remaining > 1e-12:
+        if index >= len(skyline):
+            return None
+        segment_x, segment_y, segment_width = skyline[index]
+        y = max(y, segment_y)
+        remaining -= segment_width - (x - segment_x if segment_x < x else 0)
+        x = segment_x + segment_width
+        index += 1
+    return y
+
+# Puts a box on the skyline at segment 'index'
+def skyline_place(skyline, index, width, height, y):
+    x = skyline[index][0]
+    skyline.insert(index, [x, y + height, width])
+
+    # Cut away whatever the box now covers
+    right = x + width
+    following = index + 1
+    while following < len(skyline) and skyline[following][0] < right - 1e-12:
+        segment = skyline[following]
+        segment_right = segment[0] + segment[2]
+        if segment_right <= right + 1e-12:
+            del skyline[following]
+        else:
+            segment[2] = segment_right - right
+            segment[0] = right
+            break
+
+    # Join neighbouring segments at the same height
+    merged = [skyline[0]]
+    for segment in skyline[1:]:
+        if abs(segment[1] - merged[-1][1]) < 1e-12:
+            merged[-1][2] += segment[2]
+        else:
+            merged.append(segment)
+    skyline[:] = merged
+
+# Packs boxes into a strip 'bin_width' wide. Returns the corner of each
+# box, whether each box was turned 90 degrees, and how tall the strip got.
+def skyline_pack(sizes, bin_width, allow_rotation=True):
+    skyline = [[0.0, 0.0, bin_width]]
+    corners = np.zeros_like(sizes)
+    rotated = np.zeros(len(sizes), dtype=bool)
+
+    for box in np.argsort(-sizes.max(axis=1), kind="stable").tolist():
+        best = None
+        for rotate in ((False, True) if allow_rotation else (False,)):
+            width, height = sizes[box][::-1] if rotate else sizes[box]
+            for index in range(len(skyline)):
+                y = skyline_fit(skyline, index, width, bin_width)
+                if y is None:
+                    continue
+                score = (y + height, skyline[index][0])
+                if best is None or score < best[0]:
+                    best = (score, index, width, height, rotate, y)
+
+        if best is None:
+            return None
+
+        score, index, width, height, rotate, y = best
+        corners[box] = (skyline[index][0], y)
+        rotated[box] = rotate
+        skyline_place(skyline, index, width, height, y)
+
+    return corners, rotated, max(segment[1] for segment in skyline)
+
+# Packs boxes into a square. Returns their corners, whether each was
+# turned, and the side of the square.
+def pack_boxes(sizes, attempts=8):
+    area = (sizes[:, 0] * sizes[:, 1]).sum()
+    narrowest = sizes.min(axis=1).max()
+
+    best = None
+    for stretch in np.linspace(1.0, 1.4, attempts):
+        bin_width = max(np.sqrt(area) * stretch, narrowest)
+        packed = skyline_pack(sizes, bin_width)
+        if packed is None:
+            continue
+        corners, rotated, height = packed
+        used_width = (corners[:, 0] + np.where(rotated, sizes[:, 1], sizes[:, 0])).max()
+        side = max(used_width, height)
+        if best is None or side < best[2]:
+            best = (corners, rotated, side)
+
+    return best
+
+# Returns how much of the unit square the UV map covers
+def uv_utilization(uvs, loop_start, loop_total):
+    loop_polygon, next_loop = loop_topology(loop_start, loop_total)
+    cross = uvs[:, 0] * uvs[next_loop, 1] - uvs[next_loop, 0] * uvs[:, 1]
+    areas = np.zeros(len(loop_start))
+    np.add.at(areas, loop_polygon, cross)
+    return float(np.abs(areas).sum() * 0.5)
+
+# Repacks a UV map's islands into the unit square, leaving 'padding'
+# pixels between them (and half that around the edges) on a texture that's
+# 'texture_size' pixels across. Returns the new UVs and the fraction of the
+# texture they cover.
+def pack_uvs(loop_vertices, loop_start, loop_total, uvs, texture_size=1024, padding=4, iterations=4):
+    loop_vertices = np.asarray(loop_vertices, dtype=np.int64)
+    loop_start = np.asarray(loop_start, dtype=np.int64)
+    loop_total = np.asarray(loop_total, dtype=np.int64)
+    uvs = np.asarray(uvs, dtype=np.float64)
+
+    loop_polygon, next_loop = loop_topology(loop_start, loop_total)
+    loop_island = uv_islands(loop_vertices, loop_start, loop_total, uvs)[loop_polygon]
+    island_count = loop_island.max() + 1
+
+    low = np.full((island_count, 2), np.inf)
+    high = np.full((island_count, 2), -np.inf)
+    np.minimum.at(low, loop_island, uvs)
+    np.maximum.at(high, loop_island, uvs)
+    sizes = high - low
+    local = uvs - low[loop_island]
+
+    # The padding depends on how much the islands get scaled by, which
+    # depends on the padding; a few rounds settles it
+    scale = 1.0 / np.sqrt(max((sizes[:, 0] * sizes[:, 1]).sum(), 1e-12))
+    for iteration in range(iterations):
+        margin = 0.5 * padding / (texture_size * scale)
+        corners, rotated, side = pack_boxes(sizes + 2 * margin)
+        scale = 1.0 / side
+
+    # Turning an island 90 degrees anticlockwise keeps its winding
+    turned = rotated[loop_island]
+    local = np.where(turned[:, None],
+        np.stack([sizes[loop_island, 1] - local[:, 1], local[:, 0]], axis=1), local)
+
+    packed = (corners[loop_island] + margin + local) * scale
+    return packed, uv_utilization(packed, loop_start, loop_total)
@@ -0,0 +1,67 @@
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from asset_cache import AssetCache, cache_key, folder_size
+
+# Writes a file of 'size' bytes and returns its path
+def make_file(directory, name, size=1000):
+    path = os.path.join(str(directory), name)
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return path
+
+def test_keys_ignore_order_but_not_values():
+    assert cache_key({"a": 1, "b": [1, 2]}) == cache_key({"b": (1, 2), "a": 1})
+    assert cache_key({"a": 1}) != cache_key({"a": 2})
+
+def test_store_and_restore(tmp_path):
+    cache = AssetCache(str(tmp_path / "cache"))
+    source = make_file(tmp_path, "rock.fbx")
+    cache.store("a", {"fbx": source})
+
+    destination = str(tmp_path / "out.fbx")
+    assert cache.restore("a", {"fbx": destination})
+    with open(source, "rb") as f, open(destination, "rb") as g:
+        assert f.read() == g.read()
+
+    # Roles that weren't stored can't be restored
+    assert not cache.restore("a", {"fbx": destination, "normal": str(tmp_path / "out.png")})
+    assert not cache.restore("b", {"fbx": destination})
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = AssetCache(str(tmp_path / "cache"))
+    for key in ("a", "b"):
+        cache.store(key, {"fbx": make_file(tmp_path, key + ".fbx")})
+
+    # Make "b" the older of the two, then use "a", so "b" is the least
+    # recently used
+    os.utime(cache.entry_path("a"), (1000, 1000))
+    os.utime(cache.entry_path("b"), (2000, 2000))
+    assert cache.lookup("a") is not None
+
+    # Room for two entries but not three
+    cache.max_bytes = int(2.5 * folder_size(cache.entry_path("a")))
+    cache.store("c", {"fbx": make_file(tmp_path, "c.fbx")})
+
+    assert cache.lookup("a") is not None
+    assert cache.lookup("b") is None
+    assert cache.lookup("c") is not None
+
+def test_failed_store_leaves_nothing_behind(tmp_path):
+    cache = AssetCache(str(tmp_path / "cache"))
+
+    # The second file doesn't exist, so the store fails partway through
+    cache.store("a", {"fbx": make_file(tmp_path, "a.fbx"), "normal": str(tmp_path / "missing.png")})
+
+    # Nothing half-written is visible, and the staging folder is gone
+    assert cache.lookup("a") is None
+    assert os.listdir(cache.directory) == []
+
+def test_storing_an_existing_key_keeps_the_first_entry(tmp_path):
+    cache = AssetCache(str(tmp_path / "cache"))
+    first = make_file(tmp_path, "first.fbx", 10)
+    cache.store("a", {"fbx": first})
+    cache.store("a", {"fbx": make_file(tmp_path, "second.fbx", 20)})
+
+    assert os.path.getsize(cache.lookup("a")["fbx"]) == 10
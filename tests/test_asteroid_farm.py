@@ -0,0 +1,20 @@
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from asteroid_farm import make_shards, run_farm
+
+def test_shards_cover_the_range():
+    shards = make_shards(10, 11, 4)
+    assert shards == [(10, 3), (13, 3), (16, 3), (19, 2)]
+    assert make_shards(0, 2, 8) == [(0, 1), (1, 1)]
+
+def test_missing_blender_fails_the_shards(tmpdir):
+    # A Blender that can't be started fails every asteroid in its shard,
+    # and says why in the shard's log, instead of stopping the farm
+    results = run_farm(0, 4, 2, 1, blender=str(tmpdir.join("no_blender")), work_dir=str(tmpdir))
+
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert not any(result["ok"] for result in results)
+    assert all("Couldn't start Blender" in result["error"] for result in results)
+    assert "no_blender" in tmpdir.join("shard_0.log").read()
@@ -0,0 +1,36 @@
+import os, sys, struct
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from dds import encode_dds
+
+# Returns the FourCC from a DDS file's header, and the DXGI format from its
+# DX10 header (or None if it doesn't have one)
+def dds_format(data):
+    fourcc = data[84:88]
+    if fourcc != b"DX10":
+        return fourcc, None
+    return fourcc, struct.unpack("<I", data[128:132])[0]
+
+def test_colour_maps_are_srgb():
+    pixels = np.random.RandomState(0).uniform(0, 1, (16, 16, 4))
+
+    assert dds_format(encode_dds(pixels, "bc1", "color")) == (b"DX10", 72)
+    assert dds_format(encode_dds(pixels, "bc7", "color")) == (b"DX10", 99)
+    assert dds_format(encode_dds(pixels, "bc7", "data")) == (b"DX10", 98)
+
+def test_normal_and_data_maps_keep_their_fourcc():
+    pixels = np.random.RandomState(0).uniform(0, 1, (16, 16, 4))
+
+    assert dds_format(encode_dds(pixels, "bc5", "normal")) == (b"ATI2", None)
+    assert dds_format(encode_dds(pixels, "bc4", "data")) == (b"ATI1", None)
+
+def test_dx10_header_moves_the_blocks_along():
+    pixels = np.random.RandomState(0).uniform(0, 1, (16, 16, 4))
+    legacy = encode_dds(pixels, "bc1", "data")
+    srgb = encode_dds(pixels, "bc1", "color")
+
+    # Mips of 16x16, 8x8, 4x4, 2x2 and 1x1: 16 + 4 + 1 + 1 + 1 blocks
+    assert len(legacy) == 128 + 23 * 8
+    assert len(srgb) == len(legacy) + 20
@@ -0,0 +1,68 @@
+import os, sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from decimate import decimate_lods
+
+# A bumpy sphere made from a subdivided cube, with each side of the cube
+# as its own UV island, so there are seams all the way round it
+def cube_sphere(n):
+    indices = {}
+    vertices, faces, uvs = [], [], []
+
+    def vertex(point):
+        key = tuple(np.round(point, 6))
+        if key not in indices:
+            indices[key] = len(vertices)
+            vertices.append(point)
+        return indices[key]
+
+    side = 0
+    for a, b, c in ((0, 1, 2), (1, 2, 0), (2, 0, 1)):
+        for sign in (-1, 1):
+            for i in range(n):
+                for j in range(n):
+                    corners, corner_uvs = [], []
+                    for x, y in ((i, j), (i + 1, j), (i + 1, j + 1), (i, j + 1)):
+                        point = np.zeros(3)
+                        point[a], point[b], point[c] = 2.0 * x / n - 1, 2.0 * y / n - 1, sign
+                        corners.append(vertex(point))
+                        corner_uvs.append(((side % 3 + 0.9 * x / n) / 3, (side // 3 + 0.9 * y / n) / 2))
+
+                    order = (0, 1, 2, 0, 2, 3) if sign > 0 else (0, 2, 1, 0, 3, 2)
+                    faces += [[corners[k] for k in order[:3]], [corners[k] for k in order[3:]]]
+                    uvs += [[corner_uvs[k] for k in order[:3]], [corner_uvs[k] for k in order[3:]]]
+            side += 1
+
+    vertices = np.array(vertices)
+    vertices /= np.linalg.norm(vertices, axis=1)[:, None]
+    vertices *= 1 + 0.1 * np.sin(3 * vertices[:, :1]) * np.cos(2 * vertices[:, 1:2])
+    return vertices, np.array(faces), np.array(uvs, dtype=np.float64)
+
+def test_seams_collapse_to_every_level():
+    vertices, faces, uvs = cube_sphere(10)
+    lods = decimate_lods(vertices, faces, (0.5, 0.25, 0.125), uvs)
+
+    assert [len(lod_faces) for _, lod_faces, _ in lods] == [600, 300, 150]
+
+    # Every corner is still one of the original corners, position and UV,
+    # so the original textures fit, and the mesh is still closed
+    original = set(tuple(np.append(vertices[faces[face, corner]], uvs[face, corner]))
+        for face in range(len(faces)) for corner in range(3))
+    for lod_vertices, lod_faces, lod_uvs in lods:
+        for face in range(len(lod_faces)):
+            for corner in range(3):
+                assert tuple(np.append(lod_vertices[lod_faces[face, corner]], lod_uvs[face, corner])) in original
+
+        edges = np.sort(np.concatenate([lod_faces[:, [0, 1]], lod_faces[:, [1, 2]], lod_faces[:, [2, 0]]]), axis=1)
+        assert (np.unique(edges, axis=0, return_counts=True)[1] == 2).all()
+
+def test_unreachable_levels_are_left_out():
+    vertices, faces, uvs = cube_sphere(6)
+
+    # Every pair of triangles is its own island, so nothing can collapse
+    uvs = uvs + (np.arange(len(faces)) // 2)[:, None, None] * 0.01
+    with pytest.warns(UserWarning, match="skipping the last 2 levels"):
+        assert decimate_lods(vertices, faces, (0.5, 0.25), uvs) == []
@@ -0,0 +1,45 @@
+import os, sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from displace import displace_vertices, voronoi_value, worley
+
+def sphere_points(count=5000, seed=4):
+    points = np.random.RandomState(seed).normal(0, 1, (count, 3))
+    return points / np.linalg.norm(points, axis=1)[:, None]
+
+def test_vertices_move_along_normals_by_noise():
+    vertices = sphere_points()
+    normals = vertices.copy()
+    original = vertices.copy()
+
+    displace_vertices(vertices, normals, noise_scale=0.5, strength=0.5)
+
+    # Each vertex moves along its own normal, by (value - midlevel) * strength
+    moved = vertices - original
+    expected = (voronoi_value(original, 0.5) - 0.5) * 0.5
+    assert np.allclose(moved, expected[:, None] * normals)
+    assert np.std(expected) > 0.01
+
+def test_chunks_and_runs_agree():
+    vertices = sphere_points()
+    whole = displace_vertices(vertices.copy(), vertices, chunk_size=1 << 20)
+    chunked = displace_vertices(vertices.copy(), vertices, chunk_size=123)
+    again = displace_vertices(vertices.copy(), vertices, chunk_size=1 << 20)
+
+    assert np.array_equal(whole, chunked)
+    assert np.array_equal(whole, again)
+
+def test_worley_distances_are_sorted_and_smooth():
+    points = sphere_points(2000) * 3
+    distances = worley(points)
+
+    assert distances.shape == (2000, 4)
+    assert (np.diff(distances, axis=1) >= 0).all()
+
+    # Distances to fixed feature points can't change faster than the point
+    # moves
+    step = 1e-3
+    nudged = worley(points + step)
+    assert (np.abs(nudged - distances) <= np.sqrt(3) * step + 1e-9).all()
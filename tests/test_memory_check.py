@@ -0,0 +1,85 @@
+import os, sys, types
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+# util.py needs Blender's modules, but reset() and purge_datablocks() only
+# look at bpy.data and the scene's objects, so these stand in for them
+class FakeBlock:
+    def __init__(self, users=0, use_fake_user=False):
+        self.users = users
+        self.use_fake_user = use_fake_user
+
+    def as_pointer(self):
+        return id(self)
+
+class FakeCollection(list):
+    def remove(self, block):
+        list.remove(self, block)
+
+class FakeObjects(list):
+    def unlink(self, obj):
+        list.remove(self, obj)
+        obj.users -= 1
+
+fake_bpy = types.ModuleType("bpy")
+fake_mathutils = types.ModuleType("mathutils")
+fake_mathutils.Euler = None
+
+@pytest.fixture
+def util(monkeypatch):
+    monkeypatch.setitem(sys.modules, "bpy", fake_bpy)
+    monkeypatch.setitem(sys.modules, "mathutils", fake_mathutils)
+    sys.modules.pop("util", None)
+    import util
+
+    fake_bpy.data = types.SimpleNamespace(**dict((kind, FakeCollection()) for kind in util.DATABLOCK_TYPES))
+    fake_bpy.context = types.SimpleNamespace(scene=types.SimpleNamespace(objects=FakeObjects(), update=lambda: None))
+    yield util
+    sys.modules.pop("util", None)
+
+def counts(util):
+    return dict((kind, len(getattr(fake_bpy.data, kind))) for kind in util.DATABLOCK_TYPES)
+
+# Adds what one asteroid leaves behind: an object in the scene, and the
+# mesh, material and image it uses
+def fake_run():
+    obj = FakeBlock(users=1)
+    fake_bpy.data.objects.append(obj)
+    fake_bpy.context.scene.objects.append(obj)
+    fake_bpy.data.meshes.append(FakeBlock())
+    fake_bpy.data.materials.append(FakeBlock())
+    fake_bpy.data.images.append(FakeBlock())
+
+def test_purge_keeps_original_used_and_fake_user_blocks(util):
+    original = FakeBlock()
+    used = FakeBlock(users=2)
+    kept = FakeBlock(use_fake_user=True)
+    fake_bpy.data.meshes.extend([original, used, kept])
+    keep = util.datablock_snapshot()
+
+    fake_bpy.data.meshes.extend([FakeBlock(), FakeBlock()])
+    fake_bpy.data.images.append(FakeBlock())
+
+    assert util.purge_datablocks(keep) == 3
+    assert list(fake_bpy.data.meshes) == [original, used, kept]
+    assert len(fake_bpy.data.images) == 0
+
+def test_reset_leaves_datablocks_level(util):
+    fake_bpy.data.materials.append(FakeBlock())
+    util.reset()
+    baseline = counts(util)
+
+    for run in range(100):
+        fake_run()
+        util.reset()
+        assert counts(util) == baseline
+    assert len(fake_bpy.context.scene.objects) == 0
+
+def test_reset_without_purge_keeps_datablocks(util):
+    util.reset()
+    fake_run()
+    util.reset(purge=False)
+
+    assert counts(util)["meshes"] == 1
+    assert len(fake_bpy.context.scene.objects) == 0
@@ -0,0 +1,42 @@
+import os, sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from metaball_sampler import sample_metaball_elements, split_by_asteroid
+
+def test_same_seeds_give_same_elements():
+    seeds = [7, 123456789, 2**63 + 5, 42]
+    first = sample_metaball_elements(seeds)
+    second = sample_metaball_elements(seeds)
+
+    assert first.tobytes() == second.tobytes()
+
+def test_asteroid_only_depends_on_its_own_seed():
+    seeds = [7, 123456789, 2**63 + 5, 42]
+    batch = split_by_asteroid(sample_metaball_elements(seeds), len(seeds))
+
+    # Sampling each asteroid on its own, or in a different batch, gives the
+    # same elements
+    for index, seed in enumerate(seeds):
+        alone = sample_metaball_elements([seed])
+        for field in ("co", "size", "rotation", "negative"):
+            assert np.array_equal(alone[field], batch[index][field])
+
+    reordered = split_by_asteroid(sample_metaball_elements(seeds[::-1]), len(seeds))
+    for index in range(len(seeds)):
+        assert np.array_equal(reordered[len(seeds) - 1 - index]["co"], batch[index]["co"])
+
+def test_elements_follow_the_settings():
+    elements = sample_metaball_elements(np.arange(200), radius=2, element_range=(2, 4),
+        element_size_range=(0.5, 1.5), negative_chance=0.2)
+    per_asteroid = np.bincount(elements["asteroid"], minlength=200)
+
+    assert per_asteroid.min() >= 2 and per_asteroid.max() <= 4
+    assert (np.linalg.norm(elements["co"], axis=1) <= 2 + 1e-5).all()
+    assert (elements["size"] >= 0.5).all() and (elements["size"] <= 1.5).all()
+    assert np.allclose(np.linalg.norm(elements["rotation"], axis=1), 1, atol=1e-5)
+
+    # The first element of each asteroid is never negative
+    first = np.searchsorted(elements["asteroid"], np.arange(200))
+    assert not elements["negative"][first].any()
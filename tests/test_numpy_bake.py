@@ -0,0 +1,90 @@
+import os, sys
+import numpy as np
+
+# These tests run with a normal Python 3 and NumPy, without Blender:
+#
+#   python3 -m pytest tests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from numpy_bake import BVH, intersect_triangles, rasterize, dilate, bake_normal_map
+
+# Finds the nearest hit for every ray by testing it against every triangle
+def brute_force(vertices, faces, origins, directions):
+    corners = vertices[faces]
+    v0 = corners[:, 0]
+    e1 = corners[:, 1] - v0
+    e2 = corners[:, 2] - v0
+
+    best_t = np.full(len(origins), np.inf)
+    best_triangle = np.full(len(origins), -1)
+    for index in range(len(faces)):
+        t, u, v = intersect_triangles(origins, directions,
+            np.repeat(v0[index:index + 1], len(origins), axis=0),
+            np.repeat(e1[index:index + 1], len(origins), axis=0),
+            np.repeat(e2[index:index + 1], len(origins), axis=0))
+        closer = t < best_t
+        best_t[closer] = t[closer]
+        best_triangle[closer] = index
+    return best_t, best_triangle
+
+def test_bvh_matches_brute_force():
+    random = np.random.RandomState(1)
+
+    # A soup of small triangles scattered through a box
+    centres = random.uniform(-1, 1, (500, 3))
+    vertices = (centres[:, None, :] + random.normal(0, 0.1, (500, 3, 3))).reshape(-1, 3)
+    faces = np.arange(len(vertices)).reshape(-1, 3)
+
+    origins = random.uniform(-1.5, 1.5, (2000, 3))
+    directions = random.normal(0, 1, (2000, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+
+    expected_t, expected_triangle = brute_force(vertices, faces, origins, directions)
+    t, triangle, u, v = BVH(vertices, faces).intersect(origins, directions, batch_size=256)
+
+    assert (triangle >= 0).sum() > 100
+    assert np.array_equal(triangle >= 0, expected_triangle >= 0)
+    hit = triangle >= 0
+    assert np.allclose(t[hit], expected_t[hit])
+
+    # The hit point is where the ray says it is
+    corners = vertices[faces[triangle[hit]]]
+    points = (1 - u[hit] - v[hit])[:, None] * corners[:, 0] + u[hit][:, None] * corners[:, 1] + v[hit][:, None] * corners[:, 2]
+    assert np.allclose(points, origins[hit] + directions[hit] * t[hit][:, None])
+
+def test_rasterize_finds_every_texel_once():
+    # Two triangles covering the whole unit square
+    uvs = np.array([[[0, 0], [1, 0], [1, 1]], [[0, 0], [1, 1], [0, 1]]], dtype=np.float64)
+    xs, ys, triangles, weights = rasterize(uvs, 16, 8)
+
+    assert len(xs) == 16 * 8
+    assert len(np.unique(ys * 16 + xs)) == 16 * 8
+    assert np.allclose(weights.sum(axis=1), 1)
+
+    # The weights put each texel's centre back where it is
+    points = np.einsum("ij,ijk->ik", weights, uvs[triangles])
+    assert np.allclose(points, np.stack([(xs + 0.5) / 16, (ys + 0.5) / 8], axis=1))
+
+def test_dilate_grows_by_margin():
+    image = np.zeros((9, 9, 4), dtype=np.float32)
+    mask = np.zeros((9, 9), dtype=bool)
+    image[4, 4] = (1, 0.5, 0.25, 1)
+    mask[4, 4] = True
+
+    image, mask = dilate(image, mask, 2)
+
+    assert mask[2:7, 2:7].all()
+    assert mask.sum() == 25
+    assert np.allclose(image[mask], (1, 0.5, 0.25, 1))
+
+def test_flat_surface_bakes_flat_normals():
+    # The same square as both the low-poly and the high-poly mesh
+    vertices = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0]], dtype=np.float64)
+    faces = np.array([[0, 1, 2], [0, 2, 3]])
+    uvs = vertices[faces][..., :2]
+
+    image = bake_normal_map(vertices, faces, uvs, vertices, faces, size=(32, 32))
+
+    assert image.shape == (32, 32, 4)
+    assert np.allclose(image[..., :3], (0.5, 0.5, 1.0), atol=1e-5)
@@ -0,0 +1,55 @@
+import os, sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from metaball_sampler import sample_metaball_elements, split_by_asteroid
+from polygonize import polygonize_metaball, polygonize_metaball_adaptive, polygonize_to_budget
+
+def asteroid_elements(count=3):
+    return split_by_asteroid(sample_metaball_elements(np.arange(1, count + 1)), count)
+
+def test_surface_is_closed_and_manifold():
+    for elements in asteroid_elements():
+        vertices, faces = polygonize_metaball(elements, resolution=0.15)
+        assert len(faces) > 100
+
+        # Every edge is used by exactly two triangles, once in each
+        # direction, so there are no holes and the triangles all face the
+        # same way
+        directed = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+        assert len(np.unique(directed, axis=0)) == len(directed)
+        edges, uses = np.unique(np.sort(directed, axis=1), axis=0, return_counts=True)
+        assert (uses == 2).all()
+
+        # Neighbouring cells share their vertices, and no triangle is
+        # squashed into a line
+        assert len(np.unique(vertices, axis=0)) == len(vertices)
+        assert (faces[:, 0] != faces[:, 1]).all() and (faces[:, 1] != faces[:, 2]).all() and (faces[:, 2] != faces[:, 0]).all()
+
+        # Triangles face outwards: the enclosed volume is positive
+        corners = vertices[faces]
+        volume = np.einsum("ij,ij->i", corners[:, 0], np.cross(corners[:, 1], corners[:, 2])).sum() / 6
+        assert volume > 0
+
+# Returns every triangle of a mesh as a sorted tuple of its corners'
+# positions, so that meshes can be compared whatever order their vertices
+# and triangles are in
+def triangle_set(vertices, faces):
+    corners = np.round(vertices[faces], 6)
+    return sorted(tuple(sorted(map(tuple, triangle))) for triangle in corners)
+
+def test_adaptive_matches_dense():
+    for elements in asteroid_elements():
+        dense = polygonize_metaball(elements, resolution=0.15)
+        adaptive = polygonize_metaball_adaptive(elements, resolution=0.15)
+
+        assert len(adaptive[1]) == len(dense[1])
+        assert triangle_set(*adaptive) == triangle_set(*dense)
+
+def test_budget_lands_near_target():
+    for elements in asteroid_elements():
+        for target in (50, 500, 2000):
+            vertices, faces, resolution = polygonize_to_budget(elements, target)
+            assert abs(len(faces) - target) <= 0.1 * target
+            assert faces.max() < len(vertices)
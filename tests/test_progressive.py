@@ -0,0 +1,41 @@
+import os, sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from numpy_bake import BVH
+from progressive import upsample, nearby_triangles
+
+def test_upsample_rows_and_columns_match_whole_image():
+    image = np.random.RandomState(0).uniform(0, 1, (8, 8, 4))
+    whole = upsample(image, (32, 32))
+    rows, columns = np.array([0, 5, 31]), np.array([3, 4, 17, 30])
+
+    assert np.allclose(upsample(image, (32, 32), rows, columns), whole[np.ix_(rows, columns)])
+
+def test_nearby_triangles_keep_every_hit():
+    random = np.random.RandomState(2)
+
+    # A bumpy high-poly sheet, and points on the flat sheet under part of it
+    grid = np.linspace(-1, 1, 81)
+    xs, ys = np.meshgrid(grid, grid)
+    zs = 0.05 * np.sin(9 * xs) * np.cos(7 * ys)
+    vertices = np.stack([xs.ravel(), ys.ravel(), zs.ravel()], axis=1)
+    corner = (np.arange(80)[:, None] * 81 + np.arange(80)[None, :]).ravel()
+    faces = np.concatenate([np.stack([corner, corner + 1, corner + 82], axis=1),
+        np.stack([corner, corner + 82, corner + 81], axis=1)])
+
+    points = np.zeros((500, 3))
+    points[:, :2] = random.uniform(-0.5, 0.2, (500, 2))
+    directions = np.tile([0.0, 0.0, -1.0], (500, 1))
+    cage_extrusion = 0.1
+
+    near = nearby_triangles(vertices, faces, points, cage_extrusion)
+    assert 0 < near.sum() < len(faces) // 2
+
+    origins = points - directions * cage_extrusion
+    _, expected, _, _ = BVH(vertices, faces).intersect(origins, directions)
+    _, hit, _, _ = BVH(vertices, faces[near]).intersect(origins, directions)
+
+    assert (expected >= 0).all()
+    assert np.array_equal(np.flatnonzero(near)[hit], expected)
@@ -0,0 +1,50 @@
+import os, sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from metaball_sampler import sample_metaball_elements
+from polygonize import polygonize_metaball
+from unwrap import unwrap
+
+# A sampled asteroid, as MeshBuffers-style arrays
+def asteroid_loops(seed=3, resolution=0.2):
+    vertices, faces = polygonize_metaball(sample_metaball_elements([seed]), resolution=resolution)
+    return vertices, faces.ravel(), np.arange(0, faces.size, 3), np.full(len(faces), 3)
+
+# Returns (low, high) corners of each group's UVs' bounding box
+def bounding_boxes(uvs, groups):
+    count = groups.max() + 1
+    low = np.full((count, 2), np.inf)
+    high = np.full((count, 2), -np.inf)
+    np.minimum.at(low, groups, uvs)
+    np.maximum.at(high, groups, uvs)
+    return low, high
+
+# Returns the smallest gap between any two of the boxes, along whichever
+# axis separates them; it's negative if any two overlap
+def smallest_gap(low, high):
+    gap_x = np.maximum(low[:, None, 0] - high[None, :, 0], low[None, :, 0] - high[:, None, 0])
+    gap_y = np.maximum(low[:, None, 1] - high[None, :, 1], low[None, :, 1] - high[:, None, 1])
+    gap = np.maximum(gap_x, gap_y)
+    np.fill_diagonal(gap, np.inf)
+    return gap.min()
+
+def test_charts_fit_in_unit_square_without_overlapping():
+    vertices, loop_vertices, loop_start, loop_total = asteroid_loops()
+    uvs, chart = unwrap(vertices, loop_vertices, loop_start, loop_total, margin=0.05)
+
+    assert uvs.shape == (len(loop_vertices), 2)
+    assert (uvs >= 0).all() and (uvs <= 1).all()
+    assert chart.max() > 0
+
+    # Each chart sits in its own box, with the margin on both sides of it
+    # between it and the next
+    low, high = bounding_boxes(uvs, np.repeat(chart, loop_total))
+    assert smallest_gap(low, high) > 0
+
+    # Charts are flattened along their own normal, which every polygon in
+    # them faces within the angle limit of, so nothing is flipped over
+    uv_corners = uvs.reshape(-1, 3, 2)
+    e1, e2 = uv_corners[:, 1] - uv_corners[:, 0], uv_corners[:, 2] - uv_corners[:, 0]
+    assert (e1[:, 0] * e2[:, 1] - e1[:, 1] * e2[:, 0] > 0).all()
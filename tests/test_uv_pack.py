@@ -0,0 +1,53 @@
+import os, sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts"))
+
+from metaball_sampler import sample_metaball_elements
+from polygonize import polygonize_metaball
+from unwrap import unwrap
+from uv_pack import pack_uvs, uv_islands, uv_utilization
+
+# A sampled asteroid, unwrapped, as MeshBuffers-style arrays
+def unwrapped_asteroid(seed=3, resolution=0.2):
+    vertices, faces = polygonize_metaball(sample_metaball_elements([seed]), resolution=resolution)
+    loop_vertices, loop_start, loop_total = faces.ravel(), np.arange(0, faces.size, 3), np.full(len(faces), 3)
+    uvs, chart = unwrap(vertices, loop_vertices, loop_start, loop_total)
+    return loop_vertices, loop_start, loop_total, uvs
+
+def test_islands_are_packed_apart_inside_unit_square():
+    loop_vertices, loop_start, loop_total, uvs = unwrapped_asteroid()
+    texture_size, padding = 256, 4
+
+    packed, utilization = pack_uvs(loop_vertices, loop_start, loop_total, uvs,
+        texture_size=texture_size, padding=padding)
+
+    assert (packed >= 0).all() and (packed <= 1).all()
+    assert np.isclose(utilization, uv_utilization(packed, loop_start, loop_total))
+    assert utilization > uv_utilization(uvs, loop_start, loop_total)
+
+    # The islands are the same ones as before, and each one's bounding box
+    # is at least 'padding' pixels from every other one
+    islands = uv_islands(loop_vertices, loop_start, loop_total, packed)
+    assert np.array_equal(islands, uv_islands(loop_vertices, loop_start, loop_total, uvs))
+
+    loop_island = np.repeat(islands, loop_total)
+    count = islands.max() + 1
+    low = np.full((count, 2), np.inf)
+    high = np.full((count, 2), -np.inf)
+    np.minimum.at(low, loop_island, packed)
+    np.maximum.at(high, loop_island, packed)
+
+    gap_x = np.maximum(low[:, None, 0] - high[None, :, 0], low[None, :, 0] - high[:, None, 0])
+    gap_y = np.maximum(low[:, None, 1] - high[None, :, 1], low[None, :, 1] - high[:, None, 1])
+    gap = np.maximum(gap_x, gap_y)
+    np.fill_diagonal(gap, np.inf)
+    assert gap.min() * texture_size >= padding - 1e-6
+
+    # Packing keeps every island's shape, only moving (and maybe turning) it
+    corners = packed.reshape(-1, 3, 2)
+    before = uvs.reshape(-1, 3, 2)
+    def lengths(c):
+        return np.linalg.norm(c[:, [1, 2, 0]] - c, axis=2)
+    ratio = lengths(corners).sum() / lengths(before).sum()
+    assert np.allclose(lengths(corners), lengths(before) * ratio, atol=1e-9)